@@ -0,0 +1,6 @@
+# coding: utf-8
+"""Benchmarks for django_recommend's hot paths.
+
+Run them with ``python -m benchmarks.run --help``.
+
+"""
@@ -0,0 +1,63 @@
+# coding: utf-8
+"""Generate synthetic users x items datasets with power-law popularity.
+
+Item popularity follows a Zipf distribution: the item of rank r is picked
+with probability proportional to 1 / r ** exponent. How many items each user
+rates is Zipf-distributed too, so a few users have long histories and most
+have short ones, as on a real site.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bisect
+import random
+
+
+class ZipfSampler(object):  # pylint: disable=too-few-public-methods
+    """Draw ranks 0 to size - 1, weighted by 1 / (rank + 1) ** exponent."""
+
+    def __init__(self, size, exponent, rand):
+        weights = [1 / (rank + 1) ** exponent for rank in range(size)]
+        self.cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+        self.rand = rand
+
+    def sample(self):
+        """Draw one rank."""
+        point = self.rand.random() * self.cumulative[-1]
+        return bisect.bisect_right(self.cumulative, point)
+
+
+def generate(users, items, max_ratings=50, exponent=1.1, favorite_rate=0.2,
+             seed=0):
+    """Generate implicit-feedback scores for users x items.
+
+    Each user views between 1 and max_ratings distinct items, and favorites
+    each viewed item with probability favorite_rate. Views score 1 and
+    favorites score 5, like the simplerec demo app.
+
+    Returns a list of (user index, item index, score) tuples. The same
+    arguments always give the same dataset.
+
+    """
+    rand = random.Random(seed)
+    item_sampler = ZipfSampler(items, exponent, rand)
+    length_sampler = ZipfSampler(min(max_ratings, items), exponent, rand)
+
+    rows = []
+    for user in range(users):
+        wanted = length_sampler.sample() + 1
+        rated = set()
+        # Popular items come up again and again, so give up eventually.
+        for _ in range(wanted * 10):
+            if len(rated) == wanted:
+                break
+            rated.add(item_sampler.sample())
+        for item in sorted(rated):
+            score = 5 if rand.random() < favorite_rate else 1
+            rows.append((user, item, score))
+    return rows
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""Run the benchmark suite on a fresh SQLite database and print a report.
+
+Usage: python -m benchmarks.run [--users N] [--items N] [--output FILE]
+
+The report is JSON. Compare reports from before and after a change, with the
+same arguments, to spot regressions in wall time or query counts.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import os.path
+import sys
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def setup_django(database):
+    """Configure a minimal project with the quotes app, and migrate it."""
+    sys.path.append(os.path.join(REPO_ROOT, 'simplerec'))
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': database}},
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+
+            'django_recommend',
+
+            'quotes',
+        ),
+        RECOMMEND_ENABLE_AUTOCALC=False,
+    )
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def parse_args(argv):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--max-ratings', type=int, default=30,
+                        help='most items one user rates')
+    parser.add_argument('--exponent', type=float, default=1.1,
+                        help='Zipf exponent for item popularity')
+    parser.add_argument('--calls', type=int, default=50,
+                        help='times to call each operation')
+    parser.add_argument('--update-calls', type=int, default=3,
+                        help='times to call update_similarity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default=':memory:',
+                        help='SQLite database file (default: in memory)')
+    parser.add_argument('--output', help='write the report here, not stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the suite with command line arguments."""
+    args = parse_args(argv)
+    setup_django(args.database)
+
+    from . import suite
+    report = suite.run(users=args.users, items=args.items,
+                       max_ratings=args.max_ratings, exponent=args.exponent,
+                       calls=args.calls, update_calls=args.update_calls,
+                       seed=args.seed)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
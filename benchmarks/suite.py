@@ -0,0 +1,164 @@
+# coding: utf-8
+"""Time django_recommend operations against a generated dataset.
+
+run() expects Django to be set up, with django_recommend and the simplerec
+quotes app installed and migrated. Each operation is called several times;
+the report records its wall time and the queries it ran.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import platform
+import random
+import time
+
+import django
+import django.db
+from django.contrib.contenttypes.models import ContentType
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext, override_settings
+
+import django_recommend
+import django_recommend.conf
+import django_recommend.rebuild
+import django_recommend.tasks
+import quotes.models
+from django_recommend.models import UserScore
+
+from . import datasets
+
+
+FILTER_TEMPLATE = (
+    '{% load django_recommend %}'
+    '{% for sim in obj|similar_objects %}{{ sim.pk }} {% endfor %}')
+
+
+def load_dataset(rows, items):
+    """Store a generated dataset as quotes and UserScores.
+
+    Returns the list of quotes, indexed like the dataset's items.
+
+    """
+    quotes.models.Quote.objects.bulk_create(
+        quotes.models.Quote(content='Benchmark quote {}'.format(item))
+        for item in range(items))
+    quote_list = list(quotes.models.Quote.objects.filter(
+        content__startswith='Benchmark quote ').order_by('pk'))
+    ctype = ContentType.objects.get_for_model(quotes.models.Quote)
+    UserScore.objects.bulk_create(
+        (UserScore(user='bench:{}'.format(user), object_content_type=ctype,
+                   object_id=quote_list[item].pk, score=score)
+         for user, item, score in rows),
+        batch_size=500)
+    return quote_list
+
+
+def measure(func, args_list):
+    """Call func once per args tuple, timing each call.
+
+    Returns a dict of statistics, in milliseconds and queries.
+
+    """
+    connection = django.db.connection
+    # The query log normally keeps the last 9000 queries, which a single
+    # update_similarity() call can exceed.
+    queries_log = connection.queries_log
+    connection.queries_log = collections.deque()
+    durations = []
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            for args in args_list:
+                started = time.time()
+                func(*args)
+                durations.append((time.time() - started) * 1000)
+        query_count = len(queries)
+    finally:
+        connection.queries_log = queries_log
+    durations.sort()
+    calls = len(durations)
+    return {
+        'calls': calls,
+        'total_ms': sum(durations),
+        'mean_ms': sum(durations) / calls,
+        'median_ms': durations[calls // 2],
+        'max_ms': durations[-1],
+        'queries': query_count,
+        'queries_per_call': query_count / calls,
+    }
+
+
+def run(users=200, items=100, max_ratings=20, exponent=1.1, calls=20,
+        update_calls=3, seed=0):
+    """Generate a dataset, load it, and time each operation on it.
+
+    Each operation is called calls times, except update_similarity, which is
+    much slower and is called update_calls times. Returns the report as a
+    dict that can be dumped as JSON.
+
+    """
+    rows = datasets.generate(users, items, max_ratings, exponent, seed=seed)
+    rand = random.Random(seed)
+
+    with override_settings(RECOMMEND_ENABLE_AUTOCALC=False):
+        quote_list = load_dataset(rows, items)
+        django_recommend.rebuild.rebuild()
+
+        # Popular items are the ones requested most, so pick by popularity.
+        sampler = datasets.ZipfSampler(items, exponent, rand)
+        targets = [quote_list[sampler.sample()] for _ in range(calls)]
+        new_users = ['bench:new:{}'.format(i) for i in range(calls)]
+        # Users of their own, so setdefault_score inserts instead of finding
+        # the scores set_score wrote.
+        default_users = ['bench:default:{}'.format(i) for i in range(calls)]
+
+        template = Template(FILTER_TEMPLATE)
+
+        def render_filter(obj):
+            """Render the similar_objects template filter for obj."""
+            return template.render(Context({'obj': obj}))
+
+        operations = [
+            ('set_score', django_recommend.set_score,
+             [(user, obj, 5) for user, obj in zip(new_users, targets)]),
+            ('setdefault_score', django_recommend.setdefault_score,
+             [(user, obj, 1) for user, obj in zip(default_users, targets)]),
+            ('update_similarity', django_recommend.tasks.update_similarity,
+             [(obj,) for obj in targets[:update_calls]]),
+            ('similar_to', lambda obj: list(django_recommend.similar_to(obj)),
+             [(obj,) for obj in targets]),
+            ('get_instances_for',
+             lambda obj: django_recommend.similar_to(obj).get_instances_for(
+                 obj),
+             [(obj,) for obj in targets]),
+            ('similar_objects_filter', render_filter,
+             [(obj,) for obj in targets]),
+        ]
+        results = {name: measure(func, args_list)
+                   for name, func, args_list in operations}
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': django.db.connection.vendor,
+        },
+        'dataset': {
+            'users': users,
+            'items': items,
+            'max_ratings': max_ratings,
+            'exponent': exponent,
+            'seed': seed,
+            'scores': len(rows),
+        },
+        'settings': {
+            name: getattr(django_recommend.conf.settings, name)
+            for name in ('RECOMMEND_SIMILARITY_ENGINE',
+                         'RECOMMEND_RECOMPUTE',
+                         'RECOMMEND_BUFFER_RESULTS',
+                         'RECOMMEND_SIMILARITY_LAYOUT',
+                         'RECOMMEND_NEIGHBOR_CACHE')
+        },
+        'operations': results,
+    }
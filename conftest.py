@@ -7,6 +7,8 @@ from django.conf import settings
 import os.path
 import sys
 
+import pytest
+
 
 REPO_ROOT = os.path.realpath(os.path.dirname(__file__))
 TESTPROJ_ROOT = os.path.join(REPO_ROOT, 'simplerec')
@@ -39,3 +41,11 @@ def pytest_configure():
         SESSION_SAVE_EVERY_REQUEST=True,
         RECOMMEND_ENABLE_AUTOCALC=False,
     )
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Don't let cached data leak from one test into another."""
+    yield
+    from django.core.cache import cache
+    cache.clear()
@@ -24,9 +24,12 @@ setup(
     package_dir={'': 'src'},
     packages=[
         'django_recommend',
+        'django_recommend.management',
+        'django_recommend.management.commands',
         'django_recommend.migrations',
         'django_recommend.templatetags',
     ],
     install_requires=['django', 'pyrecommend'],
+    extras_require={'numpy': ['numpy', 'scipy']},
     setup_requires=['wheel'],
 )
@@ -36,6 +36,12 @@ class Quote(models.Model):
         """Check if user has favorited this quote."""
         return django_recommend.get_score(user, self) == 5
 
+    @staticmethod
+    def favorited_among(user, quotes):
+        """Get the set of quotes user has favorited, using one query."""
+        scores = django_recommend.get_scores(user, quotes)
+        return {quote for quote, score in scores.items() if score == 5}
+
     def mark_favorite_for(self, user):
         """Mark this as a favorite quote for user."""
         django_recommend.set_score(user, self, 5)
@@ -14,6 +14,18 @@ class QuoteIndex(generic.ListView):
     """Show all quotes in the system."""
     queryset = models.Quote.objects.all()
 
+    def get_context_data(self, **kwargs):
+        context = super(QuoteIndex, self).get_context_data(**kwargs)
+        quotes = context['object_list']
+        user = self.request.user
+        if user.is_authenticated():
+            favorites = models.Quote.favorited_among(user, quotes)
+        else:
+            favorites = set()
+        for quote in quotes:
+            quote.is_favorited = quote in favorites
+        return context
+
 
 class QuoteDetail(generic.DetailView):
     """Show a single quote."""
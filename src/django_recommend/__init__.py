@@ -64,12 +64,56 @@ def setdefault_score(request_or_user, obj, score):
         return models.UserScore.setdefault(user, obj, score)
 
 
+def set_scores(request_or_user, scores):
+    """Set the scores for many objects at once.
+
+    scores is an iterable of (obj, score) pairs. This has the same effect as
+    calling set_score() for each pair, but writes in bulk, skips scores that
+    didn't change, and queues one similarity update per changed object at the
+    end.
+
+    """
+    from . import models
+    user = __user_from_request(request_or_user)
+    if user is NO_SESSION_KEY:
+        LOG.warning(BLANK_SESSION_WARNING)
+    else:
+        return models.UserScore.set_many(user, scores)
+
+
+def setdefault_scores(request_or_user, scores):
+    """Set the scores for many objects, skipping objects already scored.
+
+    scores is an iterable of (obj, score) pairs. This has the same effect as
+    calling setdefault_score() for each pair, but writes in bulk, like
+    set_scores().
+
+    """
+    from . import models
+    user = __user_from_request(request_or_user)
+    if user is NO_SESSION_KEY:
+        LOG.warning(BLANK_SESSION_WARNING)
+    else:
+        return models.UserScore.setdefault_many(user, scores)
+
+
 def scores_for(obj):
     """Get all scores for the given object."""
     from . import models
     return models.UserScore.scores_for(obj)
 
 
+def scores_for_many(objs):
+    """Get all scores for each of the given objects.
+
+    Returns a dictionary of {obj: {user: score}}, like calling scores_for()
+    for each object, but with a single query.
+
+    """
+    from . import models
+    return models.UserScore.scores_for_many(objs)
+
+
 def get_score(request_or_user, obj):
     """Get a user's score for the given object."""
     from . import models
@@ -77,23 +121,84 @@ def get_score(request_or_user, obj):
     return models.UserScore.get(user, obj)
 
 
+def get_scores(request_or_user, objs):
+    """Get a user's scores for each of the given objects.
+
+    Returns a dictionary of {obj: score}, like calling get_score() for each
+    object, but with a single query. Unrated objects get a score of 0.
+
+    """
+    from . import models
+    user = __user_from_request(request_or_user)
+    return models.UserScore.get_many(user, objs)
+
+
 def similar_objects(obj):
     """Get objects most similar to obj.
 
     Returns an iterator, not a collection.
 
+    With RECOMMEND_NEIGHBOR_INDEX set, the neighbor list is read from that
+    index file (see the neighbor_index module). Otherwise, with
+    RECOMMEND_MEMORY_INDEX on, it comes from this process's in-memory index
+    (see the memory_index module), and holds at most
+    RECOMMEND_MEMORY_INDEX_SIZE objects. Otherwise, with
+    RECOMMEND_NEIGHBOR_CACHE on, it comes from the cache when possible, and
+    holds at most RECOMMEND_NEIGHBOR_CACHE_SIZE objects.
+
     """
+    from . import memory_index
+    from . import models
+    from . import neighbor_cache
+    from . import neighbor_index
+    index = neighbor_index.get_index()
+    if index is None:
+        index = memory_index.get_index()
+    if index is not None:
+        neighbors = index.get_neighbors(models.object_key(obj))
+        return models.get_instances(
+            [(ctype_id, obj_id) for ctype_id, obj_id, _ in neighbors])
+    if neighbor_cache.is_enabled():
+        neighbors = neighbor_cache.get_neighbors(obj)
+        return models.get_instances(
+            [(ctype_id, obj_id) for ctype_id, obj_id, _ in neighbors])
     return similar_to(obj).get_instances_for(obj)
 
 
+def recommend_for_user(request_or_user, n, model=None):
+    """Get up to n objects to recommend to a user, best first.
+
+    Objects are ranked by their similarity to everything the user has scored,
+    weighted by the user's scores. Objects the user has already scored are
+    left out. If model is given, only instances of that model are returned.
+
+    Uses a fixed number of queries, however many objects the user has scored.
+    Anonymous users without a session key get no recommendations.
+
+    """
+    from . import models
+    user = __user_from_request(request_or_user)
+    if user is NO_SESSION_KEY:
+        return []
+    return models.UserScore.recommend_for(user, n, model)
+
+
 def similar_to(obj):
     """Get a queryset of similarity scores most similar to obj.
 
     This can allow you to use methods of the ObjectSimilarityQueryset, such as
     exclude_objects, as well as normal queryset slicing.
 
+    With RECOMMEND_SIMILARITY_LAYOUT = 'symmetric', this only matches rows
+    with obj as object_1, which one index range scan returns in score order.
+
     """
     from . import models
+    if models.is_symmetric():
+        ctype_id, obj_id = models.object_key(obj)
+        return models.ObjectSimilarity.objects.filter(
+            object_1_content_type=ctype_id, object_1_id=obj_id
+        ).order_by('-score')
     obj_qset = type(obj).objects.filter(pk=obj.pk)
     high_similarity = models.ObjectSimilarity.objects.filter_objects(obj_qset)
     high_similarity = high_similarity.order_by('-score')
@@ -107,11 +212,65 @@ def forget_object(obj_content_type, obj_id):
 
     """
     from django.db.models import Q
+    from . import memory_index
     from . import models
+    from . import neighbor_cache
     models.UserScore.objects.filter(
         object_id=obj_id, object_content_type=obj_content_type
     ).delete()
-    models.ObjectSimilarity.objects.filter(
+    sims = models.ObjectSimilarity.objects.filter(
         Q(object_1_content_type=obj_content_type, object_1_id=obj_id) |
         Q(object_2_content_type=obj_content_type, object_2_id=obj_id)
-    ).delete()
+    )
+    if neighbor_cache.is_enabled() or memory_index.is_enabled():
+        # The neighbors' lists mention this object, too.
+        ctype_id = getattr(obj_content_type, 'pk', obj_content_type)
+        stale = [(ctype_id, obj_id)]
+        for ctype_1, id_1, ctype_2, id_2 in sims.values_list(
+                'object_1_content_type', 'object_1_id',
+                'object_2_content_type', 'object_2_id'):
+            stale.extend([(ctype_1, id_1), (ctype_2, id_2)])
+        sims.delete()
+        neighbor_cache.invalidate(stale)
+        memory_index.record_changes(stale)
+    else:
+        sims.delete()
+
+
+def aset_score(request_or_user, obj, score):
+    """Awaitable version of set_score(), for async views.
+
+    The write, and the similarity update its signal queues, run in the
+    django_recommend.aio thread pool, not on the event loop.
+
+    """
+    from . import aio
+    return aio.run(set_score, request_or_user, obj, score)
+
+
+def asetdefault_score(request_or_user, obj, score):
+    """Awaitable version of setdefault_score(), for async views."""
+    from . import aio
+    return aio.run(setdefault_score, request_or_user, obj, score)
+
+
+def aget_score(request_or_user, obj):
+    """Awaitable version of get_score(), for async views."""
+    from . import aio
+    return aio.run(get_score, request_or_user, obj)
+
+
+def ascores_for(obj):
+    """Awaitable version of scores_for(), for async views."""
+    from . import aio
+    return aio.run(scores_for, obj)
+
+
+def asimilar_objects(obj):
+    """Awaitable version of similar_objects(), for async views.
+
+    Resolves to a list, since the objects are loaded in the thread pool.
+
+    """
+    from . import aio
+    return aio.run(lambda: list(similar_objects(obj)))
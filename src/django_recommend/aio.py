@@ -0,0 +1,56 @@
+# coding: utf-8
+"""Run this app's database work off the asyncio event loop.
+
+The a*() functions in django_recommend hand their synchronous counterparts
+to a bounded thread pool of RECOMMEND_ASYNC_THREADS workers, and return an
+awaitable future. Old database connections are closed around each call, as
+Django does around each request.
+
+Requires Python 3 (asyncio and concurrent.futures).
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+
+import django.db
+
+from .conf import settings
+
+
+_EXECUTOR = None
+
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor():
+    """Get the thread pool shared by the async API, creating it if needed."""
+    global _EXECUTOR  # pylint: disable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            from concurrent import futures
+            _EXECUTOR = futures.ThreadPoolExecutor(
+                max_workers=settings.RECOMMEND_ASYNC_THREADS)
+    return _EXECUTOR
+
+
+def call_in_worker(func, *args):
+    """Call func(*args) in a pool thread, managing its DB connection."""
+    django.db.close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        django.db.close_old_connections()
+
+
+def run(func, *args):
+    """Schedule func(*args) on the thread pool.
+
+    Returns an asyncio future for its result, bound to the current event
+    loop.
+
+    """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(get_executor(), call_in_worker, func, *args)
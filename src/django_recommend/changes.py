@@ -0,0 +1,42 @@
+# coding: utf-8
+"""The SimilarityChange model, which the in-memory neighbor index reads."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db import router
+from django.utils.encoding import python_2_unicode_compatible
+
+from .models import MAX_QUERY_PARAMS, NO_RELATED_NAME
+
+
+@python_2_unicode_compatible
+class SimilarityChange(models.Model):
+    """A note that an object's neighbor list changed.
+
+    Recorded with RECOMMEND_MEMORY_INDEX on, so every process's in-memory
+    neighbor index (see the memory_index module) can reload the lists that
+    changed since the last change it saw.
+
+    """
+    object_id = models.IntegerField()
+    object_content_type = models.ForeignKey(ContentType,
+                                            related_name=NO_RELATED_NAME)
+    object = GenericForeignKey('object_content_type', 'object_id')
+
+    changed = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @classmethod
+    def record(cls, keys):
+        """Record changes to the neighbors of (content type ID, ID) keys."""
+        db_alias = router.db_for_write(cls)
+        cls.objects.using(db_alias).bulk_create(
+            (cls(object_content_type_id=ctype_id, object_id=obj_id)
+             for ctype_id, obj_id in sorted(set(keys))),
+            batch_size=MAX_QUERY_PARAMS // 3)
+
+    def __str__(self):
+        return '{}, {}: {}'.format(self.object_content_type_id,
+                                   self.object_id, self.changed)
@@ -4,6 +4,7 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import django.conf
+from django.core import cache
 
 
 class DefaultSettingsProxy(object):  # pylint: disable=too-few-public-methods
@@ -15,6 +16,56 @@ class DefaultSettingsProxy(object):  # pylint: disable=too-few-public-methods
 
     RECOMMEND_USE_CELERY = True
 
+    RECOMMEND_SIMILARITY_ENGINE = 'pyrecommend'
+
+    RECOMMEND_RECOMPUTE = 'neighborhood'
+
+    RECOMMEND_BUFFER_RESULTS = False
+
+    RECOMMEND_CACHE = 'default'
+
+    RECOMMEND_COALESCE_WINDOW = 0
+
+    RECOMMEND_MAX_NEIGHBORS = None
+
+    RECOMMEND_MAX_NEIGHBORS_PER_MODEL = {}
+
+    RECOMMEND_NEIGHBOR_CACHE = False
+
+    RECOMMEND_NEIGHBOR_CACHE_SIZE = 100
+
+    RECOMMEND_NEIGHBOR_CACHE_TIMEOUT = 60 * 60
+
+    RECOMMEND_NEIGHBOR_INDEX = None
+
+    RECOMMEND_MEMORY_INDEX = False
+
+    RECOMMEND_MEMORY_INDEX_SIZE = 100
+
+    RECOMMEND_MEMORY_INDEX_REFRESH = 60
+
+    RECOMMEND_MEMORY_INDEX_CHANGES_KEEP = 24 * 60 * 60
+
+    RECOMMEND_SHADOW_REBUILD_TIMEOUT = 24 * 60 * 60
+
+    RECOMMEND_ASYNC_THREADS = 4
+
+    RECOMMEND_SIMILARITY_LAYOUT = 'pairs'
+
+    RECOMMEND_INCREMENTAL = False
+
+    RECOMMEND_NATIVE_UPSERT = False
+
+    RECOMMEND_INSTRUMENTATION_SINKS = ()
+
+    RECOMMEND_STATS_PUBLISH_INTERVAL = 60
+
+    RECOMMEND_PROFILE_DIR = None
+
+    RECOMMEND_PROFILE_SAMPLE_RATE = 0
+
+    RECOMMEND_PROFILE_THRESHOLD = None
+
     def __getattribute__(self, attr_name):
         try:
 
@@ -28,3 +79,8 @@ class DefaultSettingsProxy(object):  # pylint: disable=too-few-public-methods
 
 
 settings = DefaultSettingsProxy()  # pylint: disable=invalid-name
+
+
+def get_cache():
+    """Get the Django cache named by the RECOMMEND_CACHE setting."""
+    return cache.caches[settings.RECOMMEND_CACHE]
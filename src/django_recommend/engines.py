@@ -0,0 +1,113 @@
+# coding: utf-8
+"""Similarity engines that fill a result storage from an ObjectData set.
+
+An engine is a callable taking (dataset, result_storage). It must store the
+similarity of every pair of objects in the dataset, the same way
+pyrecommend.calculate_similarity() does.
+
+With RECOMMEND_RECOMPUTE = 'star', update_similarity() runs star_engine()
+instead, which only stores the similarities between the dataset's object and
+each of the others.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import pyrecommend
+import pyrecommend.similarity
+from django.core.exceptions import ImproperlyConfigured
+
+from . import models
+from .conf import settings
+
+# NumPy and SciPy are optional; only the 'numpy' engine needs them.
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # pragma: no cover
+    numpy = sparse = None
+
+
+def pyrecommend_engine(dataset, result_storage):
+    """Calculate dot product similarity pair by pair with pyrecommend."""
+    sim_func = pyrecommend.similarity.dot_product
+    pyrecommend.calculate_similarity(dataset, sim_func, result_storage)
+
+
+def numpy_engine(dataset, result_storage):
+    """Calculate dot product similarity with one sparse matrix product.
+
+    All scores for the objects in dataset (which ObjectData prefetches while
+    being iterated) go into a users x objects matrix M; M.T * M then holds
+    the dot product of every pair of objects.
+
+    """
+    if sparse is None:  # pragma: no cover
+        raise ImproperlyConfigured(
+            "The 'numpy' similarity engine requires numpy and scipy.")
+
+    items = list(dataset)
+
+    user_rows = {}
+    row_idx, col_idx, values = [], [], []
+    for col, item in enumerate(items):
+        for user, score in dataset[item].items():
+            row_idx.append(user_rows.setdefault(user, len(user_rows)))
+            col_idx.append(col)
+            values.append(score)
+
+    matrix = sparse.csc_matrix(
+        (numpy.array(values, dtype=numpy.float64), (row_idx, col_idx)),
+        shape=(len(user_rows), len(items)))
+    products = (matrix.T * matrix).tocsr()
+
+    for i, item_a in enumerate(items):
+        row = products.getrow(i).toarray()[0]
+        for j in range(i + 1, len(items)):
+            result_storage[(item_a, items[j])] = float(row[j])
+
+
+def star_engine(dataset, result_storage):
+    """Calculate dot product similarity between dataset.obj and the others.
+
+    One score change only changes the similarities of the object it's for,
+    so the pairs between its neighbors are left alone. Only the scores of
+    the users who rated dataset.obj are loaded.
+
+    """
+    scores = dataset.star_scores()
+    own_scores = scores.pop(models.object_key(dataset.obj), {})
+    for other in models.get_instances(sorted(scores)):
+        other_scores = scores[models.object_key(other)]
+        result_storage[(dataset.obj, other)] = sum(
+            own_scores[user] * score for user, score in other_scores.items())
+
+
+ENGINES = {
+    'pyrecommend': pyrecommend_engine,
+    'numpy': numpy_engine,
+}
+
+
+def get_engine(name):
+    """Get the engine registered under name."""
+    try:
+        return ENGINES[name]
+    except KeyError:
+        msg = 'Unknown RECOMMEND_SIMILARITY_ENGINE {!r}; choose from: {}'
+        raise ImproperlyConfigured(
+            msg.format(name, ', '.join(sorted(ENGINES))))
+
+
+RECOMPUTE_MODES = ('neighborhood', 'star')
+
+
+def get_update_engine():
+    """Get the engine update_similarity() runs, per RECOMMEND_RECOMPUTE."""
+    mode = settings.RECOMMEND_RECOMPUTE
+    if mode == 'star':
+        return star_engine
+    if mode == 'neighborhood':
+        return get_engine(settings.RECOMMEND_SIMILARITY_ENGINE)
+    msg = 'Unknown RECOMMEND_RECOMPUTE {!r}; choose from: {}'
+    raise ImproperlyConfigured(msg.format(mode, ', '.join(RECOMPUTE_MODES)))
@@ -0,0 +1,31 @@
+# coding: utf-8
+"""The SimilarityGeneration model, for shadow-table rebuilds."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+
+from .models import ObjectSimilarity
+
+
+@python_2_unicode_compatible
+class SimilarityGeneration(models.Model):
+    """One shadow-table rebuild of ObjectSimilarity (see the rebuild module).
+
+    A generation's similarities are written to their own table, which is
+    renamed to ObjectSimilarity's table once it's complete. A generation
+    that's still unfinished long after it started marks a table left behind
+    by a rebuild that died.
+
+    """
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    similarities = models.IntegerField(default=0)
+
+    def table_name(self):
+        """Get the name of the table this generation is written to."""
+        return '{}_g{}'.format(ObjectSimilarity._meta.db_table, self.pk)
+
+    def __str__(self):
+        return '{}: {}'.format(self.pk, self.finished or 'unfinished')
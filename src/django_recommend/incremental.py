@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Keep similarities up to date by applying score changes as deltas.
+
+With RECOMMEND_INCREMENTAL = True, changing a UserScore doesn't queue a
+full update_similarity() run. The stored similarity of two objects is the
+dot product of their scores, so when a user's score for x goes from old to
+new, the similarity of x and each other object y the user has scored moves
+by new * score_y - old * score_y. Those deltas, and the change of
+new ** 2 - old ** 2 to x's ObjectNorm, are written right away, in the same
+transaction as the score. A write costs O(objects the user has scored).
+
+This only keeps the stored similarities exact if they were exact to begin
+with, so run recommend_rebuild (which also fills ObjectNorm) when turning
+it on. Neighbor limits drop similarities, so they can't be used with it.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import signals as model_signals
+
+from . import models
+from . import pruning
+from .conf import settings
+
+
+# (user, key) pairs of scores whose deletion has been applied, but which are
+# still in the database, because the rest of their batch is being handled.
+_DELETING = threading.local()
+
+
+def is_enabled():
+    """Check whether incremental mode is turned on."""
+    if not settings.RECOMMEND_INCREMENTAL:
+        return False
+    if pruning.is_enabled():
+        raise ImproperlyConfigured(
+            'RECOMMEND_INCREMENTAL cannot be used with RECOMMEND_MAX_NEIGHBORS'
+            ' or RECOMMEND_MAX_NEIGHBORS_PER_MODEL.')
+    return True
+
+
+def score_deltas(changes, current):
+    """Work out how one user's score changes move similarities and norms.
+
+    changes maps (content type ID, object ID) keys to (old score, new score)
+    tuples. current maps keys to the user's other scores.
+
+    Returns a dict of {(key_1, key_2): delta} for ObjectSimilarity and a
+    dict of {key: delta} for ObjectNorm.
+
+    """
+    old_scores = dict(current)
+    new_scores = dict(current)
+    for key, (old_score, new_score) in changes.items():
+        old_scores[key] = old_score
+        new_scores[key] = new_score
+
+    sim_deltas = {}
+    for key in changes:
+        for other_key in new_scores:
+            # Pairs of two changed objects are only counted once.
+            if other_key == key or (other_key in changes and other_key < key):
+                continue
+            delta = (new_scores[key] * new_scores[other_key] -
+                     old_scores[key] * old_scores[other_key])
+            if delta:
+                sim_deltas[pruning.pair_of(key, other_key)] = delta
+
+    norm_deltas = {}
+    for key, (old_score, new_score) in changes.items():
+        delta = new_score ** 2 - old_score ** 2
+        if delta:
+            norm_deltas[key] = delta
+    return sim_deltas, norm_deltas
+
+
+def apply_changes(user, changes, deleted=()):
+    """Update similarities and norms for changes to user's scores.
+
+    user is a user string as stored in UserScore. changes maps keys to (old
+    score, new score) tuples, with 0 for no score. Call this after writing
+    the new scores, inside the same transaction. Stored scores with keys in
+    deleted are treated as already gone.
+
+    """
+    changes = {key: scores for key, scores in changes.items()
+               if scores[0] != scores[1]}
+    if not changes:
+        return
+    current = {(ctype_id, obj_id): score for ctype_id, obj_id, score in
+               models.UserScore.objects.filter(user=user).values_list(
+                   'object_content_type', 'object_id', 'score')
+               if (ctype_id, obj_id) not in deleted}
+    sim_deltas, norm_deltas = score_deltas(changes, current)
+    if sim_deltas:
+        models.ObjectSimilarity.add_many(sim_deltas)
+    if norm_deltas:
+        models.ObjectNorm.add_many(norm_deltas)
+
+
+def stored_score(user_score, using):
+    """Get user_score's score as stored in the database, or 0 if it isn't.
+
+    The row is locked until the end of the transaction, so the score can't
+    change before the deltas for replacing it are applied.
+
+    """
+    if user_score.pk is None:
+        return 0
+    scores = models.UserScore.objects.using(using).select_for_update(
+    ).filter(pk=user_score.pk).values_list('score', flat=True)
+    for score in scores:
+        return score
+    return 0
+
+
+def handle_signal(signal, user_score, using):
+    """Apply the change a UserScore is making, given its model signal.
+
+    Saves are applied on post_save, with the replaced score UserScore.save()
+    read. Deletes are applied on pre_delete, since by post_delete the other
+    scores deleted in the same batch are gone too, and the similarities
+    between them would be missed. Either way, the deltas are written in the
+    same transaction as the score.
+
+    """
+    user = user_score.user
+    key = user_score.object_content_type_id, user_score.object_id
+    if not hasattr(_DELETING, 'scores'):
+        _DELETING.scores = set()
+
+    if signal is model_signals.post_save:
+        with transaction.atomic(using=using):
+            apply_changes(
+                user, {key: (user_score.saved_score, user_score.score)})
+        user_score.saved_score = user_score.score
+    elif signal is model_signals.pre_delete:
+        deleted = {other_key for other_user, other_key in _DELETING.scores
+                   if other_user == user}
+        with transaction.atomic(using=using):
+            old_score = stored_score(user_score, using)
+            apply_changes(user, {key: (old_score, 0)}, deleted)
+        _DELETING.scores.add((user, key))
+    elif signal is model_signals.post_delete:
+        _DELETING.scores.discard((user, key))
+        user_score.saved_score = 0
@@ -0,0 +1,273 @@
+# coding: utf-8
+"""Record timings and counts for the hot paths.
+
+Wrap an operation in measure() to record how long it took, how many queries
+it ran on each database, and anything it counts (pairs computed, rows
+written, ...). Each finished Measurement is passed to every sink listed in
+RECOMMEND_INSTRUMENTATION_SINKS:
+
+'log'
+    logs one INFO line per measurement, on this module's logger.
+
+'aggregate'
+    adds it to per-operation totals kept in this process. Every
+    RECOMMEND_STATS_PUBLISH_INTERVAL seconds, the totals are copied to the
+    RECOMMEND_CACHE cache, where the recommend_stats command reads them.
+
+Any other entry is a callable, or the dotted path of one, which is called
+with the Measurement.
+
+The default is no sinks, and then measure() does nothing. With sinks, every
+query is logged like it is with DEBUG = True, in order to count it.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import logging
+import os
+import socket
+import threading
+import timeit
+
+from django.db import connections
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from . import conf
+from .conf import settings
+
+
+LOG = logging.getLogger(__name__)
+
+# Published totals expire if a process stops publishing for this long.
+STATS_TIMEOUT = 24 * 60 * 60
+
+PROCESSES_KEY = 'django_recommend:stats:processes'
+
+
+Measurement = collections.namedtuple(
+    'Measurement', 'name label seconds queries counts')
+
+
+class QueryCounter(object):
+    """Stands in for a connection's queries_log, counting what's logged."""
+
+    def __init__(self, queries_log):
+        self.queries_log = queries_log
+        self.count = 0
+
+    def append(self, query):
+        """Count query, and log it as usual."""
+        self.count += 1
+        self.queries_log.append(query)
+
+    def __len__(self):
+        return len(self.queries_log)
+
+    def __iter__(self):
+        return iter(self.queries_log)
+
+    def __getattr__(self, name):
+        return getattr(self.queries_log, name)
+
+
+class Recording(object):
+    """Context manager that records one run of an operation; see measure()."""
+
+    def __init__(self, name, label='', sinks=None):
+        self.name = name
+        self.label = label
+        self.counts = collections.Counter()
+        self.given_sinks = sinks
+        self.sinks = []
+        self.saved = []
+        self.started = None
+
+    def count(self, what, num=1):
+        """Add num to the count of what."""
+        self.counts[what] += num
+
+    def __enter__(self):
+        if self.given_sinks is None:
+            self.sinks = get_sinks()
+        else:
+            self.sinks = self.given_sinks
+        if not self.sinks:
+            return self
+        for connection in connections.all():
+            self.saved.append((connection, connection.force_debug_cursor,
+                               connection.queries_log))
+            connection.force_debug_cursor = True
+            connection.queries_log = QueryCounter(connection.queries_log)
+        self.started = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.sinks:
+            return
+        seconds = timeit.default_timer() - self.started
+        queries = 0
+        for connection, force_debug_cursor, queries_log in self.saved:
+            queries += connection.queries_log.count
+            connection.queries_log = queries_log
+            connection.force_debug_cursor = force_debug_cursor
+        self.saved = []
+        if exc_type is not None:
+            self.count('errors')
+
+        measurement = Measurement(self.name, '{}'.format(self.label),
+                                  seconds, queries, dict(self.counts))
+        for sink in self.sinks:
+            try:
+                sink(measurement)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('Instrumentation sink %r failed', sink)
+
+
+def measure(name, label='', sinks=None):
+    """Get a context manager that records one run of the operation name.
+
+    label identifies what the operation worked on, such as an object key,
+    so the slowest runs can be traced back. Call count() on the context
+    manager inside the block to record how many of something it handled::
+
+        with instrumentation.measure('result_storage.flush') as recording:
+            recording.count('rows', write_rows())
+
+    Code that measures many small operations can look the sinks up once
+    with get_sinks() and pass them in.
+
+    """
+    return Recording(name, label, sinks)
+
+
+def get_sinks():
+    """Get the sink callables named by RECOMMEND_INSTRUMENTATION_SINKS."""
+    sinks = []
+    for sink in settings.RECOMMEND_INSTRUMENTATION_SINKS:
+        if isinstance(sink, six.string_types):
+            sink = SINKS[sink] if sink in SINKS else import_string(sink)
+        sinks.append(sink)
+    return sinks
+
+
+def format_key(key):
+    """Format a (content type ID, object ID) key as a measurement label."""
+    return '{}:{}'.format(*key)
+
+
+def log_sink(measurement):
+    """Log measurement."""
+    LOG.info('%s %s: %.1f ms, %d queries, %s', measurement.name,
+             measurement.label, measurement.seconds * 1000,
+             measurement.queries, measurement.counts)
+
+
+def new_totals():
+    """Get the totals for an operation that hasn't run yet."""
+    return {'calls': 0, 'seconds': 0, 'queries': 0, 'max_seconds': 0,
+            'slowest': '', 'counts': {}}
+
+
+def add_totals(totals, other):
+    """Add the totals in other to totals."""
+    totals['calls'] += other['calls']
+    totals['seconds'] += other['seconds']
+    totals['queries'] += other['queries']
+    if other['max_seconds'] > totals['max_seconds']:
+        totals['max_seconds'] = other['max_seconds']
+        totals['slowest'] = other['slowest']
+    for what, num in other['counts'].items():
+        totals['counts'][what] = totals['counts'].get(what, 0) + num
+
+
+class Aggregate(object):
+    """Per-operation totals of the measurements in this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.published = None
+
+    def add(self, measurement):
+        """Add measurement to the totals for its operation."""
+        with self.lock:
+            totals = self.stats.setdefault(measurement.name, new_totals())
+            add_totals(totals, {
+                'calls': 1, 'seconds': measurement.seconds,
+                'queries': measurement.queries,
+                'max_seconds': measurement.seconds,
+                'slowest': measurement.label, 'counts': measurement.counts})
+
+    def snapshot(self):
+        """Get a copy of the totals, as a dict of {name: totals}."""
+        with self.lock:
+            return {name: dict(totals, counts=dict(totals['counts']))
+                    for name, totals in self.stats.items()}
+
+    def reset(self):
+        """Forget all measurements."""
+        with self.lock:
+            self.stats = {}
+
+    def publish_due(self):
+        """Check whether it's time to publish the totals again."""
+        now = timeit.default_timer()
+        interval = settings.RECOMMEND_STATS_PUBLISH_INTERVAL
+        with self.lock:
+            if self.published is not None and now - self.published < interval:
+                return False
+            self.published = now
+            return True
+
+
+AGGREGATE = Aggregate()
+
+
+def process_key():
+    """Get the cache key this process publishes its totals under."""
+    return 'django_recommend:stats:{}:{}'.format(socket.gethostname(),
+                                                 os.getpid())
+
+
+def publish():
+    """Copy this process's totals to the cache, for recommend_stats."""
+    cache = conf.get_cache()
+    key = process_key()
+    cache.set(key, AGGREGATE.snapshot(), STATS_TIMEOUT)
+
+    # Racing processes can drop each other's keys here, but each one adds its
+    # key back the next time it publishes.
+    processes = cache.get(PROCESSES_KEY, [])
+    if key not in processes:
+        cache.set(PROCESSES_KEY, processes + [key], STATS_TIMEOUT)
+
+
+def aggregate_sink(measurement):
+    """Add measurement to this process's totals, publishing them if due."""
+    AGGREGATE.add(measurement)
+    if AGGREGATE.publish_due():
+        publish()
+
+
+def collected_stats():
+    """Get the totals published by all processes, added together.
+
+    Returns a dict of {name: totals}. Processes that haven't published for
+    STATS_TIMEOUT seconds are left out.
+
+    """
+    cache = conf.get_cache()
+    stats = {}
+    for snapshot in cache.get_many(cache.get(PROCESSES_KEY, [])).values():
+        for name, totals in snapshot.items():
+            add_totals(stats.setdefault(name, new_totals()), totals)
+    return stats
+
+
+SINKS = {
+    'log': log_sink,
+    'aggregate': aggregate_sink,
+}
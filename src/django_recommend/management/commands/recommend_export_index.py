@@ -0,0 +1,34 @@
+"""Implementation of the recommend_export_index manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time
+
+from django.core.management import base
+
+from ... import neighbor_index
+from ...conf import settings
+
+
+class Command(base.BaseCommand):
+    """Write all stored similarities to a memory-mappable neighbor index."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', dest='output',
+                            help='Where to write the index. Defaults to '
+                            'RECOMMEND_NEIGHBOR_INDEX.')
+        parser.add_argument('--size', type=int, default=None, dest='size',
+                            help='Most neighbors to keep per object.')
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        path = options['output'] or settings.RECOMMEND_NEIGHBOR_INDEX
+        if not path:
+            raise base.CommandError(
+                'Set RECOMMEND_NEIGHBOR_INDEX, or pass --output.')
+        started = time.time()
+        objects, neighbors = neighbor_index.export(path, size=options['size'])
+        self.stdout.write(
+            'Exported {} neighbors of {} objects to {} in {:.1f}s.'.format(
+                neighbors, objects, path, time.time() - started))
@@ -0,0 +1,42 @@
+"""Implementation of the recommend_profiles manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.core.management import base
+from django.utils.six import StringIO
+
+from ... import profiling
+from ...conf import settings
+
+
+class Command(base.BaseCommand):
+    """Show the hottest functions across the saved update profiles."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', dest='directory',
+                            help='Where the profiles are. Defaults to '
+                            'RECOMMEND_PROFILE_DIR.')
+        parser.add_argument('--sort', default='cumulative', dest='sort',
+                            choices=['cumulative', 'tottime', 'ncalls'],
+                            help='What to rank functions by.')
+        parser.add_argument('--limit', type=int, default=25, dest='limit',
+                            help='Number of functions to show.')
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        directory = options['directory'] or settings.RECOMMEND_PROFILE_DIR
+        if not directory:
+            raise base.CommandError(
+                'Set RECOMMEND_PROFILE_DIR, or pass --directory.')
+
+        output = StringIO()
+        stats, count = profiling.load_profiles(directory, stream=output)
+        if not count:
+            self.stdout.write('No profiles in {}.'.format(directory))
+            return
+
+        self.stdout.write('{} profiles, {:.1f}s in total.'.format(
+            count, stats.total_tt))
+        stats.sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,26 @@
+"""Implementation of the recommend_prune manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.core.management import base
+
+from ... import pruning
+
+
+class Command(base.BaseCommand):
+    """Delete stored similarities beyond each object's neighbor limit."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=400,
+                            dest='batch_size',
+                            help='Number of objects to load per query.')
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        if not pruning.is_enabled():
+            raise base.CommandError(
+                'Set RECOMMEND_MAX_NEIGHBORS or '
+                'RECOMMEND_MAX_NEIGHBORS_PER_MODEL first.')
+        deleted = pruning.prune_all(batch_size=options['batch_size'])
+        self.stdout.write('Deleted {} similarities.'.format(deleted))
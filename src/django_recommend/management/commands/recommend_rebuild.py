@@ -0,0 +1,55 @@
+"""Implementation of the recommend_rebuild manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time
+
+from django.core.management import base
+
+from ... import models
+from ... import rebuild
+
+
+class Command(base.BaseCommand):
+    """Recalculate all object similarities from the stored user scores."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            dest='chunk_size',
+                            help='Number of scores to read per query.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            dest='batch_size',
+                            help='Number of rows to insert per query.')
+        parser.add_argument('--partition-size', type=int, default=5000,
+                            dest='partition_size',
+                            help='Number of objects to add up per pass.')
+        parser.add_argument('--shadow', action='store_true', dest='shadow',
+                            help='Write to a shadow table, then swap it in.')
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        started = time.time()
+        stage_started = {}
+
+        def progress(stage, count):
+            """Report how many rows were handled, and how fast."""
+            now = time.time()
+            if not count:
+                stage_started[stage] = now
+                return
+            elapsed = now - stage_started[stage]
+            rate = count / elapsed if elapsed else float('inf')
+            noun = 'scores read' if stage == 'read' else 'similarities written'
+            self.stdout.write('{} {} ({:.0f}/s)'.format(count, noun, rate))
+
+        written = rebuild.rebuild(chunk_size=options['chunk_size'],
+                                  batch_size=options['batch_size'],
+                                  progress=progress,
+                                  shadow=options['shadow'],
+                                  partition_size=options['partition_size'])
+
+        rows = written * 2 if models.is_symmetric() else written
+        self.stdout.write(
+            'Rebuilt {} similarities ({} rows) in {:.1f}s.'.format(
+                written, rows, time.time() - started))
@@ -0,0 +1,42 @@
+"""Implementation of the recommend_stats manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+
+from django.core.management import base
+
+from ... import instrumentation
+
+
+class Command(base.BaseCommand):
+    """Show the instrumentation totals published by all processes."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', dest='json',
+                            help='Print the raw totals as JSON.')
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        stats = instrumentation.collected_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+            return
+        if not stats:
+            self.stdout.write(
+                "No stats published. Add 'aggregate' to "
+                'RECOMMEND_INSTRUMENTATION_SINKS.')
+            return
+
+        for name, totals in sorted(stats.items()):
+            calls = totals['calls']
+            self.stdout.write(
+                '{}: {} calls, {:.1f} ms mean, {:.1f} queries mean, '
+                '{:.1f} ms max ({})'.format(
+                    name, calls, totals['seconds'] * 1000 / calls,
+                    totals['queries'] / calls, totals['max_seconds'] * 1000,
+                    totals['slowest'] or '-'))
+            for what, num in sorted(totals['counts'].items()):
+                self.stdout.write('    {}: {} ({:.1f} mean)'.format(
+                    what, num, num / calls))
@@ -0,0 +1,32 @@
+"""Implementation of the recommend_warm manage.py command."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time
+
+from django.core.management import base
+
+from ... import memory_index
+
+
+class Command(base.BaseCommand):
+    """Load the in-memory neighbor index, and delete old recorded changes.
+
+    Web processes each load their own index; this shows how long that takes
+    and how much memory it needs.
+
+    """
+
+    help = __doc__
+
+    def handle(self, *args, **options):  # pylint: disable=unused-argument
+        started = time.time()
+        index = memory_index.warm()
+        self.stdout.write(
+            'Loaded {} neighbors of {} objects ({:.1f} MB of arrays) in '
+            '{:.1f}s.'.format(index.neighbor_count(), len(index),
+                              index.memory_size() / 1024 / 1024,
+                              time.time() - started))
+
+        deleted = memory_index.trim_changes()
+        self.stdout.write('Deleted {} old changes.'.format(deleted))
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""Remember score reads for the length of a request.
+
+While a memo is active in the current thread (see ScoreMemoMiddleware, or
+use memoize_scores() as a context manager), UserScore.get(), get_many() and
+scores_for() answer repeated reads without querying the database again.
+
+Writes made through UserScore, or through the UserScore model's post_save
+and post_delete signals, call forget() for the objects involved. Bulk
+queryset updates or deletes bypass this, so a memo can go stale if they're
+used on UserScore while it's active.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import contextlib
+import threading
+
+
+_STATE = threading.local()
+
+
+class ScoreMemo(object):
+    """Scores read so far, keyed by user and (content type ID, object ID)."""
+
+    def __init__(self):
+        self.user_scores = {}  # {(user, key): score}
+        self.object_scores = {}  # {key: {user: score}}
+
+    def get(self, user, key):
+        """Get a memoized score, or None if it isn't known."""
+        try:
+            return self.user_scores[user, key]
+        except KeyError:
+            pass
+        try:
+            return self.object_scores[key].get(user, 0)
+        except KeyError:
+            return None
+
+    def forget(self, user, key):
+        """Drop anything memoized about user's score for key."""
+        self.user_scores.pop((user, key), None)
+        self.object_scores.pop(key, None)
+
+
+def current():
+    """Get the memo active in this thread, or None."""
+    return getattr(_STATE, 'memo', None)
+
+
+def activate():
+    """Start memoizing scores in this thread.
+
+    Returns the previously active memo, to be passed to deactivate(). Nested
+    activations share the outer memo.
+
+    """
+    previous = current()
+    _STATE.memo = previous if previous is not None else ScoreMemo()
+    return previous
+
+
+def deactivate(previous):
+    """Restore the memo that was active before the matching activate()."""
+    _STATE.memo = previous
+
+
+@contextlib.contextmanager
+def memoize_scores():
+    """Memoize score reads made inside the with block."""
+    previous = activate()
+    try:
+        yield current()
+    finally:
+        deactivate(previous)
+
+
+def forget(user, keys):
+    """Drop memoized scores of user for the given objects, if a memo is on."""
+    memo = current()
+    if memo is not None:
+        for key in keys:
+            memo.forget(user, key)
@@ -0,0 +1,246 @@
+# coding: utf-8
+"""Keep every object's best neighbors in this process's memory.
+
+Enabled by RECOMMEND_MEMORY_INDEX. The first lookup (or a call to warm(),
+e.g. from wsgi.py) loads the best RECOMMEND_MEMORY_INDEX_SIZE neighbors of
+every object from ObjectSimilarity, streaming it in score order. Each list
+is stored as two arrays, so it costs a few bytes per neighbor rather than a
+tuple of Python objects.
+
+While it's on, every write to ObjectSimilarity also records the objects it
+touched as SimilarityChange rows. At most every
+RECOMMEND_MEMORY_INDEX_REFRESH seconds, a lookup reads the changes recorded
+since the last one it saw (its watermark), and reloads just those objects'
+lists. The recommend_warm command deletes changes older than
+RECOMMEND_MEMORY_INDEX_CHANGES_KEEP seconds; an index that hasn't refreshed
+in that long is reloaded from scratch.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import array
+import datetime
+import itertools
+import threading
+import timeit
+
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import models
+from . import neighbor_index
+from .conf import settings
+
+
+# A change can commit after one with a higher ID has been read, so changes
+# recorded this long before the last refresh are read again.
+LATE_COMMIT_GRACE = datetime.timedelta(seconds=10)
+
+_INDEX = None
+# Held while the first index of the process is loaded.
+_LOCK = threading.Lock()
+
+
+def is_enabled():
+    """Check whether the in-memory index is turned on."""
+    return settings.RECOMMEND_MEMORY_INDEX
+
+
+def pack(rows):
+    """Pack (key, neighbor key, score) rows into an (IDs, scores) pair.
+
+    IDs holds each neighbor's content type ID and object ID in turn.
+
+    """
+    ids = array.array(str('l'))
+    scores = array.array(str('d'))
+    for _, (ctype_id, obj_id), score in rows:
+        ids.append(ctype_id)
+        ids.append(obj_id)
+        scores.append(score)
+    return ids, scores
+
+
+class MemoryIndex(object):
+    """The best size neighbors of each object, refreshed from the database.
+
+    watermark is the ID of the last SimilarityChange applied. Lookups don't
+    lock; the database is read without the lock too, which is only held to
+    apply what was read.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lists = {}
+        self.watermark = 0
+        self.changes_since = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lists)
+
+    def neighbor_count(self):
+        """Get the number of neighbors held for all objects."""
+        return sum(len(scores) for _, scores in self.lists.values())
+
+    def memory_size(self):
+        """Get the number of bytes taken up by the neighbor arrays."""
+        return sum(len(ids) * ids.itemsize + len(scores) * scores.itemsize
+                   for ids, scores in self.lists.values())
+
+    def read_lists(self, keys=None):
+        """Load neighbor lists from the database, for keys or everything."""
+        return {key: pack(itertools.islice(rows, self.size))
+                for key, rows in itertools.groupby(
+                    neighbor_index.neighbor_rows(keys),
+                    key=lambda row: row[0])}
+
+    def load(self):
+        """Load all neighbor lists."""
+        started = timezone.now()
+        # Changes made while loading are applied again by the next refresh.
+        watermark = models.SimilarityChange.objects.aggregate(
+            Max('pk'))['pk__max'] or 0
+        lists = self.read_lists()
+        with self.lock:
+            self.lists = lists
+            self.watermark = watermark
+            self.changes_since = started
+            self.checked = timeit.default_timer()
+
+    def refresh(self):
+        """Reload the neighbor lists changed since the last load or refresh.
+
+        Returns the number of lists reloaded.
+
+        """
+        with self.lock:
+            watermark, changes_since = self.watermark, self.changes_since
+        started = timezone.now()
+        changes = models.SimilarityChange.objects.filter(
+            Q(pk__gt=watermark) |
+            Q(changed__gte=changes_since - LATE_COMMIT_GRACE)
+        ).values_list('pk', 'object_content_type', 'object_id')
+        keys = set()
+        for change_pk, ctype_id, obj_id in changes:
+            keys.add((ctype_id, obj_id))
+            watermark = max(watermark, change_pk)
+        fresh = self.read_lists(keys) if keys else {}
+
+        with self.lock:
+            for key in keys:
+                if key in fresh:
+                    self.lists[key] = fresh[key]
+                else:
+                    self.lists.pop(key, None)
+            self.watermark = max(self.watermark, watermark)
+            self.changes_since = started
+            self.checked = timeit.default_timer()
+        return len(keys)
+
+    def update(self):
+        """Refresh if it's been long enough since the last check.
+
+        An index too old to refresh from the recorded changes is reloaded.
+        Only one thread refreshes at a time; the others carry on with the
+        lists as they are.
+
+        """
+        keep = datetime.timedelta(
+            seconds=settings.RECOMMEND_MEMORY_INDEX_CHANGES_KEEP)
+        with self.lock:
+            now = timeit.default_timer()
+            if now - self.checked < settings.RECOMMEND_MEMORY_INDEX_REFRESH:
+                return
+            # Claim this check, so other threads don't start one too.
+            self.checked = now
+            reload = timezone.now() - self.changes_since > keep
+        if reload:
+            self.load()
+        else:
+            self.refresh()
+
+    def get_neighbors(self, key):
+        """Get key's neighbors, as (content type ID, object ID, score) tuples.
+
+        Neighbors are best first. Objects with no neighbors get an empty list.
+
+        """
+        try:
+            ids, scores = self.lists[tuple(key)]
+        except KeyError:
+            return []
+        return [(ids[2 * i], ids[2 * i + 1], score)
+                for i, score in enumerate(scores)]
+
+
+def new_index():
+    """Load a new MemoryIndex."""
+    index = MemoryIndex(settings.RECOMMEND_MEMORY_INDEX_SIZE)
+    index.load()
+    return index
+
+
+def warm():
+    """Load a new index for this process, replacing any current one.
+
+    Returns the new MemoryIndex.
+
+    """
+    global _INDEX  # pylint: disable=global-statement
+    index = new_index()
+    with _LOCK:
+        _INDEX = index
+    return index
+
+
+def get_index():
+    """Get this process's index, loading or refreshing it as needed.
+
+    The first call in a process loads the index; concurrent first calls
+    wait for that one load. Returns None if RECOMMEND_MEMORY_INDEX is off.
+
+    """
+    global _INDEX  # pylint: disable=global-statement
+    if not is_enabled():
+        return None
+    index = _INDEX
+    if index is None:
+        with _LOCK:
+            if _INDEX is None:
+                _INDEX = new_index()
+            return _INDEX
+    index.update()
+    return index
+
+
+def record_changes(keys):
+    """Record that the neighbors of keys changed, if the index is on.
+
+    keys is an iterable of (content type ID, object ID) pairs. Every code
+    path in this app that writes ObjectSimilarity rows calls this, next to
+    neighbor_cache.invalidate().
+
+    """
+    if not is_enabled():
+        return
+    keys = set(keys)
+    if keys:
+        models.SimilarityChange.record(keys)
+
+
+def trim_changes():
+    """Delete changes older than RECOMMEND_MEMORY_INDEX_CHANGES_KEEP seconds.
+
+    Returns the number of changes deleted.
+
+    """
+    cutoff = timezone.now() - datetime.timedelta(
+        seconds=settings.RECOMMEND_MEMORY_INDEX_CHANGES_KEEP)
+    old = models.SimilarityChange.objects.filter(changed__lt=cutoff)
+    count = old.count()
+    old.delete()
+    return count
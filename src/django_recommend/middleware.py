@@ -0,0 +1,23 @@
+# coding: utf-8
+"""Middleware for django_recommend."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from . import memo
+
+
+class ScoreMemoMiddleware(object):
+    """Memoize get_score() and scores_for() results for each request."""
+
+    attr_name = '_recommend_previous_memo'
+
+    def process_request(self, request):
+        """Start memoizing scores for this request."""
+        setattr(request, self.attr_name, memo.activate())
+
+    def process_response(self, request, response):
+        """Drop the request's memo."""
+        if hasattr(request, self.attr_name):
+            memo.deactivate(getattr(request, self.attr_name))
+            delattr(request, self.attr_name)
+        return response
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_recommend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='objectsimilarity',
+            index_together=set([('object_1_content_type', 'object_1_id', 'score'), ('object_2_content_type', 'object_2_id', 'score')]),
+        ),
+    ]
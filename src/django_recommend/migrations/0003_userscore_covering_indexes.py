@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_recommend', '0002_similarity_score_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userscore',
+            name='user',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterIndexTogether(
+            name='userscore',
+            index_together=set([('user', 'object_content_type', 'object_id', 'score'), ('object_content_type', 'object_id', 'user', 'score')]),
+        ),
+    ]
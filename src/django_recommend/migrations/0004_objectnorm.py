@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_recommend', '0003_userscore_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectNorm',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('object_id', models.IntegerField()),
+                ('sum_squares', models.FloatField()),
+                ('object_content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='objectnorm',
+            unique_together=set([('object_content_type', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('django_recommend', '0004_objectnorm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('object_id', models.IntegerField()),
+                ('changed', models.DateTimeField(db_index=True, auto_now_add=True)),
+                ('object_content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+    ]
@@ -3,21 +3,42 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import collections
+
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core import exceptions
+from django.db import connections
 from django.db import models
+from django.db import router
+from django.db import transaction
 from django.db.models import signals as model_signals
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
 from django.utils.encoding import python_2_unicode_compatible
 
 import django_recommend
 from . import conf
+from . import instrumentation
+from . import memo
+from . import neighbor_cache
+from . import upserts
 
 
 NO_RELATED_NAME = '+'  # Try to clarify obscure Django syntax.
 
+# Stay below SQLite's default limit of 999 parameters in a single query.
+MAX_QUERY_PARAMS = 900
+
+# Sums of float deltas closer to 0 than this are taken as 0, so that
+# contributions which cancel out don't leave rows with rounding residue.
+SCORE_EPSILON = 1e-9
+
+# Values for RECOMMEND_SIMILARITY_LAYOUT. 'pairs' stores each similarity once,
+# with the lower object key as object_1. 'symmetric' stores it twice, once
+# with each object as object_1, so an object's neighbors are one index range.
+SIMILARITY_LAYOUTS = ('pairs', 'symmetric')
+
 
 def respect_purge_setting(*args):
     """Raise or delete related objects based on settings.
@@ -32,18 +53,173 @@ def respect_purge_setting(*args):
         raise
 
 
+def fetch_instances(keys):
+    """Load the objects named by (content type ID, object ID) pairs.
+
+    Objects are loaded with one in_bulk() query per content type (split into
+    chunks if there are more IDs than MAX_QUERY_PARAMS), through the model's
+    default manager, so database routers are respected.
+
+    Returns a dict mapping each key to its instance. Keys of objects that are
+    not in the database are left out.
+
+    """
+    ids_by_ctype = collections.OrderedDict()
+    for ctype_id, obj_id in keys:
+        ids_by_ctype.setdefault(ctype_id, set()).add(obj_id)
+
+    found = {}
+    for ctype_id, obj_ids in ids_by_ctype.items():
+        model = ContentType.objects.get_for_id(ctype_id).model_class()
+        for chunk in chunked(list(obj_ids), MAX_QUERY_PARAMS):
+            for obj_id, inst in model.objects.in_bulk(chunk).items():
+                found[(ctype_id, obj_id)] = inst
+    return found
+
+
+def get_instances(keys, when_missing=respect_purge_setting):
+    """Get the objects named by a list of (content type ID, object ID) pairs.
+
+    Returns a list in the same order as keys. Objects are loaded with
+    fetch_instances(). Missing objects are handled by when_missing, as in
+    ObjectSimilarityQueryset.get_instances_for.
+
+    """
+    found = fetch_instances(keys)
+
+    def get_fetched(key):
+        """Get a loaded instance, raising DoesNotExist like get() would."""
+        try:
+            return found[key]
+        except KeyError:
+            model = ContentType.objects.get_for_id(key[0]).model_class()
+            msg = '{} matching query does not exist.'
+            raise model.DoesNotExist(msg.format(model._meta.object_name))
+
+    instances = []
+    for ctype_id, obj_id in keys:
+        try:
+            inst = get_fetched((ctype_id, obj_id))
+        except exceptions.ObjectDoesNotExist:
+            when_missing(ctype_id, obj_id)
+        else:
+            instances.append(inst)
+    return instances
+
+
+def object_key(obj):
+    """Get the (content type ID, object ID) pair that identifies obj."""
+    return ContentType.objects.get_for_model(obj).pk, obj.pk
+
+
+def is_symmetric():
+    """Check whether similarities are stored in both directions."""
+    layout = conf.settings.RECOMMEND_SIMILARITY_LAYOUT
+    if layout not in SIMILARITY_LAYOUTS:
+        msg = 'Unknown RECOMMEND_SIMILARITY_LAYOUT {!r}; choose from: {}'
+        raise ImproperlyConfigured(
+            msg.format(layout, ', '.join(SIMILARITY_LAYOUTS)))
+    return layout == 'symmetric'
+
+
+def stored_directions(end_1, end_2):
+    """Get the (object_1, object_2) pairs stored for a similarity.
+
+    end_1 and end_2 describe the similarity's objects, in stored order for
+    the 'pairs' layout (e.g. keys from object_key(), with end_1 < end_2).
+
+    """
+    if is_symmetric():
+        return [(end_1, end_2), (end_2, end_1)]
+    return [(end_1, end_2)]
+
+
+def key_filters(keys, ctype_field='object_content_type',
+                id_field='object_id'):
+    """Build lookups matching a collection of (content type, ID) pairs.
+
+    Returns a list of Q objects to run as separate queries. Each one uses at
+    most MAX_QUERY_PARAMS parameters, so usually there is only one.
+
+    """
+    ids_by_ctype = {}
+    for ctype_id, obj_id in keys:
+        ids_by_ctype.setdefault(ctype_id, set()).add(obj_id)
+
+    lookups = []
+    current, used = None, 0
+    for ctype_id, obj_ids in sorted(ids_by_ctype.items()):
+        for chunk in chunked(sorted(obj_ids), MAX_QUERY_PARAMS - 1):
+            lookup = Q(**{ctype_field: ctype_id, id_field + '__in': chunk})
+            if current is not None and used + len(chunk) < MAX_QUERY_PARAMS:
+                current |= lookup
+                used += len(chunk) + 1
+            else:
+                if current is not None:
+                    lookups.append(current)
+                current, used = lookup, len(chunk) + 1
+    if current is not None:
+        lookups.append(current)
+    return lookups
+
+
+def update_scores(qset, scores, field='score'):
+    """Set the score field of many rows with few UPDATE queries.
+
+    scores maps primary keys of rows in qset to their new scores. field
+    names the model's score field.
+
+    """
+    # Each When() takes two parameters, plus one for the pk__in.
+    for chunk in chunked(sorted(scores), MAX_QUERY_PARAMS // 3):
+        new_scores = Case(
+            *[When(pk=row_pk, then=Value(scores[row_pk])) for row_pk in chunk],
+            output_field=models.FloatField())
+        qset.filter(pk__in=chunk).update(**{field: new_scores})
+
+
+def delete_rows(model, db_alias, pks):
+    """Delete the rows of model with the given primary keys, in chunks.
+
+    Unlike QuerySet.delete(), this sends no pre_delete or post_delete
+    signals, and doesn't fetch the rows first. Callers must do whatever
+    their receivers would have done themselves.
+
+    """
+    connection = connections[db_alias]
+    quote = connection.ops.quote_name
+    opts = model._meta
+    for chunk in chunked(sorted(pks), MAX_QUERY_PARAMS):
+        sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+            quote(opts.db_table), quote(opts.pk.column),
+            ', '.join(['%s'] * len(chunk)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, chunk)
+
+
+def round_zero(score):
+    """Get score, or 0 if it's within SCORE_EPSILON of 0."""
+    return 0 if abs(score) < SCORE_EPSILON else score
+
+
+def chunked(items, size):
+    """Split the list items into lists of at most size elements."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
 class ObjectSimilarityQueryset(models.QuerySet):
     """The custom manager used for the ObjectSimilarity class."""
 
     def get_instances_for(self, obj, when_missing=respect_purge_setting):
         """Get the instances in this queryset that are not `obj`.
 
-        Returns a list.
+        Returns a list, in the same order as this queryset. The instances are
+        loaded with one query per content type.
 
         when_missing:
             a callback function to execute when an instance that should be
-            suggested is not present in the database (i.e. get() raises
-            ObjectDoesNotExist). This function will be called with two
+            suggested is not present in the database. It is called while the
+            model's ObjectDoesNotExist exception is being handled, with two
             parameters: the content type id, and the object id.
 
             The default callback propagates the underlying ObjectDoesNotExist
@@ -57,42 +233,39 @@ class ObjectSimilarityQueryset(models.QuerySet):
 
         """
         ctype = ContentType.objects.get_for_model(obj)
+        label = instrumentation.format_key((ctype.pk, obj.pk))
+        with instrumentation.measure('get_instances_for', label) as recording:
+            instances = self.__get_other_instances(obj, ctype, when_missing)
+            recording.count('objects', len(instances))
+        return instances
 
-        def get_object_from_ctype(contenttype, target_id):
-            """The builtin method of doing this breaks with multiple DBs."""
-            return contenttype.model_class().objects.get(pk=target_id)
+    def __get_other_instances(self, obj, ctype, when_missing):
+        """Load the instances on the other side of obj, as a list."""
 
         def get_object_params(sim_obj, num):
-            """Get the content_type and PK of an object from sim_obj."""
+            """Get the content type ID and PK of an object from sim_obj."""
             prefix = 'object_{}_'.format(num)
             target_id = getattr(sim_obj, prefix + 'id')
-            target_ctype = getattr(sim_obj, prefix + 'content_type')
-            return target_ctype, target_id
+            target_ctype_id = getattr(sim_obj, prefix + 'content_type_id')
+            return target_ctype_id, target_id
 
         def get_other_object_params(sim_obj):
-            """Get the content type and pk of the other object in sim_obj."""
+            """Get the content type ID and pk of the other object."""
             same_id_as_1 = sim_obj.object_1_id == obj.pk
-            same_ctype_as_1 = sim_obj.object_1_content_type == ctype
+            same_ctype_as_1 = sim_obj.object_1_content_type_id == ctype.pk
 
             if same_id_as_1 and same_ctype_as_1:
                 return get_object_params(sim_obj, 2)
             return get_object_params(sim_obj, 1)
 
-        instances = []
-        for sim in self:
-            other_ctype, other_pk = get_other_object_params(sim)
-            try:
-                inst = get_object_from_ctype(other_ctype, other_pk)
-            except exceptions.ObjectDoesNotExist:
-                when_missing(other_ctype.pk, other_pk)
-            else:
-                instances.append(inst)
-        return instances
+        keys = [get_other_object_params(sim) for sim in self]
+        return get_instances(keys, when_missing)
 
-    def __build_query(self, qset):
+    def __build_query(self, qset, both_sides=True):
         """Get a lookup to match qset objects as either object_1 or object_2.
 
-        qset is any Django queryset.
+        qset is any Django queryset. If both_sides is False, only object_1 is
+        matched.
 
         """
         model = qset.model
@@ -105,8 +278,10 @@ class ObjectSimilarityQueryset(models.QuerySet):
             # Forces the DB query to happen early
             qset = list(ids)
 
-        lookup = ((Q(object_1_content_type=ctype) & Q(object_1_id__in=qset)) |
-                  (Q(object_2_content_type=ctype) & Q(object_2_id__in=qset)))
+        lookup = Q(object_1_content_type=ctype) & Q(object_1_id__in=qset)
+        if both_sides:
+            lookup |= (Q(object_2_content_type=ctype) &
+                       Q(object_2_id__in=qset))
         return lookup
 
     def exclude_objects(self, qset):
@@ -126,8 +301,12 @@ class ObjectSimilarityQueryset(models.QuerySet):
         types of objects stored in ObjectSimilarity/UserScore, **not**
         ObjectSimilarity/UserScore themselves.
 
+        With the 'symmetric' layout, only the rows with the objects as
+        object_1 are matched, so each similarity of an object appears once.
+
         """
-        return self.filter(self.__build_query(qset))
+        return self.filter(
+            self.__build_query(qset, both_sides=not is_symmetric()))
 
 
 @python_2_unicode_compatible
@@ -150,8 +329,8 @@ class ObjectSimilarity(models.Model):  # pylint: disable=model-missing-unicode
 
     class Meta:
         index_together = (
-            ('object_1_id', 'object_1_content_type'),
-            ('object_2_id', 'object_2_content_type'),
+            ('object_1_content_type', 'object_1_id', 'score'),
+            ('object_2_content_type', 'object_2_id', 'score'),
         )
 
         ordering = ['-score']
@@ -194,24 +373,163 @@ class ObjectSimilarity(models.Model):  # pylint: disable=model-missing-unicode
         else:
             obj_1, obj_2 = obj_b, obj_a
 
-        inst_lookup = dict(
-            object_1_content_type=ContentType.objects.get_for_model(obj_1),
-            object_1_id=obj_1.pk,
-            object_2_content_type=ContentType.objects.get_for_model(obj_2),
-            object_2_id=obj_2.pk,
-        )
+        end_1 = ContentType.objects.get_for_model(obj_1), obj_1.pk
+        end_2 = ContentType.objects.get_for_model(obj_2), obj_2.pk
 
-        # Save space by not storing scores of 0.
-        if score == 0:
-            ObjectSimilarity.objects.filter(**inst_lookup).delete()
-            sim = None
-        else:
-            kwargs = dict(inst_lookup)
-            kwargs['defaults'] = {'score': score}
-            sim, _ = ObjectSimilarity.objects.update_or_create(**kwargs)
+        db_alias = router.db_for_write(cls)
+        fast = upserts.can_upsert(db_alias)
+        if fast and end_1 == end_2:
+            raise ValidationError('An object cannot be similar to itself.')
 
+        sims = []
+        directions = stored_directions(end_1, end_2)
+        # Both directions of the symmetric layout are stored, or neither.
+        with transaction.atomic(using=db_alias):
+            for (ctype_1, id_1), (ctype_2, id_2) in directions:
+                inst_lookup = dict(
+                    object_1_content_type=ctype_1, object_1_id=id_1,
+                    object_2_content_type=ctype_2, object_2_id=id_2,
+                )
+
+                # Save space by not storing scores of 0.
+                if score == 0:
+                    ObjectSimilarity.objects.filter(**inst_lookup).delete()
+                elif fast:
+                    id_lookup = dict(
+                        object_1_content_type=ctype_1.pk, object_1_id=id_1,
+                        object_2_content_type=ctype_2.pk, object_2_id=id_2)
+                    sim_pk, _ = upserts.upsert(
+                        cls, db_alias, id_lookup, {'score': score})
+                    sim = cls(pk=sim_pk, score=score, **inst_lookup)
+                    sim._state.adding = False
+                    sim._state.db = db_alias
+                    sims.append(sim)
+                else:
+                    kwargs = dict(inst_lookup)
+                    kwargs['defaults'] = {'score': score}
+                    sim, _ = ObjectSimilarity.objects.update_or_create(
+                        **kwargs)
+                    sims.append(sim)
+        sim = sims[0] if sims else None
+
+        keys = [object_key(obj_1), object_key(obj_2)]
+        neighbor_cache.invalidate(keys)
+        record_similarity_changes(keys)
         return sim
 
+    @classmethod
+    def set_many(cls, scores):
+        """Set the similarity for many pairs of objects at once.
+
+        scores is a dict mapping (key_a, key_b) pairs to scores, where each
+        key is a (content type ID, object ID) pair (see object_key()).
+
+        This follows the same rules as set(), but instead of a query or two
+        per pair it runs one SELECT for the existing rows, one DELETE for the
+        pairs set to 0, one INSERT for new pairs and one UPDATE for changed
+        scores, all in a single transaction. (Each statement is split into
+        chunks if it would need more than MAX_QUERY_PARAMS parameters.)
+
+        Unlike set(), save() and full_clean() are not called. Returns the
+        number of rows inserted, updated or deleted.
+
+        """
+        return cls.__write_many(scores, lambda old_score, score: score)
+
+    @classmethod
+    def add_many(cls, deltas):
+        """Add to the similarity of many pairs of objects at once.
+
+        deltas is a dict like the one set_many() takes, but holding amounts to
+        add to each pair's stored score (or to 0, if it has none). Pairs that
+        end up with a score of 0 (within SCORE_EPSILON) are deleted. The
+        queries are the same as set_many()'s, but the existing rows are read
+        with SELECT ... FOR UPDATE, so concurrent additions to the same pair
+        aren't lost.
+
+        """
+        return cls.__write_many(
+            deltas, lambda old_score, delta: round_zero(old_score + delta),
+            for_update=True)
+
+    @classmethod
+    def __write_many(cls, values, combine, for_update=False):
+        """Store combine(old score, value) for each pair in values.
+
+        Returns the number of rows changed.
+
+        """
+        pairs = {}
+        for (key_a, key_b), value in values.items():
+            if key_a == key_b:
+                raise ValidationError('An object cannot be similar to itself.')
+            pair = min(key_a, key_b), max(key_a, key_b)
+            for direction in stored_directions(*pair):
+                pairs[direction] = value
+
+        db_alias = router.db_for_write(cls)
+        with transaction.atomic(using=db_alias):
+            existing = cls.__existing_rows(pairs, db_alias, for_update)
+
+            to_delete = []
+            to_update = {}
+            to_create = []
+            for (key_1, key_2), value in pairs.items():
+                sim_pk, old_score = existing.get((key_1, key_2), (None, 0))
+                score = combine(old_score, value)
+                if sim_pk is None:
+                    if score != 0:
+                        to_create.append(cls(
+                            object_1_content_type_id=key_1[0],
+                            object_1_id=key_1[1],
+                            object_2_content_type_id=key_2[0],
+                            object_2_id=key_2[1], score=score))
+                elif score == 0:
+                    to_delete.append(sim_pk)
+                elif score != old_score:
+                    to_update[sim_pk] = score
+
+            sims = cls.objects.using(db_alias)
+            for chunk in chunked(sorted(to_delete), MAX_QUERY_PARAMS):
+                sims.filter(pk__in=chunk).delete()
+            sims.bulk_create(to_create)
+            update_scores(sims, to_update)
+
+        keys = {key for pair in pairs for key in pair}
+        neighbor_cache.invalidate(keys)
+        record_similarity_changes(keys)
+        return len(to_delete) + len(to_create) + len(to_update)
+
+    @classmethod
+    def __existing_rows(cls, pairs, db_alias, for_update=False):
+        """Find the stored rows for the (key_1, key_2) pairs in pairs.
+
+        Returns a dict mapping pairs to (pk, score) tuples. If for_update is
+        true, the rows are locked until the end of the transaction.
+
+        """
+        ids_by_ctype = {}
+        for key_1, _ in pairs:
+            ids_by_ctype.setdefault(key_1[0], set()).add(key_1[1])
+
+        sims = cls.objects.using(db_alias)
+        if for_update:
+            sims = sims.select_for_update()
+
+        existing = {}
+        for ctype_id, obj_ids in ids_by_ctype.items():
+            for chunk in chunked(sorted(obj_ids), MAX_QUERY_PARAMS):
+                rows = sims.filter(
+                    object_1_content_type=ctype_id, object_1_id__in=chunk
+                ).order_by().values_list(
+                    'object_1_content_type', 'object_1_id',
+                    'object_2_content_type', 'object_2_id', 'pk', 'score')
+                for ctype_1, id_1, ctype_2, id_2, sim_pk, score in rows:
+                    pair = (ctype_1, id_1), (ctype_2, id_2)
+                    if pair in pairs:
+                        existing[pair] = sim_pk, score
+        return existing
+
     def __str__(self):
         return '{}, {}: {}'.format(self.object_1_id, self.object_2_id,
                                    self.score)
@@ -230,17 +548,35 @@ class UserScore(models.Model):
     object_content_type = models.ForeignKey(ContentType)
     object = GenericForeignKey('object_content_type', 'object_id')
 
-    user = models.CharField(max_length=255, db_index=True)
+    user = models.CharField(max_length=255)
 
     score = models.FloatField()
 
     class Meta:
-        index_together = ('object_id', 'object_content_type')
+        # Covering indexes for reading scores by user and by object.
+        index_together = (
+            ('user', 'object_content_type', 'object_id', 'score'),
+            ('object_content_type', 'object_id', 'user', 'score'),
+        )
         unique_together = ('object_id', 'object_content_type', 'user')
 
+    # In incremental mode, the score being replaced by the current save(),
+    # as read from the database (with its row locked) by save() itself.
+    saved_score = 0
+
     def save(self, *args, **kwargs):
         self.full_clean()
-        super(UserScore, self).save(*args, **kwargs)
+        if not tracks_score_changes():
+            super(UserScore, self).save(*args, **kwargs)
+            return
+        # The post_save receiver applies the deltas, so the score and the
+        # deltas are written in one transaction.
+        from . import incremental
+        db_alias = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        with transaction.atomic(using=db_alias):
+            self.saved_score = incremental.stored_score(self, db_alias)
+            super(UserScore, self).save(*args, **kwargs)
 
     @classmethod
     def __user_str(cls, user_or_str):
@@ -264,7 +600,9 @@ class UserScore(models.Model):
         inst_lookup = dict(
             user=user, object_id=obj.pk, object_content_type=ctype)
 
-        if score:
+        if score and cls.__can_upsert():
+            inst, _ = cls.__upsert(user, ctype, obj.pk, score, update=True)
+        elif score:
             kwargs = dict(inst_lookup)
             kwargs['defaults'] = {'score': score}
             inst, _ = cls.objects.update_or_create(**kwargs)
@@ -278,11 +616,162 @@ class UserScore(models.Model):
         """Store the user's score only if there's no existing score."""
         user = cls.__user_str(user_or_str)
         ctype = ContentType.objects.get_for_model(obj)
+        if cls.__can_upsert():
+            cls.__upsert(user, ctype, obj.pk, score, update=False)
+            return
         cls.objects.get_or_create(
             user=user, object_id=obj.pk, object_content_type=ctype,
             defaults={'score': score}
         )
 
+    @classmethod
+    def __can_upsert(cls):
+        """Check whether set() and setdefault() can use native upserts.
+
+        Incremental mode needs the replaced score, which upserts don't give.
+
+        """
+        return (upserts.can_upsert(router.db_for_write(cls)) and
+                not tracks_score_changes())
+
+    @classmethod
+    def __upsert(cls, user, ctype, obj_id, score, update):
+        """Write a score with one statement, and send post_save for it.
+
+        Returns the (instance, created) tuple; the instance is None if
+        nothing was written.
+
+        """
+        db_alias = router.db_for_write(cls)
+        score_pk, created = upserts.upsert(
+            cls, db_alias,
+            {'user': user, 'object_id': obj_id,
+             'object_content_type': ctype.pk},
+            {'score': score}, update=update)
+        if score_pk is None:
+            return None, False
+        inst = cls(pk=score_pk, user=user, object_id=obj_id,
+                   object_content_type=ctype, score=score)
+        inst._state.adding = False
+        inst._state.db = db_alias
+        model_signals.post_save.send(
+            sender=cls, instance=inst, created=created, raw=False,
+            using=db_alias, update_fields=None)
+        return inst, created
+
+    @classmethod
+    def set_many(cls, user_or_str, scores):
+        """Store many of a user's scores at once.
+
+        scores is an iterable of (obj, score) pairs; if an object appears more
+        than once, its last score wins. This follows the same rules as set(),
+        but runs one SELECT, then at most one DELETE, INSERT and UPDATE, in a
+        single transaction. Scores that don't change aren't written.
+
+        No post_save, pre_delete or post_delete signals are sent. Instead, the
+        changed scores are dropped from the score memo, and one similarity
+        update per changed object is queued at the end (or the changes are
+        applied, in incremental mode), as this package's receivers would.
+        Receivers of your own won't hear about these writes.
+
+        Returns a list of the (content type ID, object ID) keys that changed.
+
+        """
+        user = cls.__user_str(user_or_str)
+        new_scores = {object_key(obj): score for obj, score in scores}
+
+        db_alias = router.db_for_write(cls)
+        with transaction.atomic(using=db_alias):
+            existing = cls.__existing_scores(user, new_scores, db_alias)
+
+            to_delete = {}
+            to_update = {}
+            for key, (score_pk, old_score) in existing.items():
+                if not new_scores[key]:
+                    to_delete[score_pk] = key
+                elif new_scores[key] != old_score:
+                    to_update[score_pk] = new_scores[key]
+
+            to_create = [
+                cls(user=user, object_content_type_id=key[0],
+                    object_id=key[1], score=score)
+                for key, score in new_scores.items()
+                if score and key not in existing
+            ]
+
+            user_scores = cls.objects.using(db_alias)
+            # delete() would send pre_delete and post_delete, which would
+            # queue a second update (or apply the deltas twice) for each row.
+            delete_rows(cls, db_alias, to_delete)
+            user_scores.bulk_create(to_create)
+            update_scores(user_scores, to_update)
+
+            changes = {
+                key: (old_score, new_scores[key])
+                for key, (score_pk, old_score) in existing.items()
+                if score_pk in to_delete or score_pk in to_update}
+            changes.update(
+                ((inst.object_content_type_id, inst.object_id),
+                 (0, inst.score)) for inst in to_create)
+            applied = apply_score_changes(user, changes)
+
+        changed = list(changes)
+        memo.forget(user, changed)
+        if not applied:
+            queue_updates(changed)
+        return changed
+
+    @classmethod
+    def setdefault_many(cls, user_or_str, scores):
+        """Store many of a user's scores, skipping objects already scored.
+
+        scores is an iterable of (obj, score) pairs. Like set_many(), this
+        writes in bulk and queues updates for the new scores at the end.
+
+        Returns a list of the (content type ID, object ID) keys that were
+        added.
+
+        """
+        user = cls.__user_str(user_or_str)
+        new_scores = {object_key(obj): score for obj, score in scores}
+
+        db_alias = router.db_for_write(cls)
+        with transaction.atomic(using=db_alias):
+            existing = cls.__existing_scores(user, new_scores, db_alias)
+            to_create = [
+                cls(user=user, object_content_type_id=key[0],
+                    object_id=key[1], score=score)
+                for key, score in new_scores.items() if key not in existing
+            ]
+            cls.objects.using(db_alias).bulk_create(to_create)
+            applied = apply_score_changes(user, {
+                (inst.object_content_type_id, inst.object_id):
+                (0, inst.score) for inst in to_create})
+
+        added = [(inst.object_content_type_id, inst.object_id)
+                 for inst in to_create]
+        memo.forget(user, added)
+        if not applied:
+            queue_updates(added)
+        return added
+
+    @classmethod
+    def __existing_scores(cls, user, keys, db_alias):
+        """Get a user's stored scores for the given objects.
+
+        Returns a dict mapping (content type ID, object ID) keys to
+        (pk, score) tuples.
+
+        """
+        existing = {}
+        for lookup in key_filters(keys):
+            rows = cls.objects.using(db_alias).filter(
+                lookup, user=user
+            ).values_list('object_content_type', 'object_id', 'pk', 'score')
+            for ctype_id, obj_id, score_pk, score in rows:
+                existing[ctype_id, obj_id] = score_pk, score
+        return existing
+
     @classmethod
     def get(cls, user_or_str, obj):
         """Get the score that user gave to obj.
@@ -293,13 +782,52 @@ class UserScore(models.Model):
 
         """
         user = cls.__user_str(user_or_str)
-        ctype = ContentType.objects.get_for_model(obj)
+        key = object_key(obj)
+        memo_ = memo.current()
+        if memo_ is not None:
+            score = memo_.get(user, key)
+            if score is not None:
+                return score
+
         try:
-            inst = cls.objects.get(user=user, object_id=obj.pk,
-                                   object_content_type=ctype)
-            return inst.score
+            score = cls.objects.get(user=user, object_content_type_id=key[0],
+                                    object_id=key[1]).score
         except cls.DoesNotExist:
-            return 0
+            score = 0
+        if memo_ is not None:
+            memo_.user_scores[user, key] = score
+        return score
+
+    @classmethod
+    def get_many(cls, user_or_str, objs):
+        """Get the scores that user gave to each of objs.
+
+        Returns a dictionary mapping each object to its score, like calling
+        get() for each object, but with a single query (unless there are more
+        than MAX_QUERY_PARAMS objects). Unrated objects map to 0.
+
+        """
+        user = cls.__user_str(user_or_str)
+        objs_by_key = {object_key(obj): obj for obj in objs}
+        scores = dict.fromkeys(objs_by_key, 0)
+        memo_ = memo.current()
+        missing = set(objs_by_key)
+        if memo_ is not None:
+            for key in objs_by_key:
+                score = memo_.get(user, key)
+                if score is not None:
+                    scores[key] = score
+                    missing.discard(key)
+
+        for lookup in key_filters(missing):
+            rows = cls.objects.filter(lookup, user=user).values_list(
+                'object_content_type', 'object_id', 'score')
+            for ctype_id, obj_id, score in rows:
+                scores[ctype_id, obj_id] = score
+        if memo_ is not None:
+            memo_.user_scores.update(((user, key), scores[key])
+                                     for key in missing)
+        return {obj: scores[key] for key, obj in objs_by_key.items()}
 
     @classmethod
     def scores_for(cls, obj):
@@ -308,10 +836,46 @@ class UserScore(models.Model):
         Returns a dictionary, not a queryset.
 
         """
-        ctype = ContentType.objects.get_for_model(obj)
-        scores = cls.objects.filter(object_content_type=ctype,
-                                    object_id=obj.pk)
-        return {score.user: score.score for score in scores}
+        key = object_key(obj)
+        memo_ = memo.current()
+        if memo_ is not None and key in memo_.object_scores:
+            return dict(memo_.object_scores[key])
+
+        scores = cls.objects.filter(object_content_type_id=key[0],
+                                    object_id=key[1])
+        result = {score.user: score.score for score in scores}
+        if memo_ is not None:
+            memo_.object_scores[key] = dict(result)
+        return result
+
+    @classmethod
+    def scores_for_many(cls, objs):
+        """Get all scores for each of the given objects.
+
+        Returns a dictionary mapping each object to a dictionary like the one
+        scores_for() returns. Uses a single query, unless there are more than
+        MAX_QUERY_PARAMS objects.
+
+        """
+        objs_by_key = {object_key(obj): obj for obj in objs}
+        result = {obj: {} for obj in objs_by_key.values()}
+        for lookup in key_filters(objs_by_key):
+            rows = cls.objects.filter(lookup).values_list(
+                'object_content_type', 'object_id', 'user', 'score')
+            for ctype_id, obj_id, user, score in rows:
+                result[objs_by_key[ctype_id, obj_id]][user] = score
+        return result
+
+    @classmethod
+    def recommend_for(cls, user_or_str, num, model=None):
+        """Get up to num objects to recommend to the user, best first.
+
+        See the recommendations module for how objects are ranked.
+
+        """
+        from . import recommendations
+        user = cls.__user_str(user_or_str)
+        return recommendations.recommend(user, num, model)
 
     def __str__(self):
         return '{}, {}: {}'.format(self.user, self.object_id, self.score)
@@ -327,7 +891,62 @@ def call_handler(*args, **kwargs):
     tasks.signal_handler(*args, **kwargs)
 
 
+def forget_memoized_score(instance, **kwargs):
+    """Drop a changed score from the current thread's score memo."""
+    memo.forget(instance.user, [(instance.object_content_type_id,
+                                 instance.object_id)])
+
+
+def tracks_score_changes():
+    """Check whether score changes are applied as incremental deltas.
+
+    That only happens in incremental mode with RECOMMEND_ENABLE_AUTOCALC on.
+
+    """
+    from . import incremental
+    return (conf.settings.RECOMMEND_ENABLE_AUTOCALC and
+            incremental.is_enabled())
+
+
+def apply_score_changes(user, changes):
+    """Proxy for incremental.apply_changes, for bulk writes.
+
+    Returns whether the changes were applied (see tracks_score_changes()).
+
+    """
+    if not tracks_score_changes():
+        return False
+    from . import incremental
+    incremental.apply_changes(user, changes)
+    return True
+
+
+def record_similarity_changes(keys):
+    """Proxy for memory_index.record_changes, which imports this module."""
+    from . import memory_index
+    memory_index.record_changes(keys)
+
+
+def queue_updates(keys):
+    """Proxy for tasks.queue_updates, for bulk writes that send no signals."""
+    from . import tasks
+    tasks.queue_updates(keys)
+
+
 model_signals.post_save.connect(call_handler, UserScore,
                                 dispatch_uid="recommend_post_save")
 model_signals.post_delete.connect(call_handler, UserScore,
                                   dispatch_uid="recommend_post_save")
+model_signals.pre_delete.connect(call_handler, UserScore,
+                                 dispatch_uid="recommend_pre_delete")
+model_signals.post_save.connect(forget_memoized_score, UserScore,
+                                dispatch_uid="recommend_memo_post_save")
+model_signals.post_delete.connect(forget_memoized_score, UserScore,
+                                  dispatch_uid="recommend_memo_post_delete")
+
+# Models kept in their own modules. Importing them here registers them when
+# Django loads this app's models, and keeps them importable from here.
+# pylint: disable=wrong-import-position,unused-import
+from .changes import SimilarityChange  # noqa: E402
+from .generations import SimilarityGeneration  # noqa: E402
+from .norms import ObjectNorm  # noqa: E402
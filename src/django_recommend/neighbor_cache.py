@@ -0,0 +1,70 @@
+# coding: utf-8
+"""Cache each object's ordered neighbor list in the Django cache.
+
+Enabled by RECOMMEND_NEIGHBOR_CACHE. Each entry holds up to
+RECOMMEND_NEIGHBOR_CACHE_SIZE (content type ID, object ID, score) tuples for
+one object, best first, and lives for RECOMMEND_NEIGHBOR_CACHE_TIMEOUT
+seconds. Entries are stored in the cache named by RECOMMEND_CACHE.
+
+Every code path in this app that writes ObjectSimilarity rows calls
+invalidate() for the objects involved.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.contrib.contenttypes.models import ContentType
+
+import django_recommend
+from . import conf
+from .conf import settings
+
+
+def is_enabled():
+    """Check whether the neighbor cache is turned on."""
+    return settings.RECOMMEND_NEIGHBOR_CACHE
+
+
+def cache_key(key):
+    """Get the cache key for a (content type ID, object ID) pair."""
+    return 'django_recommend:neighbors:{}:{}'.format(*key)
+
+
+def load_neighbors(obj):
+    """Read obj's neighbor list from the database."""
+    ctype_id = ContentType.objects.get_for_model(obj).pk
+    sims = django_recommend.similar_to(obj).values_list(
+        'object_1_content_type', 'object_1_id', 'object_2_content_type',
+        'object_2_id', 'score')
+    size = settings.RECOMMEND_NEIGHBOR_CACHE_SIZE
+    if size is not None:
+        sims = sims[:size]
+
+    neighbors = []
+    for ctype_1, id_1, ctype_2, id_2, score in sims:
+        if (ctype_1, id_1) == (ctype_id, obj.pk):
+            neighbors.append((ctype_2, id_2, score))
+        else:
+            neighbors.append((ctype_1, id_1, score))
+    return neighbors
+
+
+def get_neighbors(obj):
+    """Get obj's neighbor list, from the cache if possible."""
+    cache = conf.get_cache()
+    key = cache_key((ContentType.objects.get_for_model(obj).pk, obj.pk))
+    neighbors = cache.get(key)
+    if neighbors is None:
+        neighbors = load_neighbors(obj)
+        cache.set(key, neighbors, settings.RECOMMEND_NEIGHBOR_CACHE_TIMEOUT)
+    return neighbors
+
+
+def invalidate(keys):
+    """Drop the cached neighbor lists of the given objects.
+
+    keys is an iterable of (content type ID, object ID) pairs.
+
+    """
+    if is_enabled():
+        conf.get_cache().delete_many([cache_key(key) for key in set(keys)])
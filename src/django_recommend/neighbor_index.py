@@ -0,0 +1,215 @@
+# coding: utf-8
+"""A read-only neighbor index in a memory-mapped file.
+
+export() writes every object's neighbors, best first, to one binary file.
+With RECOMMEND_NEIGHBOR_INDEX set to that file's path, similar_objects()
+reads neighbor lists from it instead of the database. The file is mapped
+with mmap, so all processes on a host share one copy in the page cache, and
+a lookup is a binary search and a slice, with no query.
+
+The index is a snapshot: score changes only show up once it's exported
+again (see the recommend_export_index command). Exporting replaces the file
+atomically, and running processes switch to the new file on their next
+lookup.
+
+File layout, all little-endian:
+
+- header: magic ``DRNI``, format version (uint32), number of objects
+  (uint64), number of neighbors (uint64)
+- neighbors: (content type ID uint32, object ID int64, score float32) for
+  every object, grouped by object, best first
+- keys: (content type ID uint32, object ID int64) of each object, sorted
+- offsets: index of each object's first neighbor (uint64), plus the total
+  number of neighbors, so object i's neighbors are offsets[i] to
+  offsets[i + 1]
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from . import models
+from .conf import settings
+
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'DRNI'
+VERSION = 1
+
+# struct needs native strings on Python 2.
+HEADER = struct.Struct(str('<4sIQQ'))
+NEIGHBOR = struct.Struct(str('<Iqf'))
+KEY = struct.Struct(str('<Iq'))
+OFFSET = struct.Struct(str('<Q'))
+
+# Opened indexes by path, with the (inode, mtime, size) they were opened at.
+_OPENED = {}
+
+# Paths that have been logged as missing, and haven't turned up since.
+_MISSING = set()
+
+
+def neighbor_rows(keys=None):
+    """Yield (key, neighbor key, score) for every stored similarity.
+
+    Each similarity is yielded once in each direction. Rows are ordered by
+    key, then best score first, then neighbor key. If keys is given, only
+    the neighbors of those (content type ID, object ID) pairs are yielded.
+
+    """
+    sides = [(1, 2)] if models.is_symmetric() else [(1, 2), (2, 1)]
+    streams = []
+    for side, other_side in sides:
+        fields = ['object_{}_content_type'.format(side),
+                  'object_{}_id'.format(side), 'score',
+                  'object_{}_content_type'.format(other_side),
+                  'object_{}_id'.format(other_side)]
+        order = fields[:2] + ['-score'] + fields[3:]
+        sims = models.ObjectSimilarity.objects.order_by(*order)
+        if keys is None:
+            querysets = [sims]
+        else:
+            querysets = [sims.filter(lookup) for lookup in
+                         models.key_filters(keys, *fields[:2])]
+        for qset in querysets:
+            rows = qset.values_list(*fields).iterator()
+            streams.append(
+                ((ctype_id, obj_id), -score, (other_ctype_id, other_id))
+                for ctype_id, obj_id, score, other_ctype_id, other_id in rows)
+
+    for key, negative_score, other_key in heapq.merge(*streams):
+        yield key, other_key, -negative_score
+
+
+def export(path, size=None):
+    """Write all stored similarities to a neighbor index file at path.
+
+    With size given, only each object's size best neighbors are kept. The
+    file is written next to path and then renamed over it, so readers never
+    see a partial index.
+
+    Returns a (number of objects, number of neighbors) tuple.
+
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            keys = []
+            offsets = []
+            count = 0
+            for key, rows in itertools.groupby(neighbor_rows(),
+                                               key=lambda row: row[0]):
+                keys.append(key)
+                offsets.append(count)
+                for _, (ctype_id, obj_id), score in itertools.islice(
+                        rows, size):
+                    out.write(NEIGHBOR.pack(ctype_id, obj_id, score))
+                    count += 1
+            offsets.append(count)
+            for key in keys:
+                out.write(KEY.pack(*key))
+            for offset in offsets:
+                out.write(OFFSET.pack(offset))
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, len(keys), count))
+        # mkstemp() makes the file private; other users' workers read it.
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(keys), count
+
+
+class NeighborIndex(object):
+    """A neighbor index file, mapped into memory."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.data = mmap.mmap(index_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, version, self.objects, self.neighbors = HEADER.unpack_from(
+            self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a neighbor index.'.format(path))
+        self.keys_start = HEADER.size + self.neighbors * NEIGHBOR.size
+        self.offsets_start = self.keys_start + self.objects * KEY.size
+
+    def __len__(self):
+        return self.objects
+
+    def find(self, key):
+        """Get the position of key among the indexed objects, or None."""
+        low, high = 0, self.objects
+        while low < high:
+            middle = (low + high) // 2
+            found = KEY.unpack_from(
+                self.data, self.keys_start + middle * KEY.size)
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def get_neighbors(self, key, limit=None):
+        """Get key's neighbors, as (content type ID, object ID, score) tuples.
+
+        key is a (content type ID, object ID) pair. Neighbors are best first,
+        and there are at most limit of them, if it's given. Objects with no
+        neighbors get an empty list.
+
+        """
+        position = self.find(tuple(key))
+        if position is None:
+            return []
+        start, end = struct.unpack_from(
+            str('<QQ'), self.data, self.offsets_start + position * OFFSET.size)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [NEIGHBOR.unpack_from(self.data,
+                                     HEADER.size + i * NEIGHBOR.size)
+                for i in range(start, end)]
+
+
+def get_index():
+    """Get the index named by RECOMMEND_NEIGHBOR_INDEX, or None.
+
+    The file is opened once per process, and again if it's been replaced.
+    The old mapping isn't closed here, since other threads may still be
+    reading it; it's unmapped once the last reference to it goes.
+
+    If the setting is empty or the file is missing, returns None, so callers
+    can fall back to the database. A missing file is only logged once, until
+    it turns up.
+
+    """
+    path = settings.RECOMMEND_NEIGHBOR_INDEX
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        if path not in _MISSING:
+            _MISSING.add(path)
+            LOG.warning('Neighbor index %s is missing; using the database.',
+                        path)
+        return None
+    _MISSING.discard(path)
+    identity = stat.st_ino, stat.st_mtime, stat.st_size
+    opened = _OPENED.get(path)
+    if opened is None or opened[0] != identity:
+        opened = identity, NeighborIndex(path)
+        _OPENED[path] = opened
+    return opened[1]
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""The ObjectNorm model, for normalized metrics in incremental mode."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db import router
+from django.db import transaction
+from django.utils.encoding import python_2_unicode_compatible
+
+from .models import (MAX_QUERY_PARAMS, NO_RELATED_NAME, chunked, key_filters,
+                     round_zero, update_scores)
+
+
+@python_2_unicode_compatible
+class ObjectNorm(models.Model):
+    """The sum of the squares of all scores given to an object.
+
+    Maintained in incremental mode (see the incremental module) for
+    normalized metrics. For example, the cosine similarity of two objects is
+    their ObjectSimilarity score divided by the square root of each object's
+    sum_squares.
+
+    """
+    object_id = models.IntegerField()
+    object_content_type = models.ForeignKey(ContentType,
+                                            related_name=NO_RELATED_NAME)
+    object = GenericForeignKey('object_content_type', 'object_id')
+
+    sum_squares = models.FloatField()
+
+    class Meta:
+        unique_together = ('object_content_type', 'object_id')
+
+    @classmethod
+    def get_many(cls, keys):
+        """Get the sum_squares of each (content type ID, object ID) key.
+
+        Returns a dict; objects with no stored norm map to 0.
+
+        """
+        norms = dict.fromkeys(keys, 0)
+        for lookup in key_filters(norms):
+            rows = cls.objects.filter(lookup).values_list(
+                'object_content_type', 'object_id', 'sum_squares')
+            for ctype_id, obj_id, sum_squares in rows:
+                norms[ctype_id, obj_id] = sum_squares
+        return norms
+
+    @classmethod
+    def add_many(cls, deltas):
+        """Add to the sum_squares of many objects at once.
+
+        deltas maps (content type ID, object ID) keys to amounts. Norms that
+        end up at 0 (within SCORE_EPSILON) are deleted. Like
+        ObjectSimilarity.add_many(), the existing rows are locked while
+        they're updated.
+
+        """
+        db_alias = router.db_for_write(cls)
+        with transaction.atomic(using=db_alias):
+            norms = cls.objects.using(db_alias).select_for_update()
+            existing = {}
+            for lookup in key_filters(deltas):
+                rows = norms.filter(lookup).values_list(
+                    'object_content_type', 'object_id', 'pk', 'sum_squares')
+                for ctype_id, obj_id, norm_pk, sum_squares in rows:
+                    existing[ctype_id, obj_id] = norm_pk, sum_squares
+
+            to_delete = []
+            to_update = {}
+            to_create = []
+            for key, delta in deltas.items():
+                norm_pk, old_sum = existing.get(key, (None, 0))
+                new_sum = round_zero(old_sum + delta)
+                if norm_pk is None:
+                    if new_sum != 0:
+                        to_create.append(cls(
+                            object_content_type_id=key[0], object_id=key[1],
+                            sum_squares=new_sum))
+                elif new_sum == 0:
+                    to_delete.append(norm_pk)
+                elif new_sum != old_sum:
+                    to_update[norm_pk] = new_sum
+
+            norms = cls.objects.using(db_alias)
+            for chunk in chunked(sorted(to_delete), MAX_QUERY_PARAMS):
+                norms.filter(pk__in=chunk).delete()
+            norms.bulk_create(to_create)
+            update_scores(norms, to_update, field='sum_squares')
+
+    def __str__(self):
+        return '{}, {}: {}'.format(self.object_content_type_id,
+                                   self.object_id, self.sum_squares)
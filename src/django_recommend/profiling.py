@@ -0,0 +1,97 @@
+# coding: utf-8
+"""Capture cProfile stats for some update_similarity runs.
+
+Nothing is profiled unless RECOMMEND_PROFILE_DIR names a directory. Then a
+run is saved there if either:
+
+- it was picked at random, with probability RECOMMEND_PROFILE_SAMPLE_RATE
+  (0 to 1), or
+
+- it took at least RECOMMEND_PROFILE_THRESHOLD seconds. There's no telling
+  in advance which runs will be slow, so with a threshold set, every run is
+  profiled, and the stats of the fast ones are thrown away.
+
+Files are named after the object key and the time the run started, like
+``12-345-20150801T120000.123456.prof``. Load them with pstats, or summarize
+them with the recommend_profiles command.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import cProfile
+import contextlib
+import datetime
+import errno
+import glob
+import logging
+import os.path
+import pstats
+import random
+import timeit
+
+from .conf import settings
+
+
+LOG = logging.getLogger(__name__)
+
+
+def profile_path(directory, key, started):
+    """Get the file name for a profile of key's run started at started."""
+    name = '{}-{}-{}.prof'.format(key[0], key[1],
+                                  started.strftime('%Y%m%dT%H%M%S.%f'))
+    return os.path.join(directory, name)
+
+
+def make_directory(directory):
+    """Create directory if it doesn't exist yet."""
+    try:
+        os.makedirs(directory)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+@contextlib.contextmanager
+def profile(key):
+    """Profile the block, if the settings call for it.
+
+    key is the (content type ID, object ID) pair the block works on. The
+    stats are written when the block finishes, even if it raises.
+
+    """
+    directory = settings.RECOMMEND_PROFILE_DIR
+    threshold = settings.RECOMMEND_PROFILE_THRESHOLD
+    sampled = (directory and
+               random.random() < settings.RECOMMEND_PROFILE_SAMPLE_RATE)
+    if not sampled and not (directory and threshold is not None):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    started = datetime.datetime.utcnow()
+    start_time = timeit.default_timer()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = timeit.default_timer() - start_time
+        if sampled or elapsed >= threshold:
+            make_directory(directory)
+            path = profile_path(directory, key, started)
+            profiler.dump_stats(path)
+            LOG.info('Saved profile of %.1f s run to %s', elapsed, path)
+
+
+def load_profiles(directory, stream=None):
+    """Combine all profiles saved in directory into one pstats.Stats.
+
+    Returns a (Stats, number of files) tuple, or (None, 0) if there are no
+    profiles. stream is where the Stats object prints to.
+
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    if not paths:
+        return None, 0
+    return pstats.Stats(*paths, stream=stream), len(paths)
@@ -0,0 +1,221 @@
+# coding: utf-8
+"""Limit how many neighbors are stored for each object.
+
+RECOMMEND_MAX_NEIGHBORS sets the limit for all objects, and
+RECOMMEND_MAX_NEIGHBORS_PER_MODEL maps 'app_label.modelname' strings to limits
+for particular models. A limit of None means no limit.
+
+Since each similarity is shared by two objects, a similarity is kept if it is
+among the top neighbors of either object. Neighbors are ranked by descending
+score, with ties broken by content type ID and object ID.
+
+Similarities are identified by their (key_1, key_2) pair of object keys, with
+key_1 < key_2, whichever RECOMMEND_SIMILARITY_LAYOUT stores them.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from . import memory_index
+from . import models
+from . import neighbor_cache
+from .conf import settings
+
+
+def is_enabled():
+    """Check whether any neighbor limit is configured."""
+    return (settings.RECOMMEND_MAX_NEIGHBORS is not None or
+            bool(settings.RECOMMEND_MAX_NEIGHBORS_PER_MODEL))
+
+
+def get_limit(ctype_id):
+    """Get the neighbor limit for objects of the given content type."""
+    per_model = settings.RECOMMEND_MAX_NEIGHBORS_PER_MODEL
+    if per_model:
+        ctype = ContentType.objects.get_for_id(ctype_id)
+        label = '{}.{}'.format(ctype.app_label, ctype.model)
+        if label in per_model:
+            return per_model[label]
+    return settings.RECOMMEND_MAX_NEIGHBORS
+
+
+def pair_of(key_a, key_b):
+    """Get the (key_1, key_2) pair that identifies a similarity."""
+    return min(key_a, key_b), max(key_a, key_b)
+
+
+def top_neighbors(key, neighbors):
+    """Get the pairs of the similarities that key should keep.
+
+    neighbors maps pairs to (score, other key) tuples.
+
+    """
+    limit = get_limit(key[0])
+    if limit is None:
+        return set(neighbors)
+    ranked = sorted(neighbors, key=lambda pair: (-neighbors[pair][0],
+                                                 neighbors[pair][1]))
+    return set(ranked[:limit])
+
+
+def kept_pairs(totals, keys):
+    """Get the pairs in totals that the objects in keys keep.
+
+    totals maps (key_1, key_2) pairs to scores, like the result of
+    rebuild.calculate_similarities(), and must have every similarity of the
+    objects in keys. Objects with no limit keep all of their similarities,
+    which are left out.
+
+    """
+    neighbors = {}
+    for pair, score in totals.items():
+        if score != 0:
+            key_1, key_2 = pair
+            if key_1 in keys:
+                neighbors.setdefault(key_1, {})[pair] = score, key_2
+            if key_2 in keys:
+                neighbors.setdefault(key_2, {})[pair] = score, key_1
+
+    keep = set()
+    for key, key_neighbors in neighbors.items():
+        if get_limit(key[0]) is not None:
+            keep |= top_neighbors(key, key_neighbors)
+    return keep
+
+
+def prune_totals(totals, kept):
+    """Drop the pairs that no neighbor limit keeps from a dict of totals.
+
+    kept is the set of pairs that objects with limits keep, from
+    kept_pairs(). Pairs of an object with no limit are kept too, and pairs
+    with a score of 0 are dropped.
+
+    """
+    limits = {}
+
+    def unlimited(key):
+        """Check whether key's object keeps all of its similarities."""
+        if key[0] not in limits:
+            limits[key[0]] = get_limit(key[0])
+        return limits[key[0]] is None
+
+    return {pair: score for pair, score in totals.items()
+            if score != 0 and (pair in kept or unlimited(pair[0]) or
+                               unlimited(pair[1]))}
+
+
+def load_neighbors(keys):
+    """Get the stored similarities of each object in keys.
+
+    Returns a dict mapping each key to a dict of {pair: (score, other key)}.
+    Runs one query per content type (or per MAX_QUERY_PARAMS / 2 objects).
+
+    """
+    neighbors = {key: {} for key in keys}
+    ids_by_ctype = {}
+    for ctype_id, obj_id in keys:
+        ids_by_ctype.setdefault(ctype_id, []).append(obj_id)
+
+    # With the symmetric layout, each object's rows have it as object_1.
+    symmetric = models.is_symmetric()
+    for ctype_id, obj_ids in ids_by_ctype.items():
+        for chunk in models.chunked(obj_ids, models.MAX_QUERY_PARAMS // 2):
+            lookup = Q(object_1_content_type=ctype_id, object_1_id__in=chunk)
+            if not symmetric:
+                lookup |= Q(object_2_content_type=ctype_id,
+                            object_2_id__in=chunk)
+            rows = models.ObjectSimilarity.objects.filter(
+                lookup
+            ).order_by().values_list(
+                'object_1_content_type', 'object_1_id',
+                'object_2_content_type', 'object_2_id', 'score')
+            for ctype_1, id_1, ctype_2, id_2, score in rows:
+                key_1, key_2 = (ctype_1, id_1), (ctype_2, id_2)
+                pair = pair_of(key_1, key_2)
+                if key_1 in neighbors:
+                    neighbors[key_1][pair] = score, key_2
+                if key_2 in neighbors and not symmetric:
+                    neighbors[key_2][pair] = score, key_1
+    return neighbors
+
+
+def delete_similarities(pairs):
+    """Delete the similarities identified by the given pairs."""
+    directions = [direction for pair in sorted(pairs)
+                  for direction in models.stored_directions(*pair)]
+    # Each direction's lookup takes four parameters.
+    for chunk in models.chunked(directions, models.MAX_QUERY_PARAMS // 4):
+        lookup = Q()
+        for key_1, key_2 in chunk:
+            lookup |= Q(object_1_content_type=key_1[0], object_1_id=key_1[1],
+                        object_2_content_type=key_2[0], object_2_id=key_2[1])
+        models.ObjectSimilarity.objects.filter(lookup).delete()
+
+
+def prune(keys):
+    """Delete similarities of the objects in keys that no limit keeps.
+
+    Use this after writing similarities between the objects in keys. Only
+    the rankings of those objects can have changed, so only their
+    similarities are checked.
+
+    Returns the number of similarities deleted.
+
+    """
+    neighbors = load_neighbors(set(keys))
+    keep = set()
+    candidates = {}
+    for key, key_neighbors in neighbors.items():
+        top = top_neighbors(key, key_neighbors)
+        keep |= top
+        for pair, (_, other_key) in key_neighbors.items():
+            if pair not in top:
+                candidates[pair] = other_key
+
+    # A similarity outside one object's top neighbors survives if it is among
+    # the other object's top neighbors.
+    others = {other_key for pair, other_key in candidates.items()
+              if pair not in keep and other_key not in neighbors}
+    for key, key_neighbors in load_neighbors(others).items():
+        keep |= top_neighbors(key, key_neighbors)
+
+    doomed = [pair for pair in candidates if pair not in keep]
+    delete_similarities(doomed)
+    stale = {key for pair in doomed for key in pair}
+    neighbor_cache.invalidate(stale)
+    memory_index.record_changes(stale)
+    return len(doomed)
+
+
+def prune_all(batch_size=400):
+    """Delete all stored similarities that no neighbor limit keeps.
+
+    Neighbors are loaded for batch_size objects per query. Returns the number
+    of similarities deleted.
+
+    """
+    sims = models.ObjectSimilarity.objects.order_by()
+    keys = set(sims.values_list(
+        'object_1_content_type', 'object_1_id').distinct())
+    keys.update(sims.values_list(
+        'object_2_content_type', 'object_2_id').distinct())
+
+    keep = set()
+    for batch in models.chunked(sorted(keys), batch_size):
+        for key, key_neighbors in load_neighbors(batch).items():
+            keep |= top_neighbors(key, key_neighbors)
+
+    rows = sims.values_list('object_1_content_type', 'object_1_id',
+                            'object_2_content_type', 'object_2_id')
+    doomed = set()
+    for ctype_1, id_1, ctype_2, id_2 in rows.iterator():
+        pair = pair_of((ctype_1, id_1), (ctype_2, id_2))
+        if pair not in keep:
+            doomed.add(pair)
+    delete_similarities(doomed)
+    neighbor_cache.invalidate(keys)
+    memory_index.record_changes(keys)
+    return len(doomed)
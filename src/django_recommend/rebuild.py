@@ -0,0 +1,465 @@
+# coding: utf-8
+"""Rebuild all ObjectSimilarity data from UserScore.
+
+Similarities are added up in memory for one partition of the scored objects
+at a time, so memory use depends on the partition size rather than on the
+number of pairs. Scores are read again for each partition.
+
+By default, the table is emptied and refilled in one transaction. With
+shadow=True, the similarities are written to a new table instead (see
+SimilarityGeneration), with bulk inserts and no secondary indexes. The
+indexes are built once it's full, and then it is renamed over the live
+table, so readers see either all of the old similarities or all of the new
+ones, and the live table never has rows churned through it. The swap is
+atomic on databases with transactional DDL, like PostgreSQL and SQLite.
+
+Similarities written by other processes while a shadow table is filled are
+lost when it's swapped in, so pause updates (e.g. by setting
+RECOMMEND_ENABLE_AUTOCALC = False) during the rebuild. Only one shadow
+rebuild may run at a time. A rebuild's table is only taken for abandoned,
+and dropped by the next one, once RECOMMEND_SHADOW_REBUILD_TIMEOUT seconds
+have passed since it started.
+
+The shadow table's secondary indexes are named after the live table, plus
+one of two slots, which alternate between rebuilds. So their names don't
+clash with the live table's indexes while both tables exist, and don't
+mention the generation. On PostgreSQL, the primary key, the other
+constraints and the ID sequence are renamed after the live table during the
+swap.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import datetime
+import hashlib
+import itertools
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db import router
+from django.db import transaction
+from django.db.backends.utils import truncate_name
+from django.db.migrations.state import ModelState, ProjectState
+from django.db.models import Q
+from django.utils import timezone
+
+from . import incremental
+from . import memory_index
+from . import models
+from . import neighbor_cache
+from . import pruning
+from .conf import settings
+
+# Secondary indexes of a shadow table are named after one of these slots:
+# whichever the live table's indexes aren't using.
+INDEX_SLOTS = ('a', 'b')
+
+
+def stream_scores(chunk_size):
+    """Yield (user, content type ID, object ID, score) for all UserScores.
+
+    Rows are ordered by user. They are read chunk_size rows at a time, with
+    each chunk starting after the last (user, pk) of the previous one, so
+    memory use doesn't depend on the size of the table.
+
+    """
+    scores = models.UserScore.objects.order_by('user', 'pk')
+    last_user = last_pk = None
+    while True:
+        chunk = scores
+        if last_pk is not None:
+            chunk = chunk.filter(Q(user__gt=last_user) |
+                                 Q(user=last_user, pk__gt=last_pk))
+        chunk = chunk.values_list(
+            'user', 'pk', 'object_content_type', 'object_id', 'score')
+        count = 0
+        for user, score_pk, ctype_id, obj_id, score in (
+                chunk[:chunk_size].iterator()):
+            count += 1
+            last_user, last_pk = user, score_pk
+            yield user, ctype_id, obj_id, score
+        if count < chunk_size:
+            return
+
+
+def object_keys():
+    """Get the sorted (content type ID, object ID) keys of scored objects."""
+    return sorted(models.UserScore.objects.order_by().values_list(
+        'object_content_type', 'object_id').distinct().iterator())
+
+
+def calculate_similarities(rows, keys=None, either=False):
+    """Get the dot product similarity of all pairs of objects in rows.
+
+    rows are (user, content type ID, object ID, score) tuples, grouped by
+    user, as given by stream_scores(). Returns a dict mapping (key_1, key_2)
+    pairs to scores, where key_1 < key_2 (see models.object_key()). Pairs
+    with no users in common are left out.
+
+    With keys, a set of object keys, only the pairs whose key_1 is in keys
+    are added up, or with either=True, the pairs with either key in keys.
+
+    """
+    totals = collections.defaultdict(float)
+    for _, user_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        user_scores = sorted(((ctype_id, obj_id), score)
+                             for _, ctype_id, obj_id, score in user_rows)
+        for i, (key_1, score_1) in enumerate(user_scores):
+            first = keys is None or key_1 in keys
+            if not (first or either):
+                continue
+            for key_2, score_2 in user_scores[i + 1:]:
+                if first or key_2 in keys:
+                    totals[key_1, key_2] += score_1 * score_2
+    return totals
+
+
+def partition_totals(read_scores, keys, partition_size):
+    """Yield the totals of all similarities, one partition at a time.
+
+    keys, the sorted keys of all scored objects, are split into partitions
+    of partition_size objects. Each partition's totals are a dict like
+    calculate_similarities() gives, for the pairs whose key_1 is in it, so
+    only one partition's pairs are held at a time. read_scores is called
+    for a new iterator of scores, like stream_scores(), for each partition.
+
+    Neighbor limits (see the pruning module) are applied to each partition.
+    A pair may be kept by its key_2, whose similarities are spread over
+    other partitions, so with limits, the pairs each object keeps are found
+    in an extra pass over the partitions first.
+
+    """
+    partitions = [set(part) for part in models.chunked(keys, partition_size)]
+    limited = pruning.is_enabled()
+    kept = set()
+    if limited:
+        for part in partitions:
+            totals = calculate_similarities(read_scores(), part, either=True)
+            kept |= pruning.kept_pairs(totals, part)
+    for part in partitions:
+        totals = calculate_similarities(read_scores(), part)
+        if limited:
+            totals = pruning.prune_totals(totals, kept)
+        yield totals
+
+
+def insert_similarities(manager, parts, batch_size, progress=None):
+    """Bulk insert the totals in parts with manager, batch_size at a time.
+
+    parts is an iterable of dicts of totals, like partition_totals() gives.
+    Returns the number of similarities written; with the 'symmetric' layout,
+    that's half the number of rows. progress is called with the same count
+    after each batch.
+
+    """
+    def make_sims():
+        """Build unsaved instances for the totals."""
+        for totals in parts:
+            for pair, score in totals.items():
+                if score == 0:
+                    continue
+                for key_1, key_2 in models.stored_directions(*pair):
+                    yield manager.model(
+                        object_1_content_type_id=key_1[0],
+                        object_1_id=key_1[1],
+                        object_2_content_type_id=key_2[0],
+                        object_2_id=key_2[1], score=score)
+
+    sims = make_sims()
+    rows_per_similarity = 2 if models.is_symmetric() else 1
+
+    written = 0
+    if progress is not None:
+        progress('write', written)
+    while True:
+        batch = list(itertools.islice(sims, batch_size))
+        if not batch:
+            break
+        manager.bulk_create(batch)
+        written += len(batch)
+        if progress is not None:
+            progress('write', written // rows_per_similarity)
+    return written // rows_per_similarity
+
+
+def stored_keys(manager):
+    """Get the keys of all objects with similarities stored by manager."""
+    keys = set(manager.order_by().values_list(
+        'object_1_content_type', 'object_1_id').distinct())
+    keys.update(manager.order_by().values_list(
+        'object_2_content_type', 'object_2_id').distinct())
+    return keys
+
+
+def tracks_changes():
+    """Check whether the keys of the changed similarities are needed."""
+    return neighbor_cache.is_enabled() or memory_index.is_enabled()
+
+
+def similarities_changed(keys):
+    """Invalidate the keys' cached neighbor lists, and record the change."""
+    neighbor_cache.invalidate(keys)
+    memory_index.record_changes(keys)
+
+
+def write_similarities(parts, batch_size, progress=None):
+    """Replace all stored similarities with the totals in parts.
+
+    The table is emptied and refilled with bulk inserts of batch_size rows,
+    in one transaction. Returns the number of similarities written; with the
+    'symmetric' layout, that's half the number of rows.
+
+    """
+    db_alias = router.db_for_write(models.ObjectSimilarity)
+    with transaction.atomic(using=db_alias):
+        manager = models.ObjectSimilarity.objects.using(db_alias)
+        if tracks_changes():
+            stale = stored_keys(manager)
+        manager.all().delete()
+        written = insert_similarities(manager, parts, batch_size, progress)
+        if tracks_changes():
+            stale |= stored_keys(manager)
+    if tracks_changes():
+        similarities_changed(stale)
+    return written
+
+
+def shadow_model(table):
+    """Build a model like ObjectSimilarity, for the table named table.
+
+    The model has no indexes besides the primary key and the unique
+    constraint, so rows can be inserted before the rest are built (see
+    create_indexes()).
+
+    """
+    state = ModelState.from_model(models.ObjectSimilarity)
+    fields = []
+    for name, field in state.fields:
+        field = field.clone()
+        field.db_index = False
+        fields.append((name, field))
+    options = {'db_table': table,
+               'unique_together': state.options['unique_together']}
+
+    project = ProjectState()
+    project.add_model(ModelState.from_model(ContentType))
+    project.add_model(ModelState(
+        models.ObjectSimilarity._meta.app_label, 'ShadowSimilarity', fields,
+        options))
+    return project.apps.get_model(models.ObjectSimilarity._meta.app_label,
+                                  'ShadowSimilarity')
+
+
+def indexed_columns(model):
+    """Get the column lists of model's secondary indexes."""
+    opts = model._meta
+    columns = [(field.column,) for field in opts.local_fields
+               if field.db_index and not field.unique]
+    columns.extend(tuple(opts.get_field(name).column for name in names)
+                   for names in opts.index_together)
+    return columns
+
+
+def index_name(connection, slot, columns):
+    """Get the name of a shadow table index on columns, in slot."""
+    digest = hashlib.md5(','.join(columns).encode('utf-8')).hexdigest()
+    name = '{}_{}_{}'.format(models.ObjectSimilarity._meta.db_table, slot,
+                             digest[:8])
+    return truncate_name(name, connection.ops.max_name_length())
+
+
+def free_index_slot(connection):
+    """Get an index slot that the live table's indexes aren't using."""
+    live_table = models.ObjectSimilarity._meta.db_table
+    with connection.cursor() as cursor:
+        names = set(connection.introspection.get_constraints(
+            cursor, live_table))
+    columns = indexed_columns(models.ObjectSimilarity)
+    for slot in INDEX_SLOTS:
+        if not names.intersection(index_name(connection, slot, index)
+                                  for index in columns):
+            return slot
+    raise ValueError('Both index slots of {} are in use.'.format(live_table))
+
+
+def create_indexes(connection, table, slot):
+    """Build ObjectSimilarity's secondary indexes on table."""
+    quote = connection.ops.quote_name
+    with connection.schema_editor() as editor:
+        for columns in indexed_columns(models.ObjectSimilarity):
+            editor.execute(editor.sql_create_index % {
+                'name': quote(index_name(connection, slot, columns)),
+                'table': quote(table),
+                'columns': ', '.join(quote(column) for column in columns),
+                'extra': '',
+            })
+
+
+def rename_after_live_table(editor, connection, table):
+    """Rename what's named after table, now that it's the live table.
+
+    Only PostgreSQL names constraints and sequences after their table;
+    elsewhere, this does nothing.
+
+    """
+    if connection.vendor != 'postgresql':
+        return
+    quote = connection.ops.quote_name
+    live_table = models.ObjectSimilarity._meta.db_table
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, live_table)
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [
+            live_table, models.ObjectSimilarity._meta.pk.column])
+        sequence = cursor.fetchone()[0]
+
+    for name, info in constraints.items():
+        if not name.startswith(table):
+            continue
+        new_name = live_table + name[len(table):]
+        if info['index'] and not (info['primary_key'] or info['unique']):
+            editor.execute('ALTER INDEX {} RENAME TO {}'.format(
+                quote(name), quote(new_name)))
+        else:
+            editor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+                quote(live_table), quote(name), quote(new_name)))
+    if sequence:
+        # pg_get_serial_sequence() gives a quoted, schema-qualified name.
+        name = sequence.rsplit('.', 1)[-1].strip('"')
+        if name.startswith(table):
+            editor.execute('ALTER SEQUENCE {} RENAME TO {}'.format(
+                sequence, quote(live_table + name[len(table):])))
+
+
+def drop_table(connection, table):
+    """Drop table, if it exists."""
+    with connection.cursor() as cursor:
+        exists = table in connection.introspection.table_names(cursor)
+    if exists:
+        with connection.schema_editor() as editor:
+            editor.execute(editor.sql_delete_table % {
+                'table': editor.quote_name(table)})
+
+
+def drop_abandoned_generations(db_alias):
+    """Drop the tables of shadow rebuilds that never finished.
+
+    Rebuilds that started less than RECOMMEND_SHADOW_REBUILD_TIMEOUT seconds
+    ago may still be running, so they're left alone.
+
+    """
+    connection = connections[db_alias]
+    cutoff = timezone.now() - datetime.timedelta(
+        seconds=settings.RECOMMEND_SHADOW_REBUILD_TIMEOUT)
+    generations = models.SimilarityGeneration.objects.using(db_alias)
+    for generation in generations.filter(finished=None,
+                                         started__lt=cutoff):
+        drop_table(connection, generation.table_name())
+        drop_table(connection, generation.table_name() + '_old')
+        generation.delete()
+
+
+def swap_similarities(parts, batch_size, progress=None):
+    """Replace all stored similarities with parts, using a shadow table.
+
+    Returns the number of similarities written, like write_similarities().
+
+    """
+    db_alias = router.db_for_write(models.ObjectSimilarity)
+    connection = connections[db_alias]
+    drop_abandoned_generations(db_alias)
+    generation = models.SimilarityGeneration.objects.using(db_alias).create()
+    live_table = models.ObjectSimilarity._meta.db_table
+    table = generation.table_name()
+    old_table = table + '_old'
+
+    try:
+        bare_model = shadow_model(table)
+        with connection.schema_editor() as editor:
+            editor.create_model(bare_model)
+        shadow = bare_model.objects.using(db_alias)
+        written = insert_similarities(shadow, parts, batch_size, progress)
+        create_indexes(connection, table, free_index_slot(connection))
+
+        if tracks_changes():
+            stale = stored_keys(shadow) | stored_keys(
+                models.ObjectSimilarity.objects.using(db_alias))
+        with connection.schema_editor() as editor:
+            editor.alter_db_table(models.ObjectSimilarity, live_table,
+                                  old_table)
+            editor.alter_db_table(models.ObjectSimilarity, table, live_table)
+            editor.execute(editor.sql_delete_table % {
+                'table': editor.quote_name(old_table)})
+            rename_after_live_table(editor, connection, table)
+    except BaseException:
+        drop_table(connection, table)
+        generation.delete()
+        raise
+
+    generation.finished = timezone.now()
+    generation.similarities = written
+    generation.save()
+    if tracks_changes():
+        similarities_changed(stale)
+    return written
+
+
+def write_norms(norms, batch_size):
+    """Replace all stored ObjectNorms with norms, in one transaction.
+
+    norms maps (content type ID, object ID) keys to sums of squared scores.
+
+    """
+    db_alias = router.db_for_write(models.ObjectNorm)
+    with transaction.atomic(using=db_alias):
+        manager = models.ObjectNorm.objects.using(db_alias)
+        manager.all().delete()
+        manager.bulk_create(
+            (models.ObjectNorm(object_content_type_id=key[0],
+                               object_id=key[1], sum_squares=sum_squares)
+             for key, sum_squares in norms.items() if sum_squares != 0),
+            batch_size=batch_size)
+
+
+def rebuild(chunk_size=2000, batch_size=1000, progress=None, shadow=False,
+            partition_size=5000):
+    """Recalculate all similarity data from scratch.
+
+    Similarities are added up for partition_size objects at a time (see
+    partition_totals()), reading all scores once per partition, or twice
+    with neighbor limits. Neighbor limits (see the pruning module) are
+    applied before writing. In incremental mode, ObjectNorms are
+    recalculated too. With shadow=True, the similarities are written to a
+    shadow table and swapped in (see above).
+
+    progress, if given, is called with a stage name ('read' or 'write') and
+    the number of scores read or similarities written so far in that stage.
+    It is called with a count of 0 when each stage starts.
+
+    Returns the number of similarities stored.
+
+    """
+    norms = collections.defaultdict(float)
+    counts = collections.Counter()
+
+    def read_scores():
+        """Read all scores, adding up norms in the first pass."""
+        counts['passes'] += 1
+        for row in stream_scores(chunk_size):
+            if counts['passes'] == 1:
+                norms[row[1], row[2]] += row[3] ** 2
+            yield row
+            counts['read'] += 1
+            if progress is not None and counts['read'] % chunk_size == 0:
+                progress('read', counts['read'])
+
+    if progress is not None:
+        progress('read', 0)
+    parts = partition_totals(read_scores, object_keys(), partition_size)
+    write = swap_similarities if shadow else write_similarities
+    written = write(parts, batch_size, progress)
+    if incremental.is_enabled():
+        write_norms(norms, batch_size)
+    return written
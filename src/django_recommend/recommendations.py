@@ -0,0 +1,107 @@
+# coding: utf-8
+"""Recommend objects to a user from the neighbors of what they've scored.
+
+Each candidate object's rank is the sum, over the objects the user has
+scored, of the user's score for that object times its similarity to the
+candidate. Objects the user has already scored are never recommended.
+
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from . import models
+
+
+def rated_subqueries(user, ctype_ids, side):
+    """Match ObjectSimilarity rows whose object_<side> the user scored.
+
+    Uses one subquery per content type, so the number of parameters doesn't
+    grow with the user's history.
+
+    """
+    lookup = Q()
+    for ctype_id in sorted(ctype_ids):
+        rated_ids = models.UserScore.objects.filter(
+            user=user, object_content_type=ctype_id
+        ).values('object_id')
+        lookup |= Q(**{'object_{}_content_type'.format(side): ctype_id,
+                       'object_{}_id__in'.format(side): rated_ids})
+    return lookup
+
+
+def neighbor_rows(user, ctype_ids, target_ctype_id=None):
+    """Get (key, other key, score) for the similarities of rated objects.
+
+    Every similarity involving an object of the user's is included, once in
+    each direction, so the caller has to check which key was rated. Runs a
+    single query. If target_ctype_id is given, similarities with no object
+    of that content type opposite a rated object are left out.
+
+    """
+    symmetric = models.is_symmetric()
+    sides = [(1, 2)] if symmetric else [(1, 2), (2, 1)]
+    lookup = Q()
+    for rated_side, other_side in sides:
+        side_lookup = rated_subqueries(user, ctype_ids, rated_side)
+        if target_ctype_id is not None:
+            side_lookup &= Q(**{
+                'object_{}_content_type'.format(other_side): target_ctype_id})
+        lookup |= side_lookup
+
+    rows = models.ObjectSimilarity.objects.filter(lookup).order_by(
+    ).values_list('object_1_content_type', 'object_1_id',
+                  'object_2_content_type', 'object_2_id', 'score')
+    for ctype_1, id_1, ctype_2, id_2, score in rows.iterator():
+        key_1, key_2 = (ctype_1, id_1), (ctype_2, id_2)
+        yield key_1, key_2, score
+        if not symmetric:
+            yield key_2, key_1, score
+
+
+def rank(user, model=None):
+    """Rank the objects to recommend to user.
+
+    Returns a list of ((content type ID, object ID), rank) tuples, best
+    first, with ties broken by key.
+
+    """
+    rated = {(ctype_id, obj_id): score for ctype_id, obj_id, score in
+             models.UserScore.objects.filter(user=user).values_list(
+                 'object_content_type', 'object_id', 'score')}
+    if not rated:
+        return []
+
+    target_ctype_id = None
+    if model is not None:
+        target_ctype_id = ContentType.objects.get_for_model(model).pk
+
+    ranks = collections.defaultdict(float)
+    ctype_ids = {ctype_id for ctype_id, _ in rated}
+    for rated_key, candidate, score in neighbor_rows(user, ctype_ids,
+                                                     target_ctype_id):
+        # In the 'pairs' layout, each row is yielded once per direction.
+        if rated_key not in rated or candidate in rated:
+            continue
+        if target_ctype_id is not None and candidate[0] != target_ctype_id:
+            continue
+        ranks[candidate] += rated[rated_key] * score
+    return sorted(ranks.items(), key=lambda item: (-item[1], item[0]))
+
+
+def recommend(user, num, model=None):
+    """Get up to num objects to recommend to user, best first.
+
+    user is a user string as stored in UserScore. If model is given, only
+    instances of that model are recommended.
+
+    Runs a query for the user's scores, one for the neighbors of all of
+    them, and one per content type to load the recommended objects.
+
+    """
+    ranked = rank(user, model)[:num]
+    return models.get_instances([key for key, _ in ranked])
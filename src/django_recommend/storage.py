@@ -5,29 +5,75 @@ from __future__ import (absolute_import, division, print_function,
 
 import logging
 
-import django.core.exceptions
 from django.contrib.contenttypes import models as ct_models
 
 import django_recommend
-from . import conf
+from . import instrumentation
 from . import models
+from . import pruning
 
 
 LOG = logging.getLogger(__name__)
 
 
 class ResultStorage(object):  # pylint: disable=too-few-public-methods
-    """Write items to the Django database."""
+    """Write items to the Django database.
 
-    def __setitem__(self, key, val):
-        models.ObjectSimilarity.set(*key, score=val)
-        LOG.debug('Setting %s to %s', key, val)
+    By default every result is written as soon as it is set. With
+    buffered=True, results are kept in memory until flush() writes them all
+    in one transaction with ObjectSimilarity.set_many().
+
+    Either way, flush() must be called when done, to apply any neighbor limits
+    (see the pruning module) to the objects that were written.
+
+    pairs counts the results set, and rows the ObjectSimilarity rows written
+    for them so far. Unbuffered, rows deleted for scores of 0 aren't counted,
+    since Django 1.8's delete() doesn't say how many rows it removed.
+
+    The instrumentation sinks are looked up once, when it's created.
 
+    """
 
-def get_object(ctype_id, obj_id):
-    """Get a model from a ContentType and an object ID."""
-    ctype = ct_models.ContentType.objects.get(pk=ctype_id)
-    return ctype.model_class().objects.get(pk=obj_id)
+    def __init__(self, buffered=False):
+        self.buffered = buffered
+        self.sinks = instrumentation.get_sinks()
+        self.pending = {}
+        self.touched = set()
+        self.pairs = 0
+        self.rows = 0
+
+    def __setitem__(self, key, val):
+        LOG.debug('Setting %s to %s', key, val)
+        obj_a, obj_b = key
+        pair = models.object_key(obj_a), models.object_key(obj_b)
+        self.touched.update(pair)
+        self.pairs += 1
+        if self.buffered:
+            self.pending[pair] = val
+        elif not self.sinks:
+            models.ObjectSimilarity.set(obj_a, obj_b, score=val)
+            self.rows += len(models.stored_directions(*pair)) if val else 0
+        else:
+            with instrumentation.measure('result_storage.write',
+                                         sinks=self.sinks) as recording:
+                models.ObjectSimilarity.set(obj_a, obj_b, score=val)
+                rows = len(models.stored_directions(*pair)) if val else 0
+                recording.count('rows', rows)
+            self.rows += rows
+
+    def flush(self):
+        """Write any buffered results, then apply neighbor limits."""
+        if self.pending:
+            with instrumentation.measure('result_storage.flush',
+                                         sinks=self.sinks) as recording:
+                rows = models.ObjectSimilarity.set_many(self.pending)
+                recording.count('pairs', len(self.pending))
+                recording.count('rows', rows)
+            self.rows += rows
+            self.pending = {}
+        if self.touched and pruning.is_enabled():
+            pruning.prune(self.touched)
+        self.touched = set()
 
 
 class ObjectData(object):  # pylint: disable=too-few-public-methods
@@ -35,35 +81,83 @@ class ObjectData(object):  # pylint: disable=too-few-public-methods
 
     def __init__(self, obj):
         self.obj = obj
+        self.scores = {}
 
     def keys(self):
         """All objects worth considering."""
         return list(iter(self))
 
     def __getitem__(self, item):
-        """Get all scores for a particular object."""
-        return django_recommend.scores_for(item)
+        """Get all scores for a particular object.
 
-    def __iter__(self):
-        ctype = ct_models.ContentType.objects.get_for_model(self.obj)
+        Scores for the objects found by the last iteration are served from
+        memory; anything else is looked up.
 
-        # Get all users who rated this object
-        relevant_users = models.UserScore.objects.filter(
-            object_content_type=ctype, object_id=self.obj.pk
-        ).values_list('user', flat=True).distinct()
+        """
+        try:
+            return self.scores[item]
+        except KeyError:
+            return django_recommend.scores_for(item)
+
+    def relevant_objects(self):
+        """Get the keys of all objects rated by users who rated self.obj.
 
-        # Get all objects that those users have rated
-        relevant_objects = models.UserScore.objects.filter(
-            user__in=relevant_users
+        Returns a queryset of (content type ID, object ID) pairs. Both halves
+        of the query are answered from UserScore's covering indexes.
+
+        """
+        # Get all objects that the users who rated this object have rated
+        return models.UserScore.objects.filter(
+            user__in=self.relevant_users()
         ).values_list(
             'object_content_type', 'object_id'
         ).distinct()
 
-        for args in relevant_objects:
-            try:
-                yield get_object(*args)
-            except django.core.exceptions.ObjectDoesNotExist:
-                if conf.settings.RECOMMEND_PURGE_MISSING_DATA:
-                    django_recommend.forget_object(*args)
-                else:
-                    raise
+    def relevant_users(self):
+        """Get a queryset of the users who rated self.obj."""
+        ctype = ct_models.ContentType.objects.get_for_model(self.obj)
+        return models.UserScore.objects.filter(
+            object_content_type=ctype, object_id=self.obj.pk
+        ).values_list('user', flat=True).distinct()
+
+    def star_scores(self):
+        """Get the scores that self.obj's similarities depend on.
+
+        A dot product only sums over the users who rated both objects, so
+        only the scores of users who rated self.obj are needed. Returns
+        {(content type ID, object ID): {user: score}} for self.obj and every
+        object those users rated, from one query.
+
+        """
+        label = instrumentation.format_key(models.object_key(self.obj))
+        with instrumentation.measure('object_data', label) as recording:
+            rows = models.UserScore.objects.filter(
+                user__in=self.relevant_users()
+            ).values_list(
+                'object_content_type', 'object_id', 'user', 'score')
+            scores = {}
+            count = 0
+            for ctype_id, obj_id, user, score in rows:
+                scores.setdefault((ctype_id, obj_id), {})[user] = score
+                count += 1
+            recording.count('objects', len(scores))
+            recording.count('scores', count)
+        return scores
+
+    def __iter__(self):
+        label = instrumentation.format_key(models.object_key(self.obj))
+        with instrumentation.measure('object_data', label) as recording:
+            relevant_objects = self.relevant_objects()
+
+            # Load the objects with one query per content type. Missing
+            # objects are purged or raise ObjectDoesNotExist, per
+            # RECOMMEND_PURGE_MISSING_DATA.
+            objs = models.get_instances(list(relevant_objects))
+
+            # Prefetch every score pyrecommend will ask for, in one query.
+            self.scores = django_recommend.scores_for_many(objs)
+            recording.count('objects', len(objs))
+            recording.count('scores', sum(
+                len(scores) for scores in self.scores.values()))
+        for obj in objs:
+            yield obj
@@ -7,9 +7,15 @@ import logging
 import threading
 import time
 
-import pyrecommend.similarity
 from django.contrib.contenttypes import models as ct_models
-
+from django.db.models import signals as model_signals
+
+from . import conf
+from . import engines
+from . import incremental
+from . import instrumentation
+from . import models
+from . import profiling
 from . import storage
 from .conf import settings
 
@@ -25,7 +31,7 @@ try:
     from celery import shared_task
 except ImportError:
     def shared_task(func):
-        """Add a mock 'delay' method."""
+        """Add mock 'delay' and 'apply_async' methods."""
 
         def delay(*args):  # pragma: no cover
             """For debugging; update suggestions in background thread."""
@@ -40,7 +46,20 @@ except ImportError:
             proc = threading.Thread(target=delayed, args=args)
             proc.start()
 
+        def apply_async(args=(), countdown=0):
+            """For debugging; run the task in a thread after countdown secs.
+
+            Like delay(), this runs the task right away unless THREADED.
+
+            """
+            if not THREADED:
+                return func(*args)
+            timer = threading.Timer(countdown, func, args=args)
+            timer.daemon = True
+            timer.start()
+
         func.delay = delay
+        func.apply_async = apply_async
         return func
 
 
@@ -50,14 +69,62 @@ def signal_handler(**kwargs):
     This will figure out what asynchronous method is most appropriate to use.
     (E.g. celery, or if debugging Python threads, etc.)
 
+    In incremental mode, the change is applied to the stored similarities
+    right away instead.
+
     """
     if not settings.RECOMMEND_ENABLE_AUTOCALC:
         return
     user_score = kwargs['instance']
+    signal = kwargs.get('signal')
+    if incremental.is_enabled():
+        incremental.handle_signal(signal, user_score, kwargs.get('using'))
+        return
+    if signal is model_signals.pre_delete:
+        return
     content_type_id = user_score.object_content_type_id
     object_id = user_score.object_id
     params = object_id, content_type_id
-    update_similarity.delay(params)
+    schedule_update(params)
+
+
+def queue_updates(keys):
+    """Queue one similarity update per distinct object in keys.
+
+    keys are (content type ID, object ID) pairs. Like signal_handler, this
+    does nothing unless RECOMMEND_ENABLE_AUTOCALC is set.
+
+    """
+    if not settings.RECOMMEND_ENABLE_AUTOCALC:
+        return
+    for content_type_id, object_id in sorted(set(keys)):
+        schedule_update((object_id, content_type_id))
+
+
+def pending_key(obj_params):
+    """Get the cache key marking an update as queued for obj_params."""
+    return 'django_recommend:pending:{}:{}'.format(*obj_params)
+
+
+def schedule_update(obj_params):
+    """Queue update_similarity for an (object_id, content_type_id) tuple.
+
+    With RECOMMEND_COALESCE_WINDOW set to a number of seconds, the first
+    change to an object queues an update to run at the end of the window, and
+    further changes within the window are folded into that update. A marker
+    in the RECOMMEND_CACHE cache records the queued update, so this works
+    across processes when the cache is shared.
+
+    """
+    window = settings.RECOMMEND_COALESCE_WINDOW
+    if not window:
+        update_similarity.delay(obj_params)
+        return
+
+    # cache.add() only succeeds if the key isn't set, so only one process gets
+    # to queue the update.
+    if conf.get_cache().add(pending_key(obj_params), True, window):
+        update_similarity.apply_async(args=(obj_params,), countdown=window)
 
 
 @shared_task
@@ -75,10 +142,21 @@ def update_similarity(obj_params):
     except TypeError:  # Not iterable, must be a Django obj
         obj = obj_params
     else:
+        if settings.RECOMMEND_COALESCE_WINDOW:
+            # Changes made from now on need another update.
+            conf.get_cache().delete(pending_key(obj_params))
         content_type = ct_models.ContentType.objects.get(pk=ctype_id)
         obj = content_type.model_class().objects.get(pk=obj_id)
 
-    obj_data = storage.ObjectData(obj)
-    sim_func = pyrecommend.similarity.dot_product
-    pyrecommend.calculate_similarity(
-        obj_data, sim_func, storage.ResultStorage())
+    key = models.object_key(obj)
+    label = instrumentation.format_key(key)
+    with profiling.profile(key), instrumentation.measure(
+            'update_similarity', label) as recording:
+        obj_data = storage.ObjectData(obj)
+        engine = engines.get_update_engine()
+        result_storage = storage.ResultStorage(
+            buffered=settings.RECOMMEND_BUFFER_RESULTS)
+        engine(obj_data, result_storage)
+        result_storage.flush()
+        recording.count('pairs', result_storage.pairs)
+        recording.count('rows', result_storage.rows)
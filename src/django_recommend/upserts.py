@@ -0,0 +1,143 @@
+# coding: utf-8
+"""Native upserts, for the databases that have INSERT ... ON CONFLICT."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from django.db import connections
+
+from . import conf
+
+
+def can_upsert(db_alias):
+    """Check whether native upserts are turned on and work on db_alias.
+
+    They need INSERT ... ON CONFLICT and RETURNING: PostgreSQL 9.5 or SQLite
+    3.35 or later.
+
+    """
+    if not conf.settings.RECOMMEND_NATIVE_UPSERT:
+        return False
+    connection = connections[db_alias]
+    if connection.vendor == 'postgresql':
+        return connection.pg_version >= 90500
+    if connection.vendor == 'sqlite':
+        # The library Django's backend loaded, not necessarily the stdlib's.
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def prepare(model, connection, lookup, values):
+    """Get the quoted columns and database values for upsert().
+
+    Returns (key columns, key params, value columns, value params). Values
+    are cleaned like full_clean() does, but without the queries that check
+    relations and uniqueness; the database's constraints handle those.
+
+    """
+    quote = connection.ops.quote_name
+    opts = model._meta
+    row = dict(lookup, **values)
+    columns = {}
+    params = {}
+    for name in row:
+        field = opts.get_field(name)
+        value = row[name]
+        if not field.is_relation:  # Checking relations would need queries.
+            value = field.clean(value, None)
+        columns[name] = quote(field.column)
+        params[name] = field.get_db_prep_save(value, connection)
+    return ([columns[name] for name in lookup],
+            [params[name] for name in lookup],
+            [columns[name] for name in values],
+            [params[name] for name in values])
+
+
+def update_sql(model, connection, key_columns, value_columns):
+    """Build an UPDATE of the row with the key, returning its primary key.
+
+    Its parameters are the values, then the key.
+
+    """
+    quote = connection.ops.quote_name
+    return 'UPDATE {} SET {} WHERE {} RETURNING {}'.format(
+        quote(model._meta.db_table),
+        ', '.join(column + ' = %s' for column in value_columns),
+        ' AND '.join(column + ' = %s' for column in key_columns),
+        quote(model._meta.pk.column))
+
+
+def insert_sql(model, connection, key_columns, value_columns, update):
+    """Build an INSERT ... ON CONFLICT, returning the row's primary key.
+
+    With update=False, conflicting rows are left alone and nothing is
+    returned for them. On PostgreSQL, whether the row was inserted is
+    returned too. Its parameters are the key, then the values.
+
+    """
+    quote = connection.ops.quote_name
+    if update:
+        action = 'DO UPDATE SET ' + ', '.join(
+            '{0} = excluded.{0}'.format(column) for column in value_columns)
+    else:
+        action = 'DO NOTHING'
+    returning = quote(model._meta.pk.column)
+    if connection.vendor == 'postgresql':
+        # xmax is only 0 for rows that weren't there before.
+        returning += ', xmax = 0'
+    return ('INSERT INTO {table} ({columns}) VALUES ({values}) '
+            'ON CONFLICT ({conflict}) {action} RETURNING {returning}').format(
+                table=quote(model._meta.db_table),
+                columns=', '.join(key_columns + value_columns),
+                values=', '.join(['%s'] * len(key_columns + value_columns)),
+                conflict=', '.join(key_columns), action=action,
+                returning=returning)
+
+
+def fetch_row(connection, sql, params):
+    """Run sql, and get the row it returns, or None."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def upsert(model, db_alias, lookup, values, update=True):
+    """Insert a row, or update the one matching lookup, in one statement.
+
+    lookup and values map field names to values, using IDs for foreign keys.
+    The fields in lookup must make up one of model's unique constraints.
+    With update=False, an existing row is left alone, instead.
+
+    Returns a (primary key, created) tuple, or (None, False) if nothing was
+    written.
+
+    SQLite can't say whether ON CONFLICT ... DO UPDATE inserted the row, so
+    there the row is updated first, and only inserted if it wasn't there.
+    That's a second statement for new rows, and a third if another
+    connection inserts the row in between.
+
+    """
+    connection = connections[db_alias]
+    key_columns, key_params, value_columns, value_params = prepare(
+        model, connection, lookup, values)
+    update_row = update_sql(model, connection, key_columns, value_columns)
+
+    split = update and connection.vendor != 'postgresql'
+    if split:
+        result = fetch_row(connection, update_row, value_params + key_params)
+        if result is not None:
+            return result[0], False
+
+    result = fetch_row(
+        connection,
+        insert_sql(model, connection, key_columns, value_columns,
+                   update and not split),
+        key_params + value_params)
+    if result is None and split:
+        # Another connection inserted the row since it was updated.
+        result = fetch_row(connection, update_row, value_params + key_params)
+        return (None if result is None else result[0]), False
+    if result is None:
+        return None, False
+    if len(result) == 1:
+        return result[0], True  # DO NOTHING only returns inserted rows.
+    return result[0], result[1]
@@ -0,0 +1,66 @@
+# coding: utf-8
+"""Tests for the awaitable API."""
+# pylint: disable=redefined-outer-name
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import threading
+
+import pytest
+
+import django_recommend
+from django_recommend.models import ObjectSimilarity
+from tests.utils import make_quote
+
+asyncio = pytest.importorskip('asyncio')  # pylint: disable=invalid-name
+
+
+@pytest.fixture
+def run():
+    """Run an awaitable to completion on an event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop.run_until_complete
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_scores(run):
+    """aset_score() and friends work like their synchronous versions."""
+    quote = make_quote('foo')
+
+    run(django_recommend.aset_score('abc', quote, 3))
+    run(django_recommend.asetdefault_score('abc', quote, 4))
+    run(django_recommend.asetdefault_score('def', quote, 2))
+
+    assert 3 == run(django_recommend.aget_score('abc', quote))
+    assert {'abc': 3, 'def': 2} == run(django_recommend.ascores_for(quote))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_similar_objects(run):
+    """asimilar_objects() resolves to a list of similar objects."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    quote_c = make_quote('baz')
+    ObjectSimilarity.set(quote_a, quote_b, 4)
+    ObjectSimilarity.set(quote_a, quote_c, 5)
+
+    assert [quote_c, quote_b] == run(
+        django_recommend.asimilar_objects(quote_a))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runs_off_the_event_loop(run, monkeypatch):
+    """Database work, including recompute dispatch, runs in the pool."""
+    threads = []
+    monkeypatch.setattr(
+        'django_recommend.tasks.signal_handler',
+        lambda **kwargs: threads.append(threading.current_thread()))
+    quote = make_quote('foo')
+
+    run(django_recommend.aset_score('abc', quote, 3))
+
+    assert 1 == len(threads)
+    assert threading.current_thread() is not threads[0]
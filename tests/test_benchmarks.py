@@ -0,0 +1,52 @@
+# coding: utf-8
+"""Tests for the benchmark suite."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+
+import pytest
+
+from benchmarks import datasets, suite
+from django_recommend.models import UserScore
+
+
+def test_generate_is_deterministic():
+    """The same arguments always give the same dataset."""
+    assert datasets.generate(50, 20, seed=3) == datasets.generate(
+        50, 20, seed=3)
+    assert datasets.generate(50, 20, seed=3) != datasets.generate(
+        50, 20, seed=4)
+
+
+def test_generate_power_law():
+    """Popular items get most of the scores; nobody rates an item twice."""
+    rows = datasets.generate(500, 50, max_ratings=10, seed=0)
+    per_item = collections.Counter(item for _, item, _ in rows)
+    per_user_item = collections.Counter((user, item)
+                                        for user, item, _ in rows)
+
+    assert per_item[0] > 5 * per_item[49]
+    assert max(per_user_item.values()) == 1
+    assert {1, 5} == {score for _, _, score in rows}
+    assert max(collections.Counter(user for user, _, _ in rows).values()) <= 10
+
+
+@pytest.mark.django_db
+def test_run():
+    """A tiny run times every operation and counts its queries."""
+    report = suite.run(users=20, items=10, max_ratings=5, calls=2,
+                       update_calls=1)
+
+    operations = report['operations']
+    assert {'set_score', 'setdefault_score', 'update_similarity',
+            'similar_to', 'get_instances_for',
+            'similar_objects_filter'} == set(operations)
+    assert 1 == operations['update_similarity']['calls']
+    for stats in operations.values():
+        assert stats['queries'] > 0
+        assert stats['max_ms'] >= stats['median_ms'] >= 0
+    assert report['dataset']['scores'] > 0
+    # setdefault_score times inserts, not the scores set_score wrote.
+    assert [1, 1] == list(UserScore.objects.filter(
+        user__startswith='bench:default:').values_list('score', flat=True))
@@ -0,0 +1,136 @@
+# coding: utf-8
+"""Tests for the manage.py commands."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import mock
+import pytest
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+import django_recommend.models
+import django_recommend.rebuild
+import django_recommend.tasks
+import people.models
+from tests.utils import make_quote, similarity_rows
+
+
+def sample_data():
+    """Score some quotes and people, returning all of them."""
+    objs = [make_quote('quote {}'.format(i)) for i in range(5)]
+    objs.append(people.models.Person.objects.create(name='Kevin'))
+    scores = {'foo': [3, 2, 0, 1, 0, 4], 'bar': [0, 1, 4, 0, 0, 0],
+              'baz': [5, 0, 2, 0, 0, 0], 'qux': [0, 0, 0, 0, 5, 0]}
+    for user, user_scores in scores.items():
+        for obj, score in zip(objs, user_scores):
+            django_recommend.set_score(user, obj, score)
+    return objs
+
+
+@pytest.mark.django_db
+def test_rebuild_matches_update_similarity():
+    """recommend_rebuild stores what update_similarity does for all objects."""
+    objs = sample_data()
+    for obj in objs:
+        django_recommend.tasks.update_similarity(obj)
+    expected = similarity_rows()
+    django_recommend.models.ObjectSimilarity.set(objs[3], objs[4], 100)
+
+    out = StringIO()
+    call_command('recommend_rebuild', chunk_size=3, batch_size=2, stdout=out)
+
+    assert expected == similarity_rows()
+    assert 'scores read' in out.getvalue()
+    assert 'Rebuilt {} similarities'.format(len(expected)) in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_rebuild_partitions():
+    """Each partition is added up and written before the next is read."""
+    objs = sample_data()
+    rebuild = django_recommend.rebuild
+    keys = rebuild.object_keys()
+    assert sorted(django_recommend.models.object_key(obj)
+                  for obj in objs) == keys
+    expected = rebuild.calculate_similarities(rebuild.stream_scores(100))
+    passes = []
+
+    def read_scores():
+        """Stream the scores, counting the passes."""
+        passes.append(len(passes))
+        return rebuild.stream_scores(2)
+
+    parts = rebuild.partition_totals(read_scores, keys, 4)
+    first = next(parts)
+    assert [0] == passes
+    assert {pair for pair in expected if pair[0] in keys[:4]} == set(first)
+    second = next(parts)
+    assert [0, 1] == passes
+    assert {pair for pair in expected if pair[0] in keys[4:]} == set(second)
+    assert not list(parts)
+    assert expected == dict(first, **second)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('limit', [None, 1])
+def test_rebuild_partitioned(settings, limit):
+    """Partitioning doesn't change what's stored, even with limits."""
+    objs = sample_data()
+    settings.RECOMMEND_MAX_NEIGHBORS = limit
+    for obj in objs:
+        django_recommend.tasks.update_similarity(obj)
+    expected = similarity_rows()
+
+    with mock.patch('django_recommend.rebuild.stream_scores',
+                    wraps=django_recommend.rebuild.stream_scores) as stream:
+        call_command('recommend_rebuild', partition_size=2, stdout=StringIO())
+
+    assert expected == similarity_rows()
+    assert (3 if limit is None else 6) == stream.call_count
+
+
+@pytest.mark.django_db
+def test_rebuild_symmetric_counts(settings):
+    """Progress and the total both count similarities, not rows."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = 'symmetric'
+    objs = sample_data()
+    for obj in objs:
+        django_recommend.tasks.update_similarity(obj)
+    count = django_recommend.models.ObjectSimilarity.objects.count() // 2
+
+    out = StringIO()
+    call_command('recommend_rebuild', batch_size=1000, stdout=out)
+
+    assert '{} similarities written'.format(count) in out.getvalue()
+    assert 'Rebuilt {} similarities ({} rows)'.format(
+        count, count * 2) in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_rebuild_empty():
+    """recommend_rebuild works with no scores, clearing all similarities."""
+    quote_a, quote_b = make_quote('foo'), make_quote('bar')
+    django_recommend.models.ObjectSimilarity.set(quote_a, quote_b, 1)
+
+    call_command('recommend_rebuild', stdout=StringIO())
+
+    assert not django_recommend.models.ObjectSimilarity.objects.exists()
+
+
+@pytest.mark.django_db
+def test_rebuild_neighbor_limit(settings):
+    """recommend_rebuild only stores the pairs neighbor limits keep."""
+    objs = sample_data()
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+    for obj in objs:
+        django_recommend.tasks.update_similarity(obj)
+    expected = similarity_rows()
+
+    call_command('recommend_rebuild', stdout=StringIO())
+
+    assert expected == similarity_rows()
+
+    settings.RECOMMEND_MAX_NEIGHBORS = None
+    call_command('recommend_rebuild', stdout=StringIO())
+
+    assert expected < similarity_rows()
@@ -3,9 +3,11 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import django.db
 import django.db.models
 import pytest
 from django.contrib.contenttypes import models as ct_models
+from django.test.utils import CaptureQueriesContext
 
 import django_recommend.storage
 import django_recommend.tasks
@@ -52,6 +54,25 @@ def test_gets_related_items():
     assert set(obj_data.keys()) == {quote[4]}
 
 
+@pytest.mark.django_db
+def test_related_items_query_count():
+    """Related items are loaded in bulk, not one query each."""
+    quote = sample_data()
+    for i in range(5, 10):
+        quote[i] = make_quote('quote {}'.format(i))
+        django_recommend.set_score('bar', quote[i], 1)
+    ct_models.ContentType.objects.clear_cache()
+
+    obj_data = django_recommend.storage.ObjectData(quote[2])
+    with CaptureQueriesContext(django.db.connection) as queries:
+        keys = obj_data.keys()
+
+    assert 8 == len(keys)
+    # The ContentType for quote 2 (which also caches it by ID), the related
+    # objects, the quotes themselves, then all of their scores.
+    assert 4 == len(queries)
+
+
 @pytest.mark.django_db
 def test_gets_scores_for_one_item():
     """Accessing a specific item gets all the scores for it."""
@@ -64,6 +85,21 @@ def test_gets_scores_for_one_item():
     assert obj_data[quote[4]] == {'baz': 5}
 
 
+@pytest.mark.django_db
+def test_scores_prefetched():
+    """Iterating prefetches the scores, so getting them runs no queries."""
+    quote = sample_data()
+    obj_data = django_recommend.storage.ObjectData(quote[2])
+    keys = obj_data.keys()
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        scores = {key: obj_data[key] for key in keys}
+
+    assert 0 == len(queries)
+    assert {quote[1]: {'foo': 3}, quote[2]: {'foo': 2, 'bar': 3},
+            quote[3]: {'bar': 4}} == scores
+
+
 @pytest.mark.django_db
 def test_data_multiple_dbs():
     """Can retrieve objects from other databases."""
@@ -115,3 +151,39 @@ def test_missing_purge(settings):
     assert 0 == django_recommend.models.ObjectSimilarity.objects.filter(
         Q(object_1_content_type=ctype, object_1_id=quote_2_id) |
         Q(object_2_content_type=ctype, object_2_id=quote_2_id)).count()
+
+
+def query_plan(qset):
+    """Get SQLite's query plan for qset, as one string."""
+    sql, params = qset.query.sql_with_params()
+    with django.db.connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+@pytest.mark.django_db
+def test_relevant_objects_uses_covering_indexes():
+    """Finding related objects never reads the UserScore table itself."""
+    quote = sample_data()
+    obj_data = django_recommend.storage.ObjectData(quote[2])
+
+    plan = query_plan(obj_data.relevant_objects())
+
+    # One search for the users, one for their objects.
+    searches = [line for line in plan.splitlines()
+                if line.startswith(('SEARCH', 'SCAN'))]
+    assert 2 == len(searches)
+    assert all('COVERING INDEX' in line for line in searches), plan
+
+
+@pytest.mark.django_db
+def test_scores_for_many_uses_covering_index():
+    """Prefetching scores by object is answered from an index."""
+    quote = sample_data()
+    ctype = ct_models.ContentType.objects.get_for_model(quote[1])
+    scores = django_recommend.models.UserScore.objects.filter(
+        django_recommend.models.key_filters(
+            [(ctype.pk, obj.pk) for obj in quote.values()])[0]
+    ).values_list('object_content_type', 'object_id', 'user', 'score')
+
+    assert 'COVERING INDEX' in query_plan(scores)
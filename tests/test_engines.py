@@ -0,0 +1,131 @@
+# coding: utf-8
+"""Tests for the similarity engines."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+import django_recommend.engines
+import django_recommend.models
+import django_recommend.tasks
+from tests.utils import make_quote, similarity_rows
+
+
+def sample_data():
+    """Create some quotes with overlapping scores."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(5)]
+    django_recommend.set_score('foo', quote[0], 3)
+    django_recommend.set_score('foo', quote[1], 2)
+    django_recommend.set_score('foo', quote[3], 1.5)
+    django_recommend.set_score('bar', quote[1], 3)
+    django_recommend.set_score('bar', quote[2], 4)
+    django_recommend.set_score('baz', quote[0], 5)
+    django_recommend.set_score('baz', quote[2], 1)
+    django_recommend.set_score('qux', quote[4], 5)
+    return quote
+
+
+@pytest.mark.django_db
+def test_numpy_matches_pyrecommend(settings):
+    """The numpy engine stores the same scores as the pyrecommend engine."""
+    pytest.importorskip('scipy')
+    quote = sample_data()
+
+    settings.RECOMMEND_SIMILARITY_ENGINE = 'pyrecommend'
+    django_recommend.tasks.update_similarity(quote[1])
+    expected = similarity_rows()
+    django_recommend.models.ObjectSimilarity.objects.all().delete()
+
+    settings.RECOMMEND_SIMILARITY_ENGINE = 'numpy'
+    django_recommend.tasks.update_similarity(quote[1])
+
+    assert expected
+    assert expected == similarity_rows()
+
+
+@pytest.mark.django_db
+def test_numpy_removes_stale_scores(settings):
+    """Pairs whose dot product is now 0 are deleted, as with pyrecommend."""
+    pytest.importorskip('scipy')
+    settings.RECOMMEND_SIMILARITY_ENGINE = 'numpy'
+    quote = sample_data()
+    django_recommend.set_score('zed', quote[1], 1)
+    django_recommend.set_score('zed', quote[4], 1)
+    django_recommend.models.ObjectSimilarity.set(quote[0], quote[4], 99)
+
+    django_recommend.tasks.update_similarity(quote[1])
+
+    # No user rated both quote 0 and quote 4.
+    assert quote[4] not in django_recommend.similar_objects(quote[0])
+    assert 0 == django_recommend.models.ObjectSimilarity.objects.filter(
+        score=99).count()
+
+
+def test_unknown_engine():
+    """Asking for an engine that does not exist is a configuration error."""
+    with pytest.raises(ImproperlyConfigured):
+        django_recommend.engines.get_engine('fortran')
+
+
+def star_rows(rows, obj):
+    """Get the rows of similarity rows that involve obj."""
+    key = django_recommend.models.object_key(obj)
+    return {row for row in rows if key in (row[:2], row[2:4])}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('buffered', [False, True])
+def test_star_matches_neighborhood(settings, buffered):
+    """Star mode stores the same scores for the pairs with the object."""
+    settings.RECOMMEND_BUFFER_RESULTS = buffered
+    quote = sample_data()
+
+    django_recommend.tasks.update_similarity(quote[1])
+    expected = similarity_rows()
+    django_recommend.models.ObjectSimilarity.objects.all().delete()
+
+    settings.RECOMMEND_RECOMPUTE = 'star'
+    django_recommend.tasks.update_similarity(quote[1])
+
+    assert star_rows(expected, quote[1])
+    assert star_rows(expected, quote[1]) == similarity_rows()
+
+
+@pytest.mark.django_db
+def test_star_leaves_other_pairs(settings):
+    """Pairs that don't involve the object aren't rewritten."""
+    settings.RECOMMEND_RECOMPUTE = 'star'
+    quote = sample_data()
+    django_recommend.models.ObjectSimilarity.set(quote[0], quote[2], 99)
+    django_recommend.models.ObjectSimilarity.set(quote[1], quote[2], 99)
+
+    django_recommend.tasks.update_similarity(quote[1])
+
+    sims = django_recommend.models.ObjectSimilarity.objects
+    assert 99 == sims.get(object_1_id=quote[0].pk,
+                          object_2_id=quote[2].pk).score
+    assert 12 == sims.get(object_1_id=quote[1].pk,
+                          object_2_id=quote[2].pk).score
+
+
+@pytest.mark.django_db
+def test_star_zero_scores(settings):
+    """Pairs whose dot product is now 0 are deleted, as with pyrecommend."""
+    settings.RECOMMEND_RECOMPUTE = 'star'
+    quote = sample_data()
+    django_recommend.set_score('zed', quote[1], 1)
+    django_recommend.set_score('zed', quote[4], -2)
+    django_recommend.set_score('foo', quote[4], 1)
+    django_recommend.models.ObjectSimilarity.set(quote[1], quote[4], 99)
+
+    django_recommend.tasks.update_similarity(quote[1])
+
+    assert quote[4] not in django_recommend.similar_objects(quote[1])
+
+
+def test_unknown_recompute(settings):
+    """Asking for a recompute mode that does not exist is an error."""
+    settings.RECOMMEND_RECOMPUTE = 'everything'
+    with pytest.raises(ImproperlyConfigured):
+        django_recommend.engines.get_update_engine()
@@ -0,0 +1,227 @@
+# coding: utf-8
+"""Tests for incremental similarity maintenance."""
+# pylint: disable=redefined-outer-name,unused-argument
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import random
+
+import mock
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+import django_recommend
+import django_recommend.incremental
+import django_recommend.rebuild
+import people.models
+from django_recommend.models import (ObjectNorm, ObjectSimilarity, UserScore,
+                                     object_key)
+from tests.utils import make_quote
+
+
+@pytest.fixture
+def incremental(settings):
+    """Turn on incremental mode, and fail if a full update is queued."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    settings.RECOMMEND_INCREMENTAL = True
+    with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+        yield settings
+    assert not schedule.called
+
+
+def stored_similarities():
+    """Get the stored similarities as a dict of {(key_1, key_2): score}."""
+    return {((ctype_1, id_1), (ctype_2, id_2)): score
+            for ctype_1, id_1, ctype_2, id_2, score in
+            ObjectSimilarity.objects.values_list(
+                'object_1_content_type', 'object_1_id',
+                'object_2_content_type', 'object_2_id', 'score')
+            if (ctype_1, id_1) < (ctype_2, id_2)}
+
+
+def expected_similarities():
+    """Calculate all similarities from scratch."""
+    totals = django_recommend.rebuild.calculate_similarities(
+        django_recommend.rebuild.stream_scores(1000))
+    return {pair: score for pair, score in totals.items() if score != 0}
+
+
+def expected_norms():
+    """Calculate every object's sum of squared scores from scratch."""
+    norms = {}
+    for ctype_id, obj_id, score in UserScore.objects.values_list(
+            'object_content_type', 'object_id', 'score'):
+        key = ctype_id, obj_id
+        norms[key] = norms.get(key, 0) + score ** 2
+    return norms
+
+
+def test_score_deltas():
+    """Each pair involving a changed score moves by the change in product."""
+    key = [(1, i) for i in range(4)]
+    changes = {key[0]: (2, 3), key[1]: (0, 1)}
+    current = {key[2]: 4, key[3]: 5}
+
+    sims, norms = django_recommend.incremental.score_deltas(changes, current)
+
+    assert {(key[0], key[1]): 3, (key[0], key[2]): 4, (key[0], key[3]): 5,
+            (key[1], key[2]): 4, (key[1], key[3]): 5} == sims
+    assert {key[0]: 5, key[1]: 1} == norms
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_matches_full_calculation(incremental, layout):
+    """Every kind of score write keeps similarities and norms exact."""
+    incremental.RECOMMEND_SIMILARITY_LAYOUT = layout
+    rand = random.Random(1234)
+    objs = [make_quote('quote {}'.format(i)) for i in range(6)]
+    objs.append(people.models.Person.objects.create(name='Stanley'))
+    users = ['user {}'.format(i) for i in range(4)]
+
+    for _ in range(40):
+        user, obj = rand.choice(users), rand.choice(objs)
+        score = rand.choice([0, 1, 2, 3])
+        write = rand.choice(['set', 'setdefault', 'bulk', 'bulk_default',
+                             'delete'])
+        if write == 'set':
+            django_recommend.set_score(user, obj, score)
+        elif write == 'setdefault':
+            django_recommend.setdefault_score(user, obj, score or 1)
+        elif write == 'bulk':
+            django_recommend.set_scores(
+                user, [(obj, score), (rand.choice(objs), rand.choice([0, 2]))])
+        elif write == 'bulk_default':
+            django_recommend.setdefault_scores(
+                user, [(obj, score or 1), (rand.choice(objs), 2)])
+        else:
+            UserScore.objects.filter(user=user).delete()
+
+        assert expected_similarities() == stored_similarities()
+        assert expected_norms() == ObjectNorm.get_many(expected_norms())
+        assert ObjectNorm.objects.count() == len(expected_norms())
+
+
+@pytest.mark.django_db
+def test_saving_an_instance_twice(incremental):
+    """A UserScore saved more than once replaces its own last score."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 2)
+    score = UserScore(user='abc', object=quote_b, score=1)
+
+    score.save()
+    score.score = 4
+    score.save()
+
+    assert {(object_key(quote_a), object_key(quote_b)): 8} == (
+        stored_similarities())
+
+
+@pytest.mark.django_db
+def test_saving_a_stale_instance(incremental):
+    """The replaced score is read from the database, not the instance."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 2)
+    django_recommend.set_score('abc', quote_b, 1)
+    stale = UserScore.objects.get(object_id=quote_b.pk)
+    django_recommend.set_score('abc', quote_b, 3)
+
+    stale.score = 4
+    stale.save()
+
+    assert expected_similarities() == stored_similarities()
+    assert expected_norms() == ObjectNorm.get_many(expected_norms())
+
+
+@pytest.mark.django_db
+def test_saving_a_deleted_instance(incremental):
+    """An instance whose row was deleted elsewhere replaces a score of 0."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 2)
+    django_recommend.set_score('abc', quote_b, 1)
+    deleted = UserScore.objects.get(object_id=quote_b.pk)
+    UserScore.objects.filter(pk=deleted.pk).delete()
+
+    deleted.score = 4
+    deleted.save()
+
+    assert expected_similarities() == stored_similarities()
+    assert expected_norms() == ObjectNorm.get_many(expected_norms())
+
+
+@pytest.mark.django_db
+def test_failed_deltas_roll_back_score(incremental):
+    """A score isn't saved if its deltas can't be applied."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 2)
+    score = UserScore(user='abc', object=quote_b, score=1)
+
+    with mock.patch.object(ObjectSimilarity, 'add_many',
+                           side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            score.save()
+
+    assert not UserScore.objects.filter(object_id=quote_b.pk).exists()
+
+
+@pytest.mark.django_db
+def test_cancelling_deltas():
+    """Deltas that cancel out delete the row, despite rounding."""
+    pair = (1, 1), (1, 2)
+    for delta in [0.1, 0.2, -0.1, -0.2]:
+        ObjectSimilarity.add_many({pair: delta})
+        ObjectNorm.add_many({pair[0]: delta})
+
+    assert not ObjectSimilarity.objects.exists()
+    assert not ObjectNorm.objects.exists()
+
+
+@pytest.mark.django_db
+def test_norm_str():
+    """ObjectNorms show their object's key and sum of squares."""
+    ObjectNorm.add_many({(1, 2): 9})
+
+    assert '1, 2: 9.0' == str(ObjectNorm.objects.get())
+
+
+@pytest.mark.django_db
+def test_forget_object(incremental):
+    """Forgetting an object removes its similarities and norm."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    for obj in quote:
+        django_recommend.set_score('abc', obj, 2)
+
+    django_recommend.forget_object(*object_key(quote[0]))
+
+    assert {(object_key(quote[1]), object_key(quote[2])): 4} == (
+        stored_similarities())
+    assert {object_key(quote[1]), object_key(quote[2])} == set(
+        ObjectNorm.objects.values_list('object_content_type', 'object_id'))
+
+
+@pytest.mark.django_db
+def test_rebuild_writes_norms(settings):
+    """recommend_rebuild fills in ObjectNorm in incremental mode."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(2)]
+    django_recommend.set_score('abc', quote[0], 2)
+    django_recommend.set_score('def', quote[0], 1)
+    django_recommend.set_score('abc', quote[1], 3)
+    settings.RECOMMEND_INCREMENTAL = True
+
+    django_recommend.rebuild.rebuild()
+
+    assert {object_key(quote[0]): 5, object_key(quote[1]): 9} == (
+        ObjectNorm.get_many([object_key(obj) for obj in quote]))
+
+
+def test_pruning_conflicts(settings):
+    """Incremental mode can't be combined with neighbor limits."""
+    settings.RECOMMEND_INCREMENTAL = True
+    settings.RECOMMEND_MAX_NEIGHBORS = 10
+
+    with pytest.raises(ImproperlyConfigured):
+        django_recommend.incremental.is_enabled()
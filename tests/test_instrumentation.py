@@ -0,0 +1,269 @@
+# coding: utf-8
+"""Tests for the instrumentation hooks and the recommend_stats command."""
+# pylint: disable=redefined-outer-name
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+
+import mock
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from testfixtures import LogCapture
+
+import django_recommend
+import django_recommend.storage
+import django_recommend.tasks
+from django_recommend import instrumentation
+from django_recommend.models import ObjectSimilarity, object_key
+from tests.utils import make_quote
+
+
+@pytest.fixture
+def recorded(settings):
+    """Collect measurements with a callback sink."""
+    measurements = []
+    settings.RECOMMEND_INSTRUMENTATION_SINKS = [measurements.append]
+    return measurements
+
+
+@pytest.fixture
+def aggregate(settings):
+    """Publish aggregate totals on every measurement."""
+    settings.RECOMMEND_INSTRUMENTATION_SINKS = ['aggregate']
+    settings.RECOMMEND_STATS_PUBLISH_INTERVAL = 0
+    instrumentation.AGGREGATE.reset()
+    yield
+    instrumentation.AGGREGATE.reset()
+
+
+def scored_quotes():
+    """Create three quotes scored by two users."""
+    quotes = [make_quote('quote {}'.format(i)) for i in range(3)]
+    django_recommend.set_score('foo', quotes[0], 2)
+    django_recommend.set_score('foo', quotes[1], 3)
+    django_recommend.set_score('bar', quotes[0], 1)
+    django_recommend.set_score('bar', quotes[2], 4)
+    return quotes
+
+
+@pytest.mark.django_db
+def test_measure_counts_queries(recorded):
+    """A measurement counts queries, including those of nested ones."""
+    with instrumentation.measure('outer', 'abc') as outer:
+        make_quote('foo')
+        with instrumentation.measure('inner'):
+            make_quote('bar')
+        outer.count('quotes', 2)
+
+    inner_measurement, outer_measurement = recorded
+    assert 'inner' == inner_measurement.name
+    assert 1 == inner_measurement.queries
+    assert 'outer' == outer_measurement.name
+    assert 'abc' == outer_measurement.label
+    assert 2 == outer_measurement.queries
+    assert {'quotes': 2} == outer_measurement.counts
+    assert outer_measurement.seconds >= inner_measurement.seconds
+
+
+@pytest.mark.django_db
+def test_measure_keeps_query_log(recorded):
+    """Queries still show up in the usual query log while measured."""
+    with CaptureQueriesContext(connection) as queries:
+        with instrumentation.measure('outer'):
+            make_quote('foo')
+        make_quote('bar')
+
+    assert 2 == len(queries)
+    assert 1 == recorded[0].queries
+
+
+@pytest.mark.django_db
+def test_measure_reads_query_log(recorded):
+    """The query log can still be read while it's being counted."""
+    with instrumentation.measure('outer'):
+        with CaptureQueriesContext(connection) as queries:
+            make_quote('foo')
+        logged = connection.queries
+
+    assert 1 == len(queries)
+    assert queries[0] == logged[-1]
+    assert 1 == recorded[0].queries
+
+
+def test_measure_without_sinks():
+    """With no sinks, nothing is recorded, and the block still runs."""
+    with instrumentation.measure('outer') as recording:
+        recording.count('things')
+    assert connection.queries_log.__class__ is not (
+        instrumentation.QueryCounter)
+
+
+def test_measure_errors(recorded):
+    """A failed operation is recorded with an error count."""
+    with pytest.raises(ValueError):
+        with instrumentation.measure('outer'):
+            raise ValueError()
+
+    assert {'errors': 1} == recorded[0].counts
+
+
+def test_broken_sink(settings):
+    """A sink that raises doesn't break the operation or other sinks."""
+    measurements = []
+
+    def broken(measurement):
+        """Fail."""
+        raise ValueError(measurement)
+
+    settings.RECOMMEND_INSTRUMENTATION_SINKS = [broken, measurements.append]
+    with LogCapture() as logs:
+        with instrumentation.measure('outer'):
+            pass
+
+    assert 1 == len(measurements)
+    assert 'sink' in str(logs)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('buffered', [False, True])
+def test_update_similarity(recorded, settings, buffered):
+    """update_similarity records pairs and rows, and its parts' timings."""
+    settings.RECOMMEND_BUFFER_RESULTS = buffered
+    quotes = scored_quotes()
+
+    django_recommend.tasks.update_similarity(quotes[0])
+
+    by_name = {}
+    for measurement in recorded:
+        by_name.setdefault(measurement.name, []).append(measurement)
+    update = by_name['update_similarity'][0]
+    label = instrumentation.format_key(object_key(quotes[0]))
+    assert label == update.label
+    assert {'pairs': 3, 'rows': 2} == update.counts
+    assert ObjectSimilarity.objects.count() == update.counts['rows']
+    assert [label] == [m.label for m in by_name['object_data']]
+    assert {'objects': 3, 'scores': 4} == by_name['object_data'][0].counts
+    assert update.queries > by_name['object_data'][0].queries > 0
+
+    write_name = 'result_storage.flush' if buffered else (
+        'result_storage.write')
+    writes = by_name[write_name]
+    assert 2 == sum(write.counts['rows'] for write in writes)
+
+
+@pytest.mark.django_db
+def test_result_storage_without_sinks():
+    """Without sinks, unbuffered writes don't set up any measurements."""
+    quotes = [make_quote('foo'), make_quote('bar')]
+    result_storage = django_recommend.storage.ResultStorage()
+
+    with mock.patch.object(instrumentation, 'Recording') as recording:
+        result_storage[(quotes[0], quotes[1])] = 3
+
+    assert not recording.called
+    assert 1 == result_storage.rows
+
+
+@pytest.mark.django_db
+def test_result_storage_looks_up_sinks_once(recorded):
+    """ResultStorage reads RECOMMEND_INSTRUMENTATION_SINKS once."""
+    quotes = [make_quote('quote {}'.format(i)) for i in range(3)]
+    result_storage = django_recommend.storage.ResultStorage()
+
+    with mock.patch.object(instrumentation, 'get_sinks') as get_sinks:
+        result_storage[(quotes[0], quotes[1])] = 3
+        result_storage[(quotes[0], quotes[2])] = 2
+
+    assert not get_sinks.called
+    assert 2 == len(recorded)
+
+
+@pytest.mark.django_db
+def test_get_instances_for(recorded):
+    """get_instances_for records how many instances it loaded."""
+    quotes = scored_quotes()
+    django_recommend.tasks.update_similarity(quotes[0])
+    del recorded[:]
+
+    django_recommend.similar_to(quotes[0]).get_instances_for(quotes[0])
+
+    assert ['get_instances_for'] == [m.name for m in recorded]
+    assert {'objects': 2} == recorded[0].counts
+
+
+def test_log_sink(settings):
+    """The 'log' sink logs each measurement."""
+    settings.RECOMMEND_INSTRUMENTATION_SINKS = ['log']
+
+    with LogCapture() as logs:
+        with instrumentation.measure('outer', '1:2') as recording:
+            recording.count('rows', 3)
+
+    assert 'outer 1:2' in str(logs)
+    assert "'rows': 3" in str(logs)
+
+
+def test_dotted_path_sink(settings):
+    """Sinks can be given as dotted paths."""
+    settings.RECOMMEND_INSTRUMENTATION_SINKS = [
+        'django_recommend.instrumentation.log_sink']
+    assert [instrumentation.log_sink] == instrumentation.get_sinks()
+
+
+@pytest.mark.django_db
+def test_recommend_stats(aggregate):
+    """recommend_stats shows the totals published by the aggregate sink."""
+    quotes = scored_quotes()
+    for quote in quotes:
+        django_recommend.tasks.update_similarity(quote)
+
+    out = StringIO()
+    call_command('recommend_stats', json=True, stdout=out)
+    stats = json.loads(out.getvalue())
+    update = stats['update_similarity']
+    assert 3 == update['calls']
+    assert 5 == update['counts']['pairs']
+    assert update['slowest'] in [
+        instrumentation.format_key(object_key(quote)) for quote in quotes]
+
+    out = StringIO()
+    call_command('recommend_stats', stdout=out)
+    assert 'update_similarity: 3 calls' in out.getvalue()
+    assert 'pairs: 5 (1.7 mean)' in out.getvalue()
+
+
+def test_recommend_stats_merges_processes(aggregate):
+    """Totals from every publishing process are added together."""
+    measurement = instrumentation.Measurement('op', 'a', 0.5, 3, {'rows': 2})
+    instrumentation.aggregate_sink(measurement)
+    first_key = instrumentation.process_key()
+    stats = instrumentation.AGGREGATE.snapshot()
+    stats['op']['max_seconds'] = 2
+    stats['op']['slowest'] = 'b'
+    cache = instrumentation.conf.get_cache()
+    cache.set('other-process', stats)
+    cache.set(instrumentation.PROCESSES_KEY, [first_key, 'other-process'])
+
+    assert {'op': {'calls': 2, 'seconds': 1, 'queries': 6, 'max_seconds': 2,
+                   'slowest': 'b', 'counts': {'rows': 4}}} == (
+                       instrumentation.collected_stats())
+
+
+def test_publish_due(settings):
+    """Totals are published at most once per interval."""
+    settings.RECOMMEND_STATS_PUBLISH_INTERVAL = 60
+    aggregate = instrumentation.Aggregate()
+
+    assert aggregate.publish_due()
+    assert not aggregate.publish_due()
+
+
+def test_recommend_stats_empty():
+    """recommend_stats explains how to get stats when there are none."""
+    out = StringIO()
+    call_command('recommend_stats', stdout=out)
+    assert 'aggregate' in out.getvalue()
@@ -0,0 +1,148 @@
+# coding: utf-8
+"""Tests for the 'symmetric' similarity layout."""
+# pylint: disable=redefined-outer-name,unused-argument
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import django.db
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+import django_recommend
+import django_recommend.pruning
+import django_recommend.rebuild
+from django_recommend.models import ObjectSimilarity, object_key
+from tests.utils import make_quote
+
+
+@pytest.fixture
+def symmetric(settings):
+    """Store similarities in both directions."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = 'symmetric'
+    return settings
+
+
+def stored_rows():
+    """Get all stored rows as a set of (id_1, id_2, score) tuples."""
+    return set(ObjectSimilarity.objects.values_list(
+        'object_1_id', 'object_2_id', 'score'))
+
+
+def sample_quotes():
+    """Make four quotes with PKs 1 to 4."""
+    return [make_quote('quote {}'.format(i), pk=i + 1) for i in range(4)]
+
+
+@pytest.mark.django_db
+def test_set(symmetric):
+    """set() writes and deletes both directions of a similarity."""
+    quote = sample_quotes()
+
+    sim = ObjectSimilarity.set(quote[1], quote[0], 3)
+
+    assert (quote[0], quote[1]) == (sim.object_1, sim.object_2)
+    assert {(1, 2, 3), (2, 1, 3)} == stored_rows()
+
+    ObjectSimilarity.set(quote[0], quote[1], 0)
+
+    assert set() == stored_rows()
+
+
+@pytest.mark.django_db
+def test_set_many(symmetric):
+    """set_many() writes, updates and deletes both directions."""
+    quote = sample_quotes()
+    key = [object_key(obj) for obj in quote]
+    ObjectSimilarity.set_many({(key[0], key[1]): 1, (key[0], key[2]): 2})
+
+    ObjectSimilarity.set_many({(key[1], key[0]): 5, (key[0], key[2]): 0,
+                               (key[3], key[2]): 4})
+
+    assert {(1, 2, 5), (2, 1, 5), (3, 4, 4), (4, 3, 4)} == stored_rows()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_similar_objects(settings, layout):
+    """The public API gives the same results with either layout."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = layout
+    quote = sample_quotes()
+    ObjectSimilarity.set(quote[0], quote[1], 1)
+    ObjectSimilarity.set(quote[2], quote[0], 3)
+    ObjectSimilarity.set(quote[0], quote[3], 2)
+    ObjectSimilarity.set(quote[1], quote[2], 4)
+
+    assert [quote[2], quote[3], quote[1]] == (
+        django_recommend.similar_objects(quote[0]))
+    assert [quote[1], quote[0]] == django_recommend.similar_objects(quote[2])
+    assert 3 == django_recommend.similar_to(quote[0]).count()
+    assert [quote[2], quote[1]] == (
+        django_recommend.similar_to(quote[0]).exclude_objects(
+            type(quote[3]).objects.filter(pk=quote[3].pk)
+        ).get_instances_for(quote[0]))
+
+
+@pytest.mark.django_db
+def test_similar_to_query_plan(symmetric):
+    """similar_to() is one index range scan, already ordered by score."""
+    quote = sample_quotes()
+    sql, params = django_recommend.similar_to(quote[0]).query.sql_with_params()
+
+    with django.db.connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+
+    assert 'USING INDEX' in plan
+    assert 'TEMP B-TREE' not in plan
+    assert ' OR ' not in sql.upper()
+
+
+@pytest.mark.django_db
+def test_forget_object(symmetric):
+    """forget_object() removes both directions."""
+    quote = sample_quotes()
+    ObjectSimilarity.set(quote[0], quote[1], 1)
+    ObjectSimilarity.set(quote[2], quote[3], 1)
+
+    django_recommend.forget_object(*object_key(quote[1]))
+
+    assert {(3, 4, 1), (4, 3, 1)} == stored_rows()
+
+
+@pytest.mark.django_db
+def test_rebuild(symmetric):
+    """rebuild() writes both directions, counting each similarity once."""
+    quote = sample_quotes()
+    for obj in quote[:3]:
+        django_recommend.set_score('foo', obj, 1)
+
+    assert 3 == django_recommend.rebuild.rebuild()
+
+    assert 6 == ObjectSimilarity.objects.count()
+    assert set(quote[1:3]) == set(django_recommend.similar_objects(quote[0]))
+
+
+@pytest.mark.django_db
+def test_prune(symmetric):
+    """Pruning deletes both directions of the similarities it drops."""
+    quote = sample_quotes()
+    ObjectSimilarity.set(quote[0], quote[1], 10)
+    ObjectSimilarity.set(quote[0], quote[2], 5)
+    ObjectSimilarity.set(quote[0], quote[3], 1)
+    ObjectSimilarity.set(quote[1], quote[2], 2)
+    ObjectSimilarity.set(quote[2], quote[3], 3)
+    symmetric.RECOMMEND_MAX_NEIGHBORS = 1
+
+    assert 1 == django_recommend.pruning.prune([object_key(quote[3])])
+    assert 1 == django_recommend.pruning.prune_all()
+
+    assert {(1, 2, 10), (2, 1, 10), (1, 3, 5), (3, 1, 5), (3, 4, 3),
+            (4, 3, 3)} == stored_rows()
+
+
+def test_unknown_layout(settings):
+    """An unknown layout name is a configuration error."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = 'sideways'
+
+    with pytest.raises(ImproperlyConfigured):
+        django_recommend.models.is_symmetric()
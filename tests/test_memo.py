@@ -0,0 +1,137 @@
+# coding: utf-8
+"""Tests for request-scoped score memoization."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import django.db
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+import django_recommend
+from django_recommend import memo
+from django_recommend.middleware import ScoreMemoMiddleware
+from django_recommend.models import UserScore
+from tests.utils import make_quote
+
+
+def count_queries(func, *args):
+    """Call func, returning its result and the number of queries it ran."""
+    with CaptureQueriesContext(django.db.connection) as queries:
+        result = func(*args)
+    return result, len(queries)
+
+
+@pytest.mark.django_db
+def test_get_score_memoized():
+    """Repeated get_score() calls only query once inside a memo."""
+    quote = make_quote('foo')
+    django_recommend.set_score('abc', quote, 3)
+
+    with memo.memoize_scores():
+        assert (3, 1) == count_queries(django_recommend.get_score, 'abc',
+                                       quote)
+        assert (3, 0) == count_queries(django_recommend.get_score, 'abc',
+                                       quote)
+        # Unscored objects are remembered too.
+        assert (0, 1) == count_queries(django_recommend.get_score, 'def',
+                                       quote)
+        assert (0, 0) == count_queries(django_recommend.get_score, 'def',
+                                       quote)
+
+    assert (3, 1) == count_queries(django_recommend.get_score, 'abc', quote)
+
+
+@pytest.mark.django_db
+def test_scores_for_memoized():
+    """scores_for() results also answer get_score() inside a memo."""
+    quote = make_quote('foo')
+    django_recommend.set_score('abc', quote, 3)
+
+    with memo.memoize_scores():
+        scores, num_queries = count_queries(django_recommend.scores_for,
+                                            quote)
+        assert ({'abc': 3}, 1) == (scores, num_queries)
+        scores['def'] = 10  # Callers get a copy of the memo.
+        assert ({'abc': 3}, 0) == count_queries(django_recommend.scores_for,
+                                                quote)
+        assert (0, 0) == count_queries(django_recommend.get_score, 'def',
+                                       quote)
+
+
+@pytest.mark.django_db
+def test_get_scores_memoized():
+    """get_scores() only queries for objects not in the memo."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 3)
+    django_recommend.set_score('abc', quote_b, 4)
+
+    with memo.memoize_scores():
+        django_recommend.get_score('abc', quote_a)
+        assert ({quote_a: 3, quote_b: 4}, 1) == count_queries(
+            django_recommend.get_scores, 'abc', [quote_a, quote_b])
+        assert ({quote_a: 3, quote_b: 4}, 0) == count_queries(
+            django_recommend.get_scores, 'abc', [quote_a, quote_b])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('write, score', [
+    (lambda quote: django_recommend.set_score('abc', quote, 5), 5),
+    (lambda quote: django_recommend.set_score('abc', quote, 0), 0),
+    (lambda quote: django_recommend.set_scores('abc', [(quote, 5)]), 5),
+    (lambda quote: django_recommend.set_scores('abc', [(quote, 0)]), 0),
+    (lambda quote: UserScore.objects.get(user='abc').delete(), 0),
+])
+def test_writes_invalidate_memo(write, score):
+    """Writing a score drops it from the memo."""
+    quote = make_quote('foo')
+    django_recommend.set_score('abc', quote, 3)
+    django_recommend.set_score('def', quote, 1)
+
+    with memo.memoize_scores():
+        django_recommend.scores_for(quote)
+        django_recommend.get_score('abc', quote)
+        write(quote)
+
+        assert score == django_recommend.get_score('abc', quote)
+        expected = {'abc': score, 'def': 1} if score else {'def': 1}
+        assert expected == django_recommend.scores_for(quote)
+
+
+@pytest.mark.django_db
+def test_setdefault_scores_invalidate_memo():
+    """setdefault_scores() drops the scores it adds from the memo."""
+    quote = make_quote('foo')
+
+    with memo.memoize_scores():
+        assert 0 == django_recommend.get_score('abc', quote)
+        django_recommend.setdefault_scores('abc', [(quote, 2)])
+        assert 2 == django_recommend.get_score('abc', quote)
+
+
+@pytest.mark.django_db
+def test_middleware():
+    """ScoreMemoMiddleware keeps a memo only while handling a request."""
+    quote = make_quote('foo')
+    middleware = ScoreMemoMiddleware()
+    request = RequestFactory().get('/')
+    response = HttpResponse()
+
+    assert middleware.process_request(request) is None
+    assert memo.current() is not None
+    django_recommend.get_score('abc', quote)
+    assert (0, 0) == count_queries(django_recommend.get_score, 'abc', quote)
+
+    assert response is middleware.process_response(request, response)
+    assert memo.current() is None
+
+
+def test_nested_memos_share_state():
+    """A memo activated inside another reuses the outer one."""
+    with memo.memoize_scores() as outer:
+        with memo.memoize_scores() as inner:
+            assert outer is inner
+        assert memo.current() is outer
+    assert memo.current() is None
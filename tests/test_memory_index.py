@@ -0,0 +1,227 @@
+# coding: utf-8
+"""Tests for the in-process neighbor index."""
+# pylint: disable=redefined-outer-name,unused-argument
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import threading
+import time
+import timeit
+
+import django.db
+import mock
+import pytest
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+
+import django_recommend
+import django_recommend.rebuild
+from django_recommend import memory_index
+from django_recommend.models import (ObjectSimilarity, SimilarityChange,
+                                     object_key)
+from tests.utils import sample_similarities, similar_objects_queries
+
+
+@pytest.fixture
+def memory(settings, monkeypatch):
+    """Turn on the in-memory index, checking for changes on every lookup."""
+    settings.RECOMMEND_MEMORY_INDEX = True
+    settings.RECOMMEND_MEMORY_INDEX_REFRESH = 0
+    monkeypatch.setattr(memory_index, '_INDEX', None)
+    return settings
+
+
+def neighbor_keys(obj):
+    """Get the keys of obj's neighbors in the index."""
+    return [(ctype_id, obj_id) for ctype_id, obj_id, _ in
+            memory_index.get_index().get_neighbors(object_key(obj))]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_load(memory, layout):
+    """The index holds each object's best neighbors, best first."""
+    memory.RECOMMEND_SIMILARITY_LAYOUT = layout
+    memory.RECOMMEND_MEMORY_INDEX_SIZE = 2
+    objs = sample_similarities()
+
+    index = memory_index.get_index()
+
+    assert 4 == len(index)
+    assert 8 == index.neighbor_count()
+    assert [(object_key(objs[2]) + (5.5,)), (object_key(objs[4]) + (4,))] == (
+        index.get_neighbors(object_key(objs[0])))
+    assert [object_key(objs[0])] == neighbor_keys(objs[4])[:1]
+    assert [] == index.get_neighbors(object_key(objs[3]))
+
+
+@pytest.mark.django_db
+def test_similar_objects(memory):
+    """similar_objects() uses the index, without querying ObjectSimilarity."""
+    objs = sample_similarities()
+    memory_index.warm()
+    memory.RECOMMEND_MEMORY_INDEX_REFRESH = 60
+
+    result, queries = similar_objects_queries(objs[0])
+    assert [objs[2], objs[4], objs[1]] == result
+    table = ObjectSimilarity._meta.db_table
+    assert not [sql for sql in queries if table in sql]
+
+
+@pytest.mark.django_db
+def test_refresh(memory):
+    """Lookups reload the lists that changed since the last check."""
+    objs = sample_similarities()
+    memory_index.warm()
+
+    ObjectSimilarity.set(objs[1], objs[3], 10)
+    ObjectSimilarity.set_many({(object_key(objs[0]), object_key(objs[2])): 0})
+
+    assert [object_key(objs[3]), object_key(objs[0]),
+            object_key(objs[2])] == neighbor_keys(objs[1])
+    assert [object_key(objs[4]), object_key(objs[1])] == neighbor_keys(
+        objs[0])
+    assert [object_key(objs[1])] == neighbor_keys(objs[3])
+
+
+@pytest.mark.django_db
+def test_refresh_after_forget_and_rebuild(memory):
+    """Forgetting objects and rebuilding are picked up too."""
+    objs = sample_similarities()
+    memory_index.warm()
+
+    django_recommend.forget_object(*object_key(objs[2]))
+    assert [object_key(objs[4]), object_key(objs[1])] == neighbor_keys(
+        objs[0])
+    assert [] == neighbor_keys(objs[2])
+
+    django_recommend.set_score('abc', objs[3], 1)
+    django_recommend.set_score('abc', objs[4], 2)
+    django_recommend.rebuild.rebuild()
+    assert [] == neighbor_keys(objs[0])
+    assert [object_key(objs[4])] == neighbor_keys(objs[3])
+
+
+@pytest.mark.django_db
+def test_refresh_interval(memory):
+    """Changes aren't looked for more than once per refresh interval."""
+    objs = sample_similarities()
+    memory.RECOMMEND_MEMORY_INDEX_REFRESH = 60
+    memory_index.warm()
+
+    ObjectSimilarity.set(objs[1], objs[3], 10)
+
+    assert 2 == len(neighbor_keys(objs[1]))
+
+
+@pytest.mark.django_db
+def test_late_commit(memory):
+    """Changes with low IDs that show up late are still applied."""
+    objs = sample_similarities()
+    index = memory_index.warm()
+    ObjectSimilarity.set(objs[1], objs[3], 10)
+    index.watermark = SimilarityChange.objects.latest('pk').pk
+
+    assert object_key(objs[3]) in neighbor_keys(objs[1])
+
+
+@pytest.mark.django_db
+def test_stale_index_reloads(memory):
+    """An index older than the kept changes is reloaded from scratch."""
+    objs = sample_similarities()
+    index = memory_index.warm()
+    ObjectSimilarity.set(objs[1], objs[3], 10)
+    SimilarityChange.objects.all().delete()
+    index.changes_since -= datetime.timedelta(days=2)
+
+    assert object_key(objs[3]) in neighbor_keys(objs[1])
+
+
+@pytest.mark.django_db
+def test_change_str():
+    """SimilarityChanges show their object's key and when it changed."""
+    SimilarityChange.record([(1, 2)])
+    change = SimilarityChange.objects.get()
+
+    assert '1, 2: {}'.format(change.changed) == str(change)
+
+
+@pytest.mark.django_db
+def test_changes_not_recorded_when_off(settings):
+    """Without the in-memory index, no changes are recorded."""
+    objs = sample_similarities()
+    table = SimilarityChange._meta.db_table
+    with CaptureQueriesContext(django.db.connection) as queries:
+        ObjectSimilarity.set(objs[1], objs[3], 10)
+
+    assert not [query for query in queries if table in query['sql']]
+    assert not SimilarityChange.objects.exists()
+    assert memory_index.get_index() is None
+
+
+def test_concurrent_first_lookups(memory):
+    """Threads that all find no index wait for one load."""
+    def slow_load(index):
+        """Pretend to read everything."""
+        time.sleep(0.05)
+        index.changes_since = timezone.now()
+        index.checked = timeit.default_timer()
+
+    memory.RECOMMEND_MEMORY_INDEX_REFRESH = 60
+    with mock.patch.object(memory_index.MemoryIndex, 'load', autospec=True,
+                           side_effect=slow_load) as load:
+        threads = [threading.Thread(target=memory_index.get_index)
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert 1 == load.call_count
+
+
+def test_one_refresh_at_a_time(memory):
+    """Lookups made while a refresh runs don't start another one."""
+    index = memory_index.MemoryIndex(10)
+    index.changes_since = timezone.now()
+    index.checked = timeit.default_timer() - 1
+    memory.RECOMMEND_MEMORY_INDEX_REFRESH = 0.5
+
+    unlocked = []
+
+    def slow_refresh():
+        """Check whether the lock is held while the database is read."""
+        unlocked.append(index.lock.acquire(False))
+        if unlocked[-1]:
+            index.lock.release()
+        time.sleep(0.05)
+
+    with mock.patch.object(index, 'refresh',
+                           side_effect=slow_refresh) as refresh:
+        threads = [threading.Thread(target=index.update) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert 1 == refresh.call_count
+    assert [True] == unlocked
+
+
+@pytest.mark.django_db
+def test_recommend_warm(memory):
+    """recommend_warm loads the index and trims old changes."""
+    sample_similarities()
+    old = timezone.now() - datetime.timedelta(days=2)
+    SimilarityChange.objects.filter(pk__lte=2).update(changed=old)
+    remaining = SimilarityChange.objects.count() - 2
+    out = StringIO()
+
+    call_command('recommend_warm', stdout=out)
+
+    assert 'Loaded 10 neighbors of 4 objects' in out.getvalue()
+    assert 'Deleted 2 old changes' in out.getvalue()
+    assert remaining == SimilarityChange.objects.count()
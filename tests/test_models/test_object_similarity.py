@@ -3,11 +3,15 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import django.db
 import mock
 import pytest
 from django.contrib.contenttypes import models as ct_models
+from django.core.exceptions import ValidationError
+from django.test.utils import CaptureQueriesContext
 
 import django_recommend.tasks
+import people.models
 import quotes.models
 from django_recommend import models
 from tests.utils import make_quote
@@ -78,6 +82,36 @@ def test_set_0_doesnt_create():
         object_1_id=obj_a.id, object_2_id=obj_b.pk).exists()
 
 
+@pytest.mark.django_db
+def test_set_many():
+    """set_many() stores pairs in the same order and way as set()."""
+    quote_a = make_quote(content='Hello', pk=30)
+    quote_b = make_quote(content='World', pk=40)
+    quote_c = make_quote(content='Foo', pk=50)
+    key_a, key_b, key_c = [models.object_key(quote)
+                           for quote in (quote_a, quote_b, quote_c)]
+    models.ObjectSimilarity.set(quote_a, quote_c, 7)
+
+    models.ObjectSimilarity.set_many({(key_b, key_a): 20, (key_c, key_a): 0,
+                                      (key_b, key_c): 0})
+
+    sim_obj = models.ObjectSimilarity.objects.get()
+    assert sim_obj.object_1 == quote_a
+    assert sim_obj.object_2 == quote_b
+    assert sim_obj.score == 20
+
+
+@pytest.mark.django_db
+def test_set_many_similar_to_self():
+    """set_many() refuses to store an object's similarity to itself."""
+    key = models.object_key(make_quote(content='Hello'))
+
+    with pytest.raises(ValidationError):
+        models.ObjectSimilarity.set_many({(key, key): 3})
+
+    assert not models.ObjectSimilarity.objects.exists()
+
+
 @pytest.mark.django_db
 def test_instance_list():
     """Querysets/model managers have an instance_list method."""
@@ -93,6 +127,37 @@ def test_instance_list():
     assert [obj_b, obj_c] == list(instances)
 
 
+@pytest.mark.django_db
+def test_instance_list_query_count():
+    """get_instances_for loads all instances of a model in one query."""
+    obj_a = make_quote('Hello')
+    others = [make_quote('Quote {}'.format(i)) for i in range(5)]
+    for score, other in enumerate(others, start=1):
+        models.ObjectSimilarity.set(obj_a, other, score)
+    sims = models.ObjectSimilarity.objects.all().order_by('-score')
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        instances = sims.get_instances_for(obj_a)
+
+    assert list(reversed(others)) == instances
+    assert 2 == len(queries)  # The similarities, then the quotes.
+
+
+@pytest.mark.django_db
+def test_instance_list_mixed_models():
+    """get_instances_for keeps score order across content types."""
+    obj_a = make_quote('Hello')
+    obj_b = make_quote('World')
+    person = people.models.Person.objects.create(name='Dwight')
+    models.ObjectSimilarity.set(obj_a, obj_b, 1)
+    models.ObjectSimilarity.set(obj_a, person, 3)
+
+    instances = models.ObjectSimilarity.objects.all().order_by(
+        '-score').get_instances_for(obj_a)
+
+    assert [person, obj_b] == instances
+
+
 @pytest.mark.django_db
 def test_exclude_objects_qset():
     """ObjectSimilarity qset.exclude_objects can take a queryset."""
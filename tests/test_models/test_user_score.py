@@ -93,3 +93,19 @@ def test_signal_handler_delete(test_quote):
         test_quote.delete()
 
     assert not sig_handler.called
+
+
+@pytest.mark.django_db
+def test_scores_for_many_chunks():
+    """scores_for_many() splits lookups to respect MAX_QUERY_PARAMS."""
+    quotes_list = [quotes.models.Quote.objects.create(content=str(i))
+                   for i in range(5)]
+    for score, quote in enumerate(quotes_list, start=1):
+        django_recommend.models.UserScore.set('foo', quote, score)
+
+    with mock.patch('django_recommend.models.MAX_QUERY_PARAMS', 3):
+        scores = django_recommend.models.UserScore.scores_for_many(
+            quotes_list)
+
+    assert [{'foo': i} for i in range(1, 6)] == [
+        scores[quote] for quote in quotes_list]
@@ -4,11 +4,14 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import django.db
 import mock
 import pytest
 import testfixtures
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import models as ct_models
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.test.utils import CaptureQueriesContext
 
 import django_recommend.models
 import django_recommend.tasks
@@ -72,6 +75,24 @@ def test_set_score_direct_user():
     assert django_recommend.scores_for(quote) == {'user:3': 5}
 
 
+@pytest.mark.django_db
+def test_scores_for_many():
+    """scores_for_many() gets the scores for several objects at once."""
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    quote_c = make_quote('baz')
+    person = people.models.Person.objects.create(name='Andy')
+    django_recommend.set_score('abc', quote_a, 1)
+    django_recommend.set_score('def', quote_a, 2)
+    django_recommend.set_score('abc', person, 3)
+    django_recommend.set_score('abc', quote_c, 4)
+
+    scores = django_recommend.scores_for_many([quote_a, quote_b, person])
+
+    assert {quote_a: {'abc': 1, 'def': 2}, quote_b: {},
+            person: {'abc': 3}} == scores
+
+
 @pytest.mark.django_db
 def test_get_score_with_user():
     """The get_score function can get the user's score for an object."""
@@ -92,6 +113,24 @@ def test_get_score_when_unset():
     assert django_recommend.get_score(user, quote) == 0
 
 
+@pytest.mark.django_db
+def test_get_scores():
+    """get_scores() gets a user's scores for several objects at once."""
+    user = User.objects.create()
+    quote_a = make_quote('foo')
+    quote_b = make_quote('bar')
+    person = people.models.Person.objects.create(name='Andy')
+    django_recommend.set_score(user, quote_a, 2)
+    django_recommend.set_score(user, person, 3)
+    django_recommend.set_score('abc', quote_b, 4)  # Someone else's score
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        scores = django_recommend.get_scores(user, [quote_a, quote_b, person])
+
+    assert 1 == len(queries)
+    assert {quote_a: 2, quote_b: 0, person: 3} == scores
+
+
 @pytest.mark.django_db
 def test_setdefault_score():
     """setdefault_score only sets a score if it doesn't exist."""
@@ -145,6 +184,95 @@ def test_setdefault_score_str(some_quote):
     assert django_recommend.get_score('qwerty', some_quote) == 20
 
 
+@pytest.mark.django_db
+def test_set_scores(settings):
+    """set_scores() writes many scores, then queues updates once each."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    user = User.objects.create()
+    quote = [make_quote('quote {}'.format(i)) for i in range(5)]
+    person = people.models.Person.objects.create(name='Phyllis')
+    django_recommend.set_score(user, quote[0], 1)  # Will change
+    django_recommend.set_score(user, quote[1], 2)  # Will be deleted
+    django_recommend.set_score(user, quote[2], 3)  # Will stay the same
+    ctype_id = ct_models.ContentType.objects.get_for_model(quote[0]).pk
+    person_ctype_id = ct_models.ContentType.objects.get_for_model(person).pk
+
+    with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+        with CaptureQueriesContext(django.db.connection) as queries:
+            changed = django_recommend.set_scores(user, [
+                (quote[0], 4), (quote[1], 0), (quote[2], 3), (quote[3], 0),
+                (quote[4], 1), (quote[4], 5), (person, 2)])
+
+    # SAVEPOINT, SELECT, DELETE, INSERT, UPDATE, RELEASE SAVEPOINT
+    assert 6 == len(queries)
+    assert ([4, 0, 3, 0, 5] ==
+            [django_recommend.get_score(user, obj) for obj in quote])
+    assert 2 == django_recommend.get_score(user, person)
+    assert 4 == len(changed)
+    expected_keys = sorted(
+        [(ctype_id, quote[i].pk) for i in (0, 1, 4)] +
+        [(person_ctype_id, person.pk)])
+    assert ([mock.call((obj_id, ctype)) for ctype, obj_id in expected_keys] ==
+            schedule.call_args_list)
+
+
+@pytest.mark.django_db
+def test_set_scores_sends_no_signals(settings):
+    """set_scores() deletes without signals, and queues each update once."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    quote = make_quote('foo')
+    django_recommend.set_score('abc', quote, 3)
+    receiver = mock.MagicMock()
+    user_score = django_recommend.models.UserScore
+    for signal in (pre_delete, post_delete, post_save):
+        signal.connect(receiver, sender=user_score, weak=False)
+
+    try:
+        with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+            django_recommend.set_scores('abc', [(quote, 0)])
+    finally:
+        for signal in (pre_delete, post_delete, post_save):
+            signal.disconnect(receiver, sender=user_score)
+
+    assert not user_score.objects.exists()
+    assert not receiver.called
+    assert 1 == schedule.call_count
+
+
+@pytest.mark.django_db
+def test_setdefault_scores(settings):
+    """setdefault_scores() only adds scores for objects without one."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    django_recommend.set_score('abc', quote[0], 7)
+    ctype_id = ct_models.ContentType.objects.get_for_model(quote[0]).pk
+
+    with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+        django_recommend.setdefault_scores(
+            'abc', [(quote[0], 1), (quote[1], 2), (quote[2], 3)])
+
+    assert [7, 2, 3] == [django_recommend.get_score('abc', obj)
+                         for obj in quote]
+    assert [mock.call((quote[1].pk, ctype_id)),
+            mock.call((quote[2].pk, ctype_id))] == schedule.call_args_list
+
+
+@pytest.mark.django_db
+def test_set_scores_blank_session(client):
+    """set_scores() and setdefault_scores() need a session key."""
+    request = client.get('/url-doesnt-matter').wsgi_request
+    blank_session = mock.patch.object(type(request.session), 'session_key', '')
+
+    with testfixtures.LogCapture() as logs, blank_session:
+        django_recommend.set_scores(request, [(object(), 3)])
+        django_recommend.setdefault_scores(request, [(object(), 3)])
+
+    msg = ("Can't track score: anonymous user has no session key. Do you need "
+           'to set SESSION_SAVE_EVERY_REQUEST=True ?')
+    logs.check(('django_recommend', 'WARNING', msg),
+               ('django_recommend', 'WARNING', msg))
+
+
 @pytest.mark.django_db
 def test_get_similar_objects():
     """get_similar_objects gets instances most similar to the given object."""
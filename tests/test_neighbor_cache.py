@@ -0,0 +1,108 @@
+# coding: utf-8
+"""Tests for the neighbor list cache."""
+# pylint: disable=redefined-outer-name
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import pytest
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+import django_recommend.models
+import django_recommend.tasks
+from django_recommend.models import ObjectSimilarity, object_key
+from tests.utils import make_quote, similar_objects_queries
+
+
+@pytest.fixture
+def neighbor_cache(settings):
+    """Turn on the neighbor cache."""
+    settings.RECOMMEND_NEIGHBOR_CACHE = True
+    return settings
+
+
+@pytest.mark.django_db
+def test_cache_hit(neighbor_cache):  # pylint: disable=unused-argument
+    """Cached neighbor lists don't query ObjectSimilarity."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    ObjectSimilarity.set(quote[0], quote[1], 5)
+    ObjectSimilarity.set(quote[0], quote[2], 10)
+    table = ObjectSimilarity._meta.db_table
+
+    first, queries = similar_objects_queries(quote[0])
+    assert [quote[2], quote[1]] == first
+    assert any(table in sql for sql in queries)
+
+    second, queries = similar_objects_queries(quote[0])
+    assert first == second
+    assert 1 == len(queries)  # Just loading the quotes.
+    assert table not in queries[0]
+
+
+@pytest.mark.django_db
+def test_cache_size(neighbor_cache):
+    """Cached neighbor lists are cut off at the configured size."""
+    neighbor_cache.RECOMMEND_NEIGHBOR_CACHE_SIZE = 2
+    quote = [make_quote('quote {}'.format(i)) for i in range(4)]
+    for score, other in enumerate(quote[1:], start=1):
+        ObjectSimilarity.set(quote[0], other, score)
+
+    assert [quote[3], quote[2]] == django_recommend.similar_objects(quote[0])
+
+
+@pytest.mark.django_db
+def test_set_invalidates(neighbor_cache):  # pylint: disable=unused-argument
+    """ObjectSimilarity.set() and set_many() invalidate both objects."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    ObjectSimilarity.set(quote[0], quote[1], 5)
+    assert [quote[1]] == django_recommend.similar_objects(quote[0])
+    assert [quote[0]] == django_recommend.similar_objects(quote[1])
+
+    ObjectSimilarity.set(quote[2], quote[0], 10)
+    assert quote[2:0:-1] == django_recommend.similar_objects(quote[0])
+
+    ObjectSimilarity.set_many({
+        (object_key(quote[1]), object_key(quote[2])): 20,
+        (object_key(quote[0]), object_key(quote[2])): 0,
+    })
+    assert [quote[1]] == django_recommend.similar_objects(quote[0])
+    assert [quote[2], quote[0]] == django_recommend.similar_objects(quote[1])
+
+
+@pytest.mark.django_db
+def test_forget_object_invalidates(neighbor_cache):
+    """forget_object() invalidates the lists of the object's neighbors."""
+    neighbor_cache.RECOMMEND_PURGE_MISSING_DATA = False
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    ObjectSimilarity.set(quote[0], quote[1], 5)
+    ObjectSimilarity.set(quote[0], quote[2], 10)
+    assert quote[2:0:-1] == django_recommend.similar_objects(quote[0])
+    ctype_id, quote_2_pk = object_key(quote[2])
+    quote[2].delete()
+
+    django_recommend.forget_object(ctype_id, quote_2_pk)
+
+    assert [quote[1]] == django_recommend.similar_objects(quote[0])
+
+
+@pytest.mark.django_db
+def test_update_and_rebuild_invalidate(neighbor_cache):
+    """update_similarity and recommend_rebuild invalidate cached lists."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(3)]
+    assert [] == django_recommend.similar_objects(quote[0])
+    django_recommend.set_score('foo', quote[0], 1)
+    django_recommend.set_score('foo', quote[1], 2)
+
+    for buffered in (False, True):
+        neighbor_cache.RECOMMEND_BUFFER_RESULTS = buffered
+        ObjectSimilarity.set(quote[0], quote[1], 0)
+        assert [] == django_recommend.similar_objects(quote[0])
+
+        django_recommend.tasks.update_similarity(quote[0])
+
+        assert [quote[1]] == django_recommend.similar_objects(quote[0])
+
+    django_recommend.set_score('foo', quote[2], 3)
+    call_command('recommend_rebuild', stdout=StringIO())
+
+    assert quote[2:0:-1] == django_recommend.similar_objects(quote[0])
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""Tests for the memory-mapped neighbor index."""
+# pylint: disable=redefined-outer-name
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import gc
+import os
+import weakref
+
+import django.db
+import mock
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from testfixtures import LogCapture
+
+import django_recommend
+from django_recommend import neighbor_index
+from django_recommend.models import ObjectSimilarity, object_key
+from tests.utils import sample_similarities
+
+
+@pytest.fixture
+def index_path(settings, tmpdir):
+    """Point RECOMMEND_NEIGHBOR_INDEX at a file in a temporary directory."""
+    path = str(tmpdir.join('neighbors.idx'))
+    settings.RECOMMEND_NEIGHBOR_INDEX = path
+    return path
+
+
+def expected_neighbors(obj):
+    """Get obj's neighbors from the database, like the index stores them."""
+    neighbors = []
+    for sim in django_recommend.similar_to(obj):
+        other_key = (sim.object_2_content_type_id, sim.object_2_id)
+        if other_key == object_key(obj):
+            other_key = (sim.object_1_content_type_id, sim.object_1_id)
+        neighbors.append(other_key + (sim.score,))
+    return neighbors
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_export(index_path, settings, layout):
+    """The index holds every object's neighbors, best first."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = layout
+    objs = sample_similarities()
+
+    assert (4, 10) == neighbor_index.export(index_path)
+
+    index = neighbor_index.get_index()
+    assert 4 == len(index)
+    for obj in objs:
+        assert expected_neighbors(obj) == index.get_neighbors(
+            object_key(obj))
+    assert expected_neighbors(objs[0])[:2] == index.get_neighbors(
+        object_key(objs[0]), limit=2)
+    assert [] == index.get_neighbors(object_key(objs[3]))
+    assert [] == index.get_neighbors((12345, 1))
+
+
+@pytest.mark.django_db
+def test_export_size(index_path):
+    """Only the best size neighbors of each object are exported."""
+    objs = sample_similarities()
+
+    assert (4, 4) == neighbor_index.export(index_path, size=1)
+
+    index = neighbor_index.get_index()
+    assert expected_neighbors(objs[0])[:1] == index.get_neighbors(
+        object_key(objs[0]))
+
+
+@pytest.mark.django_db
+def test_similar_objects(index_path):
+    """similar_objects() reads neighbor lists from the index."""
+    objs = sample_similarities()
+    neighbor_index.export(index_path)
+    ObjectSimilarity.set(objs[0], objs[3], 100)
+    table = ObjectSimilarity._meta.db_table
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        similar = django_recommend.similar_objects(objs[0])
+
+    assert [objs[2], objs[4], objs[1]] == similar
+    assert not [query for query in queries if table in query['sql']]
+
+
+@pytest.mark.django_db
+def test_missing_index(index_path):
+    """Without the index file, similar_objects() uses the database."""
+    objs = sample_similarities()
+
+    with LogCapture() as logs:
+        for _ in range(3):
+            assert [objs[2], objs[4], objs[1]] == list(
+                django_recommend.similar_objects(objs[0]))
+    assert not os.path.exists(index_path)
+    assert 1 == len(logs.records)
+
+    # Once the file turns up and goes away again, it's logged again.
+    neighbor_index.export(index_path)
+    assert neighbor_index.get_index() is not None
+    os.remove(index_path)
+    with LogCapture() as logs:
+        assert neighbor_index.get_index() is None
+    assert 1 == len(logs.records)
+
+
+@pytest.mark.django_db
+def test_reexport(index_path):
+    """A new export replaces the index for running processes."""
+    objs = sample_similarities()
+    neighbor_index.export(index_path)
+    first_index = neighbor_index.get_index()
+    assert first_index is neighbor_index.get_index()
+    ObjectSimilarity.set(objs[0], objs[3], 100)
+
+    neighbor_index.export(index_path)
+
+    assert first_index is not neighbor_index.get_index()
+    assert objs[3] == django_recommend.similar_objects(objs[0])[0]
+
+    # Readers still holding the old index can finish with it, and it's
+    # unmapped once they let go of it.
+    assert object_key(objs[2]) == (
+        first_index.get_neighbors(object_key(objs[0]))[0][:2])
+    first_ref = weakref.ref(first_index)
+    del first_index
+    gc.collect()
+    assert first_ref() is None
+
+
+@pytest.mark.django_db
+def test_failed_export(index_path):
+    """A failed export leaves the old index alone, and cleans up."""
+    sample_similarities()
+    neighbor_index.export(index_path)
+    with open(index_path, 'rb') as index_file:
+        expected = index_file.read()
+
+    with mock.patch('django_recommend.neighbor_index.neighbor_rows',
+                    side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            neighbor_index.export(index_path)
+
+    with open(index_path, 'rb') as index_file:
+        assert expected == index_file.read()
+    assert [os.path.basename(index_path)] == os.listdir(
+        os.path.dirname(index_path))
+
+
+def test_not_an_index(tmpdir):
+    """Other files aren't mistaken for an index."""
+    path = tmpdir.join('other')
+    path.write(b'x' * 100, mode='wb')
+
+    with pytest.raises(ValueError):
+        neighbor_index.NeighborIndex(str(path))
+
+
+@pytest.mark.django_db
+def test_recommend_export_index(index_path):
+    """recommend_export_index writes the index to the configured path."""
+    objs = sample_similarities()
+    out = StringIO()
+
+    call_command('recommend_export_index', stdout=out)
+
+    assert 'Exported 10 neighbors of 4 objects' in out.getvalue()
+    assert expected_neighbors(objs[1]) == (
+        neighbor_index.get_index().get_neighbors(object_key(objs[1])))
+
+
+def test_recommend_export_index_no_path():
+    """recommend_export_index needs somewhere to write to."""
+    with pytest.raises(CommandError):
+        call_command('recommend_export_index', stdout=StringIO())
@@ -0,0 +1,123 @@
+# coding: utf-8
+"""Tests for profiling update_similarity runs."""
+# pylint: disable=redefined-outer-name
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+import mock
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+
+import django_recommend
+import django_recommend.tasks
+from django_recommend import profiling
+from django_recommend.models import object_key
+from tests.utils import make_quote
+
+
+@pytest.fixture
+def profile_dir(settings, tmpdir):
+    """Save profiles to a temporary directory (which doesn't exist yet)."""
+    directory = str(tmpdir.join('profiles'))
+    settings.RECOMMEND_PROFILE_DIR = directory
+    return directory
+
+
+def update_quote():
+    """Score a quote and update its similarities, returning it."""
+    quote_a, quote_b = make_quote('foo'), make_quote('bar')
+    django_recommend.set_score('abc', quote_a, 1)
+    django_recommend.set_score('abc', quote_b, 2)
+    django_recommend.tasks.update_similarity(quote_a)
+    return quote_a
+
+
+def saved_profiles(directory):
+    """List the profile files in directory."""
+    if not os.path.exists(directory):
+        return []
+    return sorted(os.listdir(directory))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('rate,threshold,saved', [
+    (1, None, True),
+    (0, None, False),
+    (0, 0, True),
+    (0, 60, False),
+    (1, 60, True),
+])
+def test_profile_saved(profile_dir, settings, rate, threshold, saved):
+    """Runs are saved when sampled, or when slower than the threshold."""
+    settings.RECOMMEND_PROFILE_SAMPLE_RATE = rate
+    settings.RECOMMEND_PROFILE_THRESHOLD = threshold
+
+    quote = update_quote()
+
+    profiles = saved_profiles(profile_dir)
+    assert saved == bool(profiles)
+    if saved:
+        prefix = '{}-{}-'.format(*object_key(quote))
+        assert [True] == [name.startswith(prefix) and name.endswith('.prof')
+                          for name in profiles]
+
+
+@pytest.mark.django_db
+def test_no_directory(settings):
+    """Nothing is profiled without RECOMMEND_PROFILE_DIR."""
+    settings.RECOMMEND_PROFILE_SAMPLE_RATE = 1
+    with mock.patch('cProfile.Profile') as profile:
+        update_quote()
+    assert not profile.called
+
+
+def test_make_directory(tmpdir):
+    """Existing directories are fine, but other errors are raised."""
+    profiling.make_directory(str(tmpdir))
+    blocker = tmpdir.join('profiles')
+    blocker.write('Not a directory.')
+
+    with pytest.raises(OSError):
+        profiling.make_directory(str(blocker.join('nested')))
+
+
+@pytest.mark.django_db
+def test_sample_rate(profile_dir, settings):
+    """Runs are sampled with probability RECOMMEND_PROFILE_SAMPLE_RATE."""
+    settings.RECOMMEND_PROFILE_SAMPLE_RATE = 0.5
+    with mock.patch('random.random', side_effect=[0.7, 0.2]):
+        quote = update_quote()
+        assert not saved_profiles(profile_dir)
+        django_recommend.tasks.update_similarity(quote)
+        assert 1 == len(saved_profiles(profile_dir))
+
+
+@pytest.mark.django_db
+def test_recommend_profiles(profile_dir, settings):
+    """recommend_profiles summarizes the functions in all saved profiles."""
+    settings.RECOMMEND_PROFILE_SAMPLE_RATE = 1
+    quote = update_quote()
+    django_recommend.tasks.update_similarity(quote)
+
+    out = StringIO()
+    call_command('recommend_profiles', limit=5, sort='tottime', stdout=out)
+
+    assert out.getvalue().startswith('2 profiles')
+    assert 'function calls' in out.getvalue()
+
+
+def test_recommend_profiles_empty(tmpdir):
+    """recommend_profiles says so when there's nothing to summarize."""
+    out = StringIO()
+    call_command('recommend_profiles', directory=str(tmpdir), stdout=out)
+    assert 'No profiles' in out.getvalue()
+
+
+def test_recommend_profiles_no_directory():
+    """recommend_profiles needs a directory."""
+    with pytest.raises(CommandError):
+        call_command('recommend_profiles', stdout=StringIO())
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""Tests for neighbor limits."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+
+import django_recommend.models
+import django_recommend.pruning
+import django_recommend.tasks
+import people.models
+from django_recommend.models import object_key
+from tests.utils import make_quote
+
+
+def stored_pairs():
+    """Get all stored similarities as a set of (id_1, id_2) pairs."""
+    return set(django_recommend.models.ObjectSimilarity.objects.values_list(
+        'object_1_id', 'object_2_id'))
+
+
+def sample_similarities():
+    """Store some similarities between four quotes, returning the quotes."""
+    quote = [make_quote('quote {}'.format(i), pk=i + 1) for i in range(4)]
+    set_sim = django_recommend.models.ObjectSimilarity.set
+    set_sim(quote[0], quote[1], 10)
+    set_sim(quote[0], quote[2], 5)
+    set_sim(quote[0], quote[3], 1)
+    set_sim(quote[1], quote[2], 2)
+    set_sim(quote[2], quote[3], 3)
+    return quote
+
+
+def test_prune_totals(settings):
+    """Pairs are kept if they are a top neighbor of either object."""
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+    key = [(1, i) for i in range(4)]
+    totals = {(key[0], key[1]): 10, (key[0], key[2]): 5, (key[0], key[3]): 1,
+              (key[1], key[2]): 2, (key[2], key[3]): 3, (key[1], key[3]): 0}
+
+    kept = django_recommend.pruning.kept_pairs(totals, set(key))
+    pruned = django_recommend.pruning.prune_totals(totals, kept)
+
+    assert {(key[0], key[1]): 10, (key[0], key[2]): 5,
+            (key[2], key[3]): 3} == pruned
+
+
+@pytest.mark.django_db
+def test_prune_all(settings):
+    """prune_all() applies the limits to everything stored."""
+    sample_similarities()
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+
+    assert 2 == django_recommend.pruning.prune_all(batch_size=3)
+
+    assert {(1, 2), (1, 3), (3, 4)} == stored_pairs()
+
+
+@pytest.mark.django_db
+def test_prune_keys(settings):
+    """prune() only checks the similarities of the given objects."""
+    quote = sample_similarities()
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+
+    django_recommend.pruning.prune([object_key(quote[3])])
+
+    # Quote 3's top neighbor is quote 2, and quote 0 keeps quote 3 out of
+    # its top neighbors, so only that similarity goes.
+    assert {(1, 2), (1, 3), (2, 3), (3, 4)} == stored_pairs()
+
+
+@pytest.mark.django_db
+def test_per_model_limit(settings):
+    """Limits can be set per model, overriding the global limit."""
+    quote = sample_similarities()
+    person = people.models.Person.objects.create(name='Creed')
+    set_sim = django_recommend.models.ObjectSimilarity.set
+    set_sim(person, quote[0], 0.5)
+    set_sim(person, quote[1], 0.25)
+    settings.RECOMMEND_MAX_NEIGHBORS_PER_MODEL = {'quotes.quote': 1}
+
+    django_recommend.pruning.prune_all()
+
+    # People have no limit, so they keep all their similarities.
+    assert quote[:2] == django_recommend.similar_objects(person)
+    assert [quote[0], person] == django_recommend.similar_objects(quote[1])
+    assert [quote[2]] == django_recommend.similar_objects(quote[3])
+
+
+@pytest.mark.django_db
+def test_update_similarity_prunes(settings):
+    """Results written by update_similarity respect the limits."""
+    quote = [make_quote('quote {}'.format(i)) for i in range(4)]
+    for score, obj in enumerate(quote, start=1):
+        django_recommend.set_score('foo', obj, score)
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+
+    for buffered in (False, True):
+        settings.RECOMMEND_BUFFER_RESULTS = buffered
+        django_recommend.tasks.update_similarity(quote[0])
+
+        # Everyone's top neighbor is quote 3, which has the highest score, so
+        # quote 3 keeps all of its neighbors.
+        assert [quote[3]] == django_recommend.similar_objects(quote[0])
+        assert quote[2::-1] == django_recommend.similar_objects(quote[3])
+        assert 3 == django_recommend.models.ObjectSimilarity.objects.count()
+
+
+@pytest.mark.django_db
+def test_prune_command(settings):
+    """recommend_prune trims the stored similarities."""
+    sample_similarities()
+    settings.RECOMMEND_MAX_NEIGHBORS = 1
+    out = StringIO()
+
+    call_command('recommend_prune', stdout=out)
+
+    assert 'Deleted 2 similarities.' in out.getvalue()
+    assert {(1, 2), (1, 3), (3, 4)} == stored_pairs()
+
+
+def test_prune_command_no_limits():
+    """recommend_prune refuses to run without any limits configured."""
+    with pytest.raises(CommandError):
+        call_command('recommend_prune', stdout=StringIO())
@@ -0,0 +1,104 @@
+# coding: utf-8
+"""Tests for per-user recommendations."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import django.db
+import mock
+import pytest
+import testfixtures
+from django.contrib.auth.models import User
+from django.test.utils import CaptureQueriesContext
+
+import django_recommend
+import django_recommend.models
+import django_recommend.recommendations
+import people.models
+import quotes.models
+from django_recommend.models import ObjectSimilarity
+from tests.utils import make_quote
+
+
+def sample_data():
+    """Score two quotes and store similarities to three others."""
+    quote = [make_quote('quote {}'.format(i), pk=i + 1) for i in range(5)]
+    person = people.models.Person.objects.create(name='Oscar')
+    django_recommend.set_score('abc', quote[0], 2)
+    django_recommend.set_score('abc', quote[1], 1)
+    ObjectSimilarity.set(quote[0], quote[1], 10)  # Both already rated
+    ObjectSimilarity.set(quote[0], quote[2], 1)
+    ObjectSimilarity.set(quote[1], quote[2], 1)
+    ObjectSimilarity.set(quote[3], quote[1], 4)
+    ObjectSimilarity.set(quote[0], person, 1.25)
+    ObjectSimilarity.set(quote[2], quote[4], 100)  # Not near anything rated
+    return quote, person
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_recommend_for_user(settings, layout):
+    """Neighbors are ranked by similarity weighted by the user's scores."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = layout
+    quote, person = sample_data()
+
+    # quote 3: 1 * 4; quote 2: 2 * 1 + 1 * 1; person: 2 * 1.25
+    assert [quote[3], quote[2], person] == (
+        django_recommend.recommend_for_user('abc', 5))
+    assert [quote[3]] == django_recommend.recommend_for_user('abc', 1)
+    assert [quote[3], quote[2]] == django_recommend.recommend_for_user(
+        'abc', 5, model=quotes.models.Quote)
+    assert [person] == django_recommend.recommend_for_user(
+        'abc', 5, model=people.models.Person)
+
+
+@pytest.mark.django_db
+def test_rank_checks_model():
+    """rank() skips candidates of other models, whatever the rows are."""
+    quote, person = sample_data()
+    rated_key = django_recommend.models.object_key(quote[0])
+    rows = [(rated_key, django_recommend.models.object_key(person), 5),
+            (rated_key, django_recommend.models.object_key(quote[2]), 1)]
+
+    with mock.patch('django_recommend.recommendations.neighbor_rows',
+                    return_value=rows):
+        ranked = django_recommend.recommendations.rank(
+            'abc', quotes.models.Quote)
+
+    assert [(django_recommend.models.object_key(quote[2]), 2)] == ranked
+
+
+@pytest.mark.django_db
+def test_recommend_for_user_query_count():
+    """The number of queries doesn't depend on the user's history."""
+    user = User.objects.create()
+    quote = [make_quote('quote {}'.format(i)) for i in range(50)]
+    for i, obj in enumerate(quote[:40]):
+        django_recommend.set_score(user, obj, 1)
+        ObjectSimilarity.set(obj, quote[40 + i % 10], i)
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        recommended = django_recommend.recommend_for_user(user, 3)
+
+    # Scores, similarities, quotes.
+    assert 3 == len(queries)
+    assert quote[49:46:-1] == recommended
+
+
+@pytest.mark.django_db
+def test_recommend_for_user_no_history():
+    """Users who haven't scored anything get no recommendations."""
+    sample_data()
+
+    assert [] == django_recommend.recommend_for_user('xyz', 5)
+
+
+@pytest.mark.django_db
+def test_recommend_for_user_blank_session(client):
+    """Anonymous users without a session key get no recommendations."""
+    request = client.get('/url-doesnt-matter').wsgi_request
+    blank_session = mock.patch.object(type(request.session), 'session_key', '')
+
+    with testfixtures.LogCapture() as logs, blank_session:
+        assert [] == django_recommend.recommend_for_user(request, 5)
+
+    logs.check()
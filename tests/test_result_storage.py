@@ -3,8 +3,10 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import django.db
 import pytest
 from django.contrib.contenttypes import models as ct_models
+from django.test.utils import CaptureQueriesContext
 
 import django_recommend.models
 import django_recommend.storage
@@ -31,3 +33,51 @@ def test_store_results():
     assert django_recommend.models.ObjectSimilarity.objects.filter(
         object_1_id=quote_a.pk, object_1_content_type=ctype,
         object_2_id=quote_b.pk, object_2_content_type=ctype).exists()
+
+
+@pytest.mark.django_db
+def test_buffered_waits_for_flush():
+    """Buffered ResultStorage only writes when flushed."""
+    make_quote = quotes.models.Quote.objects.create
+    quote_a = make_quote(content='Hello')
+    quote_b = make_quote(content='World')
+
+    storage = django_recommend.storage.ResultStorage(buffered=True)
+    storage[(quote_a, quote_b)] = 5
+
+    assert not django_recommend.models.ObjectSimilarity.objects.exists()
+
+    storage.flush()
+
+    assert [quote_b] == django_recommend.similar_objects(quote_a)
+    assert 5 == django_recommend.similar_to(quote_a).get().score
+
+
+@pytest.mark.django_db
+def test_buffered_flush_queries():
+    """Flushing inserts, updates and deletes with a few bulk queries."""
+    make_quote = quotes.models.Quote.objects.create
+    quote = [make_quote(content='quote {}'.format(i)) for i in range(6)]
+    set_sim = django_recommend.models.ObjectSimilarity.set
+    set_sim(quote[0], quote[1], 1)  # Will be updated
+    set_sim(quote[0], quote[2], 2)  # Will be deleted
+    set_sim(quote[0], quote[3], 3)  # Will not change
+    ct_models.ContentType.objects.get_for_model(quote[0])  # Warm the cache
+
+    storage = django_recommend.storage.ResultStorage(buffered=True)
+    storage[(quote[1], quote[0])] = 10
+    storage[(quote[0], quote[2])] = 0
+    storage[(quote[0], quote[3])] = 3
+    storage[(quote[0], quote[4])] = 4
+    storage[(quote[5], quote[0])] = 5
+    storage[(quote[4], quote[5])] = 0  # Never stored, so nothing happens
+
+    with CaptureQueriesContext(django.db.connection) as queries:
+        storage.flush()
+
+    # SAVEPOINT, SELECT, DELETE, INSERT, UPDATE, RELEASE SAVEPOINT
+    assert 6 == len(queries)
+    assert [quote[1], quote[5], quote[4], quote[3]] == (
+        django_recommend.similar_objects(quote[0]))
+    assert [10, 5, 4, 3] == list(django_recommend.similar_to(
+        quote[0]).values_list('score', flat=True))
@@ -0,0 +1,259 @@
+# coding: utf-8
+"""Tests for rebuilding similarities in a shadow table."""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+
+import django.db
+import mock
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.six import StringIO
+
+import django_recommend
+import django_recommend.rebuild
+from django_recommend.models import (ObjectSimilarity, SimilarityGeneration,
+                                     object_key)
+from tests.test_commands import sample_data
+from tests.utils import similarity_rows
+
+
+def table_names():
+    """Get the names of all tables in the database."""
+    connection = django.db.connection
+    with connection.cursor() as cursor:
+        return connection.introspection.table_names(cursor)
+
+
+def indexes(table):
+    """Get the names and column lists of table's non-unique indexes."""
+    connection = django.db.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return {name: tuple(info['columns']) for name, info in constraints.items()
+            if info['index'] and not info['unique']}
+
+
+def indexed_columns(table):
+    """Get the column lists of table's non-unique indexes."""
+    return sorted(indexes(table).values())
+
+
+def latest_generation():
+    """Get the last finished generation."""
+    return SimilarityGeneration.objects.exclude(
+        finished=None).order_by('-pk').first()
+
+
+def create_abandoned(started):
+    """Create an unfinished generation started at started, with a table."""
+    generation = SimilarityGeneration.objects.create()
+    SimilarityGeneration.objects.filter(pk=generation.pk).update(
+        started=started)
+    bare_model = django_recommend.rebuild.shadow_model(
+        generation.table_name())
+    with django.db.connection.schema_editor() as editor:
+        editor.create_model(bare_model)
+    return generation
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_matches_plain_rebuild(settings, layout):
+    """A shadow rebuild stores the same rows, with the same indexes."""
+    settings.RECOMMEND_SIMILARITY_LAYOUT = layout
+    sample_data()
+    table = ObjectSimilarity._meta.db_table
+    expected_count = django_recommend.rebuild.rebuild()
+    expected = similarity_rows()
+    expected_indexes = indexed_columns(table)
+
+    assert expected_count == django_recommend.rebuild.rebuild(shadow=True)
+
+    assert expected == similarity_rows()
+    assert expected_indexes == indexed_columns(table)
+    generation = latest_generation()
+    assert expected_count == generation.similarities
+    assert generation.table_name() not in table_names()
+    assert generation.table_name() + '_old' not in table_names()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_generations(settings):
+    """Each shadow rebuild is a new generation, and can be repeated."""
+    objs = sample_data()
+    call_command('recommend_rebuild', shadow=True, stdout=StringIO())
+    first = latest_generation()
+    first_indexes = indexes(ObjectSimilarity._meta.db_table)
+    django_recommend.set_score('foo', objs[2], 5)
+
+    out = StringIO()
+    call_command('recommend_rebuild', shadow=True, stdout=out)
+
+    assert first.pk < latest_generation().pk
+    # The index names alternate between two slots, and never mention a
+    # generation.
+    second_indexes = indexes(ObjectSimilarity._meta.db_table)
+    assert sorted(first_indexes.values()) == sorted(second_indexes.values())
+    assert not set(first_indexes) & set(second_indexes)
+    assert not [name for name in second_indexes if '_g' in name[-14:]]
+    call_command('recommend_rebuild', shadow=True, stdout=StringIO())
+    assert first_indexes == indexes(ObjectSimilarity._meta.db_table)
+    assert 'Rebuilt' in out.getvalue()
+    sims = django_recommend.similar_to(objs[2])
+    ctype_id, obj_id = object_key(objs[0])
+    assert 25 == sims.get(object_1_content_type=ctype_id,
+                          object_1_id=obj_id).score
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failure_keeps_live_table():
+    """A failed shadow rebuild leaves the live table alone, and cleans up."""
+    sample_data()
+    django_recommend.rebuild.rebuild()
+    expected = similarity_rows()
+
+    with mock.patch('django_recommend.rebuild.insert_similarities',
+                    side_effect=ValueError):
+        with pytest.raises(ValueError):
+            django_recommend.rebuild.rebuild(shadow=True)
+
+    assert expected == similarity_rows()
+    assert not SimilarityGeneration.objects.exists()
+    live_table = ObjectSimilarity._meta.db_table
+    assert [live_table] == [name for name in table_names()
+                            if name.startswith(live_table)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_abandoned_generation_dropped():
+    """Tables left by rebuilds that died are dropped by the next one."""
+    sample_data()
+    abandoned = create_abandoned(timezone.now() - datetime.timedelta(days=2))
+
+    django_recommend.rebuild.rebuild(shadow=True)
+
+    assert abandoned.table_name() not in table_names()
+    assert [latest_generation()] == list(SimilarityGeneration.objects.all())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_running_generation_kept(settings):
+    """A rebuild that may still be running keeps its table."""
+    settings.RECOMMEND_SHADOW_REBUILD_TIMEOUT = 60 * 60
+    sample_data()
+    running = create_abandoned(
+        timezone.now() - datetime.timedelta(minutes=5))
+
+    django_recommend.rebuild.rebuild(shadow=True)
+
+    assert running.table_name() in table_names()
+    assert SimilarityGeneration.objects.filter(pk=running.pk).exists()
+    django_recommend.rebuild.drop_table(django.db.connection,
+                                        running.table_name())
+
+
+def stored_keys():
+    """Get the keys of all objects with stored similarities."""
+    return {key for row in similarity_rows() for key in [row[:2], row[2:4]]}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('shadow', [False, True])
+def test_zero_sums_skipped(shadow):
+    """Pairs whose score products add up to 0 aren't stored."""
+    quote_a, quote_b, quote_c = sample_data()[:3]
+    # foo scored them 3 and 2, which this cancels out.
+    django_recommend.set_score('opposite', quote_a, -3)
+    django_recommend.set_score('opposite', quote_b, 2)
+
+    django_recommend.rebuild.rebuild(shadow=shadow)
+
+    pairs = {(row[1], row[3]) for row in similarity_rows()}
+    assert not pairs & {(quote_a.pk, quote_b.pk), (quote_b.pk, quote_a.pk)}
+    assert pairs & {(quote_a.pk, quote_c.pk), (quote_c.pk, quote_a.pk)}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_swap_reports_changes(settings):
+    """Objects with similarities before or after the swap are reported."""
+    settings.RECOMMEND_NEIGHBOR_CACHE = True
+    objs = sample_data()
+    django_recommend.rebuild.rebuild()
+    django_recommend.set_score('foo', objs[5], 0)
+    before = stored_keys()
+
+    with mock.patch('django_recommend.rebuild.similarities_changed') as (
+            changed):
+        django_recommend.rebuild.rebuild(shadow=True)
+
+    assert object_key(objs[5]) not in stored_keys()
+    changed.assert_called_once_with(before | stored_keys())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_generation_str():
+    """Generations show whether and when they finished."""
+    generation = SimilarityGeneration.objects.create()
+    assert '{}: unfinished'.format(generation.pk) == str(generation)
+
+    generation.finished = timezone.now()
+    assert '{}: {}'.format(generation.pk, generation.finished) == str(
+        generation)
+
+
+def test_both_slots_in_use():
+    """A live table with indexes in both slots can't take another set."""
+    connection = django.db.connection
+    columns = django_recommend.rebuild.indexed_columns(ObjectSimilarity)
+    names = {django_recommend.rebuild.index_name(connection, slot, index): {}
+             for slot in django_recommend.rebuild.INDEX_SLOTS
+             for index in columns}
+
+    with mock.patch.object(connection, 'cursor'), mock.patch.object(
+            connection.introspection, 'get_constraints', return_value=names):
+        with pytest.raises(ValueError):
+            django_recommend.rebuild.free_index_slot(connection)
+
+
+def test_postgresql_renames():
+    """On PostgreSQL, constraints and the sequence follow the live table."""
+    live_table = ObjectSimilarity._meta.db_table
+    table = live_table + '_g5'
+    connection = mock.MagicMock(vendor='postgresql')
+    connection.ops.quote_name = '"{}"'.format
+    connection.introspection.get_constraints.return_value = {
+        table + '_pkey': {'index': True, 'primary_key': True,
+                          'unique': False},
+        table + '_uniq': {'index': True, 'primary_key': False,
+                          'unique': True},
+        table + '_1234abcd': {'index': True, 'primary_key': False,
+                              'unique': False},
+        live_table + '_a_1234abcd': {'index': True, 'primary_key': False,
+                                     'unique': False},
+    }
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = ['"public"."{}_id_seq"'.format(table)]
+    editor = mock.Mock()
+
+    django_recommend.rebuild.rename_after_live_table(editor, connection,
+                                                     table)
+
+    statements = [sql.format(old=table, new=live_table) for sql in [
+        'ALTER TABLE "{new}" RENAME CONSTRAINT "{old}_pkey" TO "{new}_pkey"',
+        'ALTER TABLE "{new}" RENAME CONSTRAINT "{old}_uniq" TO "{new}_uniq"',
+        'ALTER INDEX "{old}_1234abcd" RENAME TO "{new}_1234abcd"',
+        'ALTER SEQUENCE "public"."{old}_id_seq" RENAME TO "{new}_id_seq"',
+    ]]
+    assert sorted(statements) == sorted(
+        args[0] for args, _ in editor.execute.call_args_list)
+
+
+def test_postgresql_only():
+    """Other databases don't name anything after the table."""
+    connection = mock.Mock(vendor='sqlite')
+    editor = mock.Mock()
+    django_recommend.rebuild.rename_after_live_table(editor, connection, 't')
+    assert not editor.execute.called
@@ -8,6 +8,7 @@ import pyrecommend.similarity
 import pytest
 from django.contrib.contenttypes import models as ct_models
 
+import django_recommend.models
 import django_recommend.storage
 import django_recommend.tasks
 import people.models
@@ -50,6 +51,20 @@ def test_autocalc(settings):
     assert args['obj_params'] == (quote.pk, quote_ctype.pk)
 
 
+@pytest.mark.django_db
+def test_autocalc_delete(settings):
+    """Deleting a score queues one update, after the row is gone."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    quote = quotes.models.Quote.objects.create(content='foobar')
+    quote_ctype = ct_models.ContentType.objects.get_for_model(quote)
+    django_recommend.set_score('foo', quote, 3)
+
+    with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+        django_recommend.models.UserScore.objects.all().delete()
+
+    schedule.assert_called_once_with((quote.pk, quote_ctype.pk))
+
+
 @pytest.mark.django_db
 def test_multiple_dbs():
     """update_similarity doesn't break with multiple DBs.
@@ -66,3 +81,89 @@ def test_multiple_dbs():
     args = tests.utils.get_call_args(
         pyrecommend.calculate_similarity, calc_sim.call_args)
     assert args['dataset'].obj == person
+
+
+@pytest.mark.django_db
+def test_buffered_results(settings):
+    """Buffered result storage ends with the same data as direct writes."""
+    quote = [tests.utils.make_quote('quote {}'.format(i)) for i in range(4)]
+    django_recommend.set_score('foo', quote[0], 1)
+    django_recommend.set_score('foo', quote[1], 2)
+    django_recommend.set_score('bar', quote[1], 3)
+    django_recommend.set_score('bar', quote[2], 4)
+    django_recommend.set_score('bar', quote[3], 5)
+    all_sims = django_recommend.models.ObjectSimilarity.objects.values_list(
+        'object_1_id', 'object_2_id', 'score')
+
+    settings.RECOMMEND_BUFFER_RESULTS = False
+    django_recommend.tasks.update_similarity(quote[1])
+    expected = set(all_sims)
+    django_recommend.models.ObjectSimilarity.objects.all().delete()
+
+    settings.RECOMMEND_BUFFER_RESULTS = True
+    django_recommend.tasks.update_similarity(quote[1])
+
+    assert len(expected) == 4
+    assert expected == set(all_sims)
+
+
+@pytest.mark.django_db
+def test_coalesce_window(settings):
+    """Changes within RECOMMEND_COALESCE_WINDOW queue a single update."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    settings.RECOMMEND_COALESCE_WINDOW = 30
+    quote = tests.utils.make_quote('foobar')
+    other_quote = tests.utils.make_quote('fizzbuzz')
+    params = (quote.pk, ct_models.ContentType.objects.get_for_model(quote).pk)
+
+    with mock.patch('django_recommend.tasks.update_similarity') as update_sim:
+        django_recommend.set_score('foo', quote, 3)
+        django_recommend.set_score('bar', quote, 4)
+        django_recommend.set_score('foo', quote, 5)
+        django_recommend.set_score('foo', other_quote, 1)
+
+    assert not update_sim.delay.called
+    assert 2 == update_sim.apply_async.call_count
+    assert (mock.call(args=(params,), countdown=30) ==
+            update_sim.apply_async.call_args_list[0])
+
+    # Once the queued update starts, new changes queue another update.
+    with mock.patch('pyrecommend.calculate_similarity'):
+        django_recommend.tasks.update_similarity(params)
+
+    with mock.patch('django_recommend.tasks.update_similarity') as update_sim:
+        django_recommend.set_score('bar', quote, 1)
+        django_recommend.set_score('foo', other_quote, 2)
+
+    assert [mock.call(args=(params,), countdown=30)] == (
+        update_sim.apply_async.call_args_list)
+
+
+def test_fallback_apply_async(monkeypatch):
+    """Without Celery, apply_async runs the task in a timer thread."""
+    shared_task = django_recommend.tasks.shared_task
+    if shared_task.__module__.startswith('celery'):  # pragma: no cover
+        pytest.skip('Celery is installed.')
+    monkeypatch.setattr(django_recommend.tasks, 'THREADED', True)
+
+    task = shared_task(mock.MagicMock())
+    with mock.patch('threading.Timer') as timer:
+        task.apply_async(args=('params',), countdown=10)
+
+    assert mock.call(10, mock.ANY, args=('params',)) == timer.call_args
+    assert timer.return_value.start.called
+
+
+def test_fallback_apply_async_unthreaded():
+    """Like delay, apply_async runs the task right away unless THREADED."""
+    shared_task = django_recommend.tasks.shared_task
+    if shared_task.__module__.startswith('celery'):  # pragma: no cover
+        pytest.skip('Celery is installed.')
+
+    func = mock.MagicMock()
+    task = shared_task(func)
+    with mock.patch('threading.Timer') as timer:
+        task.apply_async(args=('params',), countdown=10)
+
+    func.assert_called_once_with('params')
+    assert not timer.called
@@ -0,0 +1,264 @@
+# coding: utf-8
+"""Tests for the native upsert path of score and similarity writes."""
+# pylint: disable=redefined-outer-name,unused-argument
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import mock
+import pytest
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, IntegrityError
+from django.db.models import signals
+from django.test.utils import CaptureQueriesContext
+
+import django_recommend
+import django_recommend.upserts
+from django_recommend import memo
+from django_recommend.models import ObjectSimilarity, UserScore, object_key
+from django_recommend.upserts import can_upsert
+from tests.utils import make_quote
+
+
+pytestmark = pytest.mark.skipif(
+    connection.vendor == 'sqlite' and
+    connection.Database.sqlite_version_info < (3, 35),
+    reason='SQLite is too old for INSERT ... ON CONFLICT ... RETURNING.')
+
+
+@pytest.fixture
+def native(settings):
+    """Turn on native upserts."""
+    settings.RECOMMEND_NATIVE_UPSERT = True
+    return settings
+
+
+def statements(queries):
+    """Get the captured queries that aren't savepoints."""
+    return [query for query in queries
+            if 'SAVEPOINT' not in query['sql'].upper()]
+
+
+def stored_scores():
+    """Get all stored scores as (user, key, score) tuples."""
+    return sorted(UserScore.objects.values_list(
+        'user', 'object_content_type', 'object_id', 'score'))
+
+
+@pytest.mark.django_db
+def test_can_upsert(settings):
+    """Upserts are only used when turned on."""
+    assert not can_upsert('default')
+    settings.RECOMMEND_NATIVE_UPSERT = True
+    assert can_upsert('default')
+
+
+@pytest.mark.parametrize('vendor, version, expected', [
+    ('postgresql', 90500, True),
+    ('postgresql', 90400, False),
+    ('mysql', None, False),
+])
+def test_can_upsert_vendors(native, vendor, version, expected):
+    """Upserts need PostgreSQL 9.5, and other databases don't have them."""
+    fake = mock.Mock(vendor=vendor, pg_version=version)
+    with mock.patch('django_recommend.upserts.connections',
+                    {'default': fake}):
+        assert expected == can_upsert('default')
+
+
+def upsert_score(vendor, rows, update=True):
+    """Upsert a score on a connection to vendor that returns rows.
+
+    Returns upsert()'s result, and the statements that were run.
+
+    """
+    fetch = mock.Mock(side_effect=rows)
+    with mock.patch.object(connections['default'], 'vendor', vendor), (
+            mock.patch('django_recommend.upserts.fetch_row', fetch)):
+        result = django_recommend.upserts.upsert(
+            UserScore, 'default',
+            {'user': 'foo', 'object_id': 1, 'object_content_type': 2},
+            {'score': 3}, update=update)
+    return result, [args[1] for args, _ in fetch.call_args_list]
+
+
+@pytest.mark.parametrize('created', [True, False])
+def test_upsert_postgresql(created):
+    """PostgreSQL upserts are one statement, which says if it inserted."""
+    result, sqls = upsert_score('postgresql', [(7, created)])
+    assert (7, created) == result
+    assert 1 == len(sqls)
+    assert 'DO UPDATE SET' in sqls[0]
+    assert sqls[0].endswith('RETURNING "id", xmax = 0')
+
+
+def test_upsert_postgresql_existing():
+    """Leaving an existing row alone writes nothing."""
+    result, sqls = upsert_score('postgresql', [None], update=False)
+    assert (None, False) == result
+    assert 'DO NOTHING' in sqls[0]
+
+
+@pytest.mark.parametrize('retried, expected', [((5,), 5), (None, None)])
+def test_upsert_race(retried, expected):
+    """A row inserted between SQLite's update and insert is updated again."""
+    result, sqls = upsert_score('sqlite', [None, None, retried])
+    assert (expected, False) == result
+    assert ['UPDATE', 'INSERT', 'UPDATE'] == [sql.split()[0] for sql in sqls]
+    assert 'DO NOTHING' in sqls[1]
+
+
+@pytest.mark.django_db
+def test_set_score(native):
+    """Updating a score is one query, and inserting one at most two."""
+    quote = make_quote('foo')
+    django_recommend.set_score('foo', quote, 1)  # Caches the content type.
+
+    with CaptureQueriesContext(connection) as queries:
+        inst = UserScore.set('foo', quote, 3)
+    assert 1 == len(queries)
+    with CaptureQueriesContext(connection) as queries:
+        UserScore.set('bar', quote, 2)
+    assert (1 if connection.vendor == 'postgresql' else 2) == len(queries)
+
+    assert UserScore.objects.get(user='foo') == inst
+    assert 3 == inst.score
+    assert quote == inst.object
+    key = object_key(quote)
+    assert [('bar',) + key + (2,), ('foo',) + key + (3,)] == stored_scores()
+
+
+@pytest.mark.django_db
+def test_set_score_zero(native):
+    """A score of 0 is still deleted."""
+    quote = make_quote('foo')
+    UserScore.set('foo', quote, 3)
+
+    assert UserScore.set('foo', quote, 0) is None
+
+    assert not UserScore.objects.exists()
+
+
+@pytest.mark.django_db
+def test_set_score_invalid(native):
+    """Scores are still validated."""
+    quote = make_quote('foo')
+    with pytest.raises(ValidationError):
+        UserScore.set('x' * 1000, quote, 3)
+
+
+@pytest.mark.django_db
+def test_setdefault(native):
+    """setdefault() only writes scores that aren't stored yet."""
+    quote = make_quote('foo')
+    UserScore.set('foo', quote, 3)
+
+    UserScore.setdefault('foo', quote, 5)
+    UserScore.setdefault('bar', quote, 5)
+
+    key = object_key(quote)
+    assert [('bar',) + key + (5,), ('foo',) + key + (3,)] == stored_scores()
+
+
+@pytest.mark.django_db
+def test_signals(native, settings):
+    """Writes still queue updates and clear memoized scores."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    quote = make_quote('foo')
+    UserScore.set('bar', quote, 1)
+
+    with mock.patch('django_recommend.tasks.schedule_update') as schedule:
+        with memo.memoize_scores():
+            assert 0 == django_recommend.get_score('foo', quote)
+            UserScore.set('foo', quote, 3)
+            assert 3 == django_recommend.get_score('foo', quote)
+            UserScore.setdefault('bar', quote, 5)
+            UserScore.setdefault('baz', quote, 5)
+
+    expected = mock.call((quote.pk, object_key(quote)[0]))
+    assert [expected, expected] == schedule.call_args_list
+
+
+@pytest.mark.django_db
+def test_signals_created(native):
+    """post_save gets whether the score was inserted, as a bool."""
+    quote = make_quote('foo')
+    receiver = mock.Mock()
+    signals.post_save.connect(receiver, sender=UserScore)
+    try:
+        UserScore.set('foo', quote, 3)
+        UserScore.set('foo', quote, 4)
+        UserScore.setdefault('bar', quote, 5)
+        UserScore.setdefault('bar', quote, 6)
+    finally:
+        signals.post_save.disconnect(receiver, sender=UserScore)
+
+    created = [call[1]['created'] for call in receiver.call_args_list]
+    assert [True, False, True] == created
+
+
+@pytest.mark.django_db
+def test_incremental_falls_back(native, settings):
+    """Incremental mode needs the replaced score, so it skips upserts."""
+    settings.RECOMMEND_ENABLE_AUTOCALC = True
+    settings.RECOMMEND_INCREMENTAL = True
+    quotes = [make_quote('foo'), make_quote('bar')]
+    UserScore.set('foo', quotes[0], 2)
+    UserScore.set('foo', quotes[1], 3)
+
+    UserScore.set('foo', quotes[0], 4)
+
+    assert 12 == ObjectSimilarity.objects.get().score
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('layout', ['pairs', 'symmetric'])
+def test_set_similarity(native, layout):
+    """Similarities are written with one query per stored direction."""
+    native.RECOMMEND_SIMILARITY_LAYOUT = layout
+    quotes = [make_quote('foo'), make_quote('bar')]
+    ObjectSimilarity.set(quotes[0], quotes[1], 1)
+
+    with CaptureQueriesContext(connection) as queries:
+        sim = ObjectSimilarity.set(quotes[1], quotes[0], 4)
+
+    writes = len(statements(queries))
+    assert (1 if layout == 'pairs' else 2) == writes
+    assert ObjectSimilarity.objects.get(pk=sim.pk) == sim
+    assert [4] * writes == list(
+        ObjectSimilarity.objects.values_list('score', flat=True))
+    assert [quotes[1]] == list(django_recommend.similar_objects(quotes[0]))
+
+    ObjectSimilarity.set(quotes[0], quotes[1], 0)
+    assert not ObjectSimilarity.objects.exists()
+
+
+@pytest.mark.django_db
+def test_set_similarity_self(native):
+    """An object still can't be similar to itself."""
+    quote = make_quote('foo')
+    with pytest.raises(ValidationError):
+        ObjectSimilarity.set(quote, quote, 1)
+    assert not ObjectSimilarity.objects.exists()
+
+
+@pytest.mark.django_db
+def test_set_similarity_atomic(native):
+    """A failure storing one direction doesn't leave the other stored."""
+    native.RECOMMEND_SIMILARITY_LAYOUT = 'symmetric'
+    quotes = [make_quote('foo'), make_quote('bar')]
+    real_upsert = django_recommend.upserts.upsert
+    calls = []
+
+    def failing_upsert(*args, **kwargs):
+        """Write the first direction, and fail on the second."""
+        calls.append(args)
+        if len(calls) > 1:
+            raise IntegrityError('Failed.')
+        return real_upsert(*args, **kwargs)
+
+    with mock.patch('django_recommend.upserts.upsert', failing_upsert):
+        with pytest.raises(IntegrityError):
+            ObjectSimilarity.set(quotes[0], quotes[1], 4)
+
+    assert 2 == len(calls)
+    assert not ObjectSimilarity.objects.exists()
@@ -5,6 +5,12 @@ from __future__ import (absolute_import, division, print_function,
 
 import inspect
 
+import django.db
+from django.test.utils import CaptureQueriesContext
+
+import django_recommend
+import django_recommend.models
+import people.models
 import quotes.models
 
 
@@ -45,3 +51,30 @@ def make_quote(content, **kwargs):
     """Shorthand for invoking the Quote constructor."""
     kwargs['content'] = content
     return quotes.models.Quote.objects.create(**kwargs)
+
+
+def similarity_rows():
+    """Get all stored similarities as a set of tuples."""
+    return set(django_recommend.models.ObjectSimilarity.objects.values_list(
+        'object_1_content_type', 'object_1_id', 'object_2_content_type',
+        'object_2_id', 'score'))
+
+
+def sample_similarities():
+    """Store similarities between some quotes and a person."""
+    objs = [make_quote('quote {}'.format(i)) for i in range(4)]
+    objs.append(people.models.Person.objects.create(name='Ada'))
+    set_sim = django_recommend.models.ObjectSimilarity.set
+    set_sim(objs[0], objs[1], 3)
+    set_sim(objs[0], objs[2], 5.5)
+    set_sim(objs[1], objs[2], 1)
+    set_sim(objs[0], objs[4], 4)
+    set_sim(objs[2], objs[4], 2)
+    return objs
+
+
+def similar_objects_queries(obj):
+    """Get similar_objects(obj) and the SQL run to get it."""
+    with CaptureQueriesContext(django.db.connection) as queries:
+        result = django_recommend.similar_objects(obj)
+    return result, [query['sql'] for query in queries]